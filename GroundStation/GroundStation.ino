@@ -11,6 +11,11 @@ const int BAUD_RATE = 19200;
 
 long current_time = 0;
 
+// Packets the CubeSat may send ahead of the credits granted to it, set on both ends with the
+// creditwindow command. Half the window is granted each time that many additional packets
+// have been received, 0 disables credit flow control
+uint16_t credit_window = 0;
+
 // UART connection to transceiver
 // SoftwareSerial rfSerial(PIN_RX, PIN_TX);
 
@@ -33,6 +38,8 @@ class Zetaplus
     TIME = 5,
     PONG = 6,
     DEBUG = 7,
+    WOD_ROLLUP = 8,
+    TIME_SYNC = 9,
   };
   enum CommandType : uint8_t
   {
@@ -45,7 +52,13 @@ class Zetaplus
     SET_OPERATING_MODE = 7,
     CLEAR_STORAGE_DATA = 8,
     ACTIVATE_PAYLOAD_STRIKING_MECHANISM = 9,
-    PERFORM_SCIENCE_MEASUREMENT = 10
+    PERFORM_SCIENCE_MEASUREMENT = 10,
+    GRANT_DOWNLINK_CREDIT = 11,
+    REQUEST_RETRANSMIT = 12,
+    REQUEST_WOD_ROLLUP = 13,
+    TIME_SYNC = 14,
+    SET_FEC = 15,
+    SET_CREDIT_WINDOW = 16
   };
 
 public:
@@ -81,7 +94,41 @@ public:
       String input = Serial.readStringUntil('\n'); // Read the input until newline character
 
       // Check the received input and perform actions accordingly
-      if (input == "ping")
+      if (input.startsWith("raw "))
+      {
+        // A packet built on the PC, the hex encoded contents go after the target address
+        byte packet[64];
+        memset(packet, 0, 64);
+        memcpy(packet, TARGET_ADDRESS, 4);
+        int n_bytes = (input.length() - 4) / 2;
+        if (n_bytes > 60)
+        {
+          n_bytes = 60;
+        }
+        for (int i = 0; i < n_bytes; i++)
+        {
+          packet[4 + i] = (byte)strtol(input.substring(4 + 2 * i, 6 + 2 * i).c_str(), NULL, 16);
+        }
+        Serial.println("Sending raw packet");
+        Transmit(0, 64, packet);
+      }
+      else if (input.startsWith("creditwindow "))
+      {
+        credit_window = input.substring(13).toInt();
+        Serial.print("Credit window: ");
+        Serial.print(credit_window);
+        Serial.println(" packets");
+        SetCreditWindow(credit_window);
+      }
+      else if (input.startsWith("setchannel "))
+      {
+        // Receive on another channel, eg. as one of several ground stations receiving a striped downlink
+        int channel = input.substring(11).toInt();
+        Serial.print("Receiving on channel ");
+        Serial.println(channel);
+        ATR(channel, 64);
+      }
+      else if (input == "ping")
       {
         Serial.println("Sending Ping");
         SendPing();
@@ -129,7 +176,14 @@ public:
         short camera_number;
         int resume_packet;
         int packets_to_send;
-        sscanf(input.c_str(), "%s %ld %d %d %d", strBuffer, &timestamp, &camera_number, &resume_packet, &packets_to_send);
+        // Optional, 0 sends the image uncompressed
+        int compression = 0;
+        int compression_level = 0;
+        // Optional, 1 sends the image interlaced and passes limits how many passes are sent (0 for all)
+        int ordering = 0;
+        int passes = 0;
+        sscanf(input.c_str(), "%s %ld %d %d %d %d %d %d %d", strBuffer, &timestamp, &camera_number, &resume_packet, &packets_to_send,
+               &compression, &compression_level, &ordering, &passes);
         Serial.print("gettimage command, timestamp:");
         Serial.print(timestamp);
         Serial.print(", camera num: ");
@@ -138,7 +192,8 @@ public:
         Serial.print(resume_packet);
         Serial.print(", packets to send: ");
         Serial.println(packets_to_send);
-        RequestScienceImage(timestamp, camera_number, resume_packet, packets_to_send);
+        RequestScienceImage(timestamp, camera_number, resume_packet, packets_to_send, compression, compression_level,
+                            ordering, passes);
       }
       else if (input.indexOf("getsciencereading") != -1)
       {
@@ -271,6 +326,28 @@ public:
     }
   }
 
+  void GrantDownlinkCredit(uint16_t credits)
+  {
+    byte packet[64];
+    memset(packet, 0, 64);
+    memcpy(packet, TARGET_ADDRESS, 4);
+    packet[4] = MessageType::GROUND_STATION_COMMAND;
+    packet[5] = CommandType::GRANT_DOWNLINK_CREDIT;
+    memcpy(packet + 6, &credits, 2);
+    Transmit(0, 64, packet);
+  }
+
+  void SetCreditWindow(uint16_t window)
+  {
+    byte packet[64];
+    memset(packet, 0, 64);
+    memcpy(packet, TARGET_ADDRESS, 4);
+    packet[4] = MessageType::GROUND_STATION_COMMAND;
+    packet[5] = CommandType::SET_CREDIT_WINDOW;
+    memcpy(packet + 6, &window, 2);
+    Transmit(0, 64, packet);
+  }
+
   void RequestTime()
   {
     byte packet[64];
@@ -307,7 +384,11 @@ public:
   void RequestScienceImage(long timestamp,
                            short camera_number,
                            int resume_packet,
-                           int packets_to_send)
+                           int packets_to_send,
+                           uint8_t compression,
+                           uint8_t compression_level,
+                           uint8_t ordering,
+                           uint8_t passes)
   {
     byte packet[64];
     memset(packet, 0, 64);
@@ -316,8 +397,12 @@ public:
     packet[5] = CommandType::REQUEST_SCIENCE_IMAGE;
     memcpy(packet + 6, &camera_number, 1);
     memcpy(packet + 7, &resume_packet, 2);
-    memcpy(packet + 9, &resume_packet, 2);
+    memcpy(packet + 9, &packets_to_send, 2);
     memcpy(packet + 11, &timestamp, 4);
+    packet[15] = compression;
+    packet[16] = compression_level;
+    packet[17] = ordering;
+    packet[18] = passes;
     Transmit(0, 64, packet);
   }
 
@@ -474,6 +559,11 @@ public:
       Serial.println("Receiving SCIENCE IMAGE message");
       ProcessAdditionalPackets("Science Image");
     }
+    else if (msgType == MessageType::WOD_ROLLUP)
+    {
+      Serial.println("Receiving WOD ROLLUP message");
+      ProcessAdditionalPackets("WOD Rollup");
+    }
     else if (msgType == MessageType::SCIENCE_THERMO_AND_CURRENT)
     {
       Serial.println("Receiving SCIENCE THERMO AND CURRENT reading message");
@@ -533,6 +623,11 @@ public:
     {
       Serial.println("Received PONG message");
     }
+    else if (msgType == MessageType::TIME_SYNC)
+    {
+      // The PC works out the round trip time and clock offset from the packet printed above
+      Serial.println("Received TIME SYNC message");
+    }
     else if (msgType == MessageType::DEBUG)
     {
       Serial.println("Received DEBUG message");
@@ -569,6 +664,7 @@ public:
     // Add a 50ms timeout between additional datapackets. If this is exceeded then return
     unsigned long timeout = 1000;
     unsigned long time_since_last_packet = 0;
+    uint16_t packets_since_grant = 0;
     while (time_since_last_packet < timeout)
     {
       unsigned long start_time = millis();
@@ -611,6 +707,16 @@ public:
         // Serial.print(byte2);
         // Serial.print(msgType);
         PrintByteArray(data, 64);
+        if (credit_window > 0)
+        {
+          // Let the CubeSat send the next half window
+          uint16_t grant = max(credit_window / 2, 1);
+          if (++packets_since_grant >= grant)
+          {
+            GrantDownlinkCredit(grant);
+            packets_since_grant = 0;
+          }
+        }
         // Serial.print("Remaining packets: ");
         // Serial.print(remaining_packets);
         // Serial.print(", Message type: ");
@@ -1,6 +1,25 @@
+"""
+Prepares images for the CubeSat: 8-bit greyscale pixel data in a .bin file (width and height
+as unsigned ints, then one byte per pixel, row by row), see obc_image_store.py.
+
+Convert a whole directory, optionally at several square sizes in one pass, with:
+    python ImageDownscale.py <input image or directory> <output directory> [--sizes 32 64] [--workers N]
+Images are converted across a process pool. A content hash of every input converted is kept in
+the output directory, so running it again only converts images that have changed. Images that
+would write the same .bin file (eg. a.png and a.jpg) aren't converted, rename one of them.
+"""
+
+import argparse
+import hashlib
+import json
+import os
 import struct
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-import sys
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+# Kept in the output directory: input path -> content hash, sizes and the files written
+CACHE_FILE = '.downscale_cache.json'
 
 
 def convert_to_greyscale(image_path, output_path, size):
@@ -72,17 +91,7 @@ def save_greyscale_data_as_binary(image_path, output_path):
         with Image.open(image_path) as img:
             # Convert the image to greyscale (8-bit)
             grey_img = img.convert('L')
-            # Get the image dimensions
-            width, height = grey_img.size
-            # Get the pixel data
-            pixels = list(grey_img.getdata())
-
-            # Write the image dimensions and pixel data to a binary file
-            with open(output_path, 'wb') as file:
-                # Write the width and height as unsigned integers
-                file.write(struct.pack('II', width, height))
-                # Write the pixel data as unsigned bytes
-                file.write(struct.pack(f'{len(pixels)}B', *pixels))
+            write_greyscale_binary(grey_img, output_path)
 
             print(f"Greyscale pixel data successfully saved to {output_path}.")
     except Exception as e:
@@ -107,7 +116,7 @@ def read_greyscale_data_from_binary(input_path):
             width, height = struct.unpack('II', file.read(8))
             # Read the pixel data
             pixel_count = width * height
-            pixels = struct.unpack(f'{pixel_count}B', file.read(pixel_count))
+            pixels = file.read(pixel_count)
 
             print(f"Greyscale pixel data successfully read from {input_path}.")
             return width, height, list(pixels)
@@ -120,18 +129,142 @@ def read_greyscale_data_from_binary(input_path):
 # print(f"Width: {width}, Height: {height}, Number of pixels: {len(pixels)}")
 
 
+def write_greyscale_binary(grey_img, output_path):
+    """
+    Writes a greyscale (mode L) image as a .bin file. The pixels are written straight from
+    the image buffer. The file is written under another name then renamed, so an interrupted
+    batch never leaves a partial file behind.
+    """
+    width, height = grey_img.size
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        # Write the width and height as unsigned integers
+        file.write(struct.pack('II', width, height))
+        file.write(grey_img.tobytes())
+    os.replace(temp_path, output_path)
+
+
+def output_paths(image_path, output_dir, sizes):
+    """
+    The .bin files written for an image: <name>.bin at its own size, or <name>_<size>.bin
+    for each size
+    """
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    if not sizes:
+        return [os.path.join(output_dir, f"{name}.bin")]
+    return [os.path.join(output_dir, f"{name}_{size}.bin") for size in sizes]
+
+
+def convert_image(image_path, output_dir, sizes):
+    """
+    Converts an image to greyscale once and writes a .bin file for each size (see output_paths).
+    Returns the paths written
+    """
+    outputs = output_paths(image_path, output_dir, sizes)
+    with Image.open(image_path) as img:
+        grey_img = img.convert('L')
+    for size, output_path in zip(sizes or [None], outputs):
+        write_greyscale_binary(grey_img if size is None else grey_img.resize((size, size)), output_path)
+    return outputs
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_images(input_path):
+    if os.path.isfile(input_path):
+        return [input_path]
+    return sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                  if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(input_path, name)))
+
+
+def load_cache(output_dir):
+    try:
+        with open(os.path.join(output_dir, CACHE_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(output_dir, cache):
+    with open(os.path.join(output_dir, CACHE_FILE), 'w') as file:
+        json.dump(cache, file, indent=1, sort_keys=True)
+
+
+def convert_batch(input_path, output_dir, sizes=None, workers=None, force=False):
+    """
+    Converts an image, or every image in a directory, to .bin files in output_dir across a process pool.
+    Images whose contents, sizes and output files haven't changed since the last run are skipped.
+    Images whose output files collide with another image's fail, as either would overwrite the other.
+
+    Returns the number of images converted, skipped and failed
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sizes = sorted(set(sizes)) if sizes else []
+    cache = {} if force else load_cache(output_dir)
+    image_outputs = {os.path.abspath(image_path): output_paths(image_path, output_dir, sizes)
+                     for image_path in find_images(input_path)}
+    writers = {}
+    for key, outputs in image_outputs.items():
+        for output in outputs:
+            writers.setdefault(os.path.normcase(os.path.abspath(output)), []).append(key)
+    colliding = set()
+    for output, keys in writers.items():
+        if len(keys) > 1:
+            print(f"{', '.join(keys)} would all be written to {output}, rename all but one")
+            colliding.update(keys)
+
+    pending = {}
+    skipped = 0
+    for key, outputs in image_outputs.items():
+        if key in colliding:
+            cache.pop(key, None)
+            continue
+        entry = {'hash': file_hash(key), 'sizes': sizes, 'outputs': outputs}
+        if cache.get(key) == entry and all(os.path.isfile(output) for output in entry['outputs']):
+            skipped += 1
+        else:
+            pending[key] = entry
+
+    converted = 0
+    failed = len(colliding)
+    if pending:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = {key: pool.submit(convert_image, key, output_dir, sizes) for key in pending}
+            for key, future in futures.items():
+                try:
+                    outputs = future.result()
+                except Exception as e:
+                    print(f"An error occurred converting {key}: {e}")
+                    cache.pop(key, None)
+                    failed += 1
+                    continue
+                cache[key] = pending[key]
+                converted += 1
+                print(f"{key} -> {', '.join(outputs)}")
+    if pending or colliding:
+        save_cache(output_dir, cache)
+    print(f"{converted} images converted, {skipped} unchanged, {failed} failed")
+    return converted, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert images to greyscale .bin files for the CubeSat')
+    parser.add_argument('input', nargs='?', default='sample_img/nerd64.png',
+                        help='image, or directory of images, to convert')
+    parser.add_argument('output_dir', nargs='?', default='sample_img', help='directory to write the .bin files to')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='square sizes to resize to, each written as <name>_<size>.bin. By default the image keeps its size')
+    parser.add_argument('--workers', type=int, help='processes to convert with, by default one per CPU')
+    parser.add_argument('--force', action='store_true', help='convert every image even if it is unchanged')
+    args = parser.parse_args()
+    convert_batch(args.input, args.output_dir, args.sizes, args.workers, args.force)
+
+
 if __name__ == "__main__":
-    save_greyscale_data_as_binary(
-        "sample_img/nerd64.png", "sample_img/nerd64.bin")
-    # if len(sys.argv) != 4:
-    #     print(
-    #         "Usage: python ImageDownscale.py <input_image_path> <output_image_path> <size>")
-    # else:
-    #     input_image_path = sys.argv[1]
-    #     output_image_path = sys.argv[2]
-    #     size = int(sys.argv[3])
-    #     convert_to_greyscale(input_image_path, output_image_path, size)
-
-    #     # save_greyscale_data_as_text(input_image_path, output_image_path + '.txt')
-    #     save_greyscale_data_as_binary(
-    #         input_image_path, output_image_path + '.bin')
+    main()
@@ -3,16 +3,78 @@ For intercepting the serial communication of the arduino to the PC. This will al
 us to process the data and save to excel/image files as required
 '''
 
+import contextlib
+import copy
 import time
 import serial
 import threading
 import struct
 import csv
+import math
+from collections import namedtuple
 from datetime import datetime, timedelta
 from PIL import Image
+from ground_scheduler import PRIORITY_HIGH, CommandScheduler
+from image_codec import Compression, Ordering, decompress_image, render_interlaced
+from image_pipeline import ImagePipeline
+from link_timing import TIME_SYNC_REPLY, TIME_SYNC_REQUEST, LinkTiming, time_sync_sample, wall_clock
+from obc_comms import WOD_ROLLUP_REQUEST
+from obc_framing import INFO_PAYLOAD_LENGTH, PacketAssembler, encode_packet_selection, header_fec, is_parity_packet, packet_ranges
+from obc_wod_rollup import ROLLUP_BUCKET, ROLLUP_FIELDS, unpack_rollup
+from pass_planner import PassPlanner, image_product, rollup_product, wod_product
+from serial_capture import CaptureSerial, CaptureWriter
+from wod_dataset import WOD_BLOB, WodDataset, decode_wod
 
 COM_PORT = "COM3"
+# Ground stations receiving a striped downlink on further channels (see obc_multilink.py),
+# eg. [("COM4", 1), ("COM5", 2)]. Packets from every port are merged into the same product
+EXTRA_PORTS = []
 BAUD_RATE = 115200
+CAPTURE_DIR = "captures"
+
+# Message and command types, see MessageType and CommandType in the arduino script
+GROUND_STATION_COMMAND = 4
+REQUEST_RETRANSMIT = 12
+REQUEST_WOD_ROLLUP = 13
+TIME_SYNC = 14
+SET_FEC = 15
+RETRANSMIT_SELECTION_LENGTH = 55
+# uint32 time followed by 32 rows of 8 uint8 readings
+WOD_LENGTH = WOD_BLOB.itemsize
+
+# A science image being received. assembler holds the (compressed) image data received so far
+ReceivedImage = namedtuple('ReceivedImage', ['img_time', 'width', 'height', 'compression', 'level',
+                                             'ordering', 'pass_ends', 'data_length', 'assembler'])
+
+# Every WOD received is added to this
+wod_dataset = WodDataset()
+
+# Commands typed in are queued here and pipelined, see ground_scheduler.py. Set up by main
+command_scheduler = None
+# The pass plan being run and the packets/s it last measured, see pass_planner.py
+pass_planner = None
+pass_packets_per_second = 20.0
+
+# Ground station clock for time syncs, and the round trip times measured by pings and time syncs
+ground_clock = wall_clock()
+link_timing = LinkTiming()
+# Sequence number of the last time sync sent, and when the last ping was sent (time.monotonic)
+time_sync_sequence = 0
+ping_sent = None
+# Seconds between the time syncs sent by one timesync command
+TIME_SYNC_INTERVAL = 0.5
+
+# The last image from each camera, keyed by camera number. Retransmitted packets and further
+# passes of the same image are added to it rather than starting again
+received_images = {}
+# Number of ports still receiving each camera's image and the interlaced passes saved so far.
+# Held with received_images_lock, as a striped image arrives on several ports at once
+image_streams = {}
+image_passes_saved = {}
+received_images_lock = threading.RLock()
+# Decodes, saves and shows received images so the reader threads only read, see image_pipeline.py.
+# Started by main, until then images are processed on the reader thread
+image_pipeline = ImagePipeline()
 
 # Function to continuously read data from serial port
 
@@ -22,13 +84,40 @@ def serial_read(serial_port):
         # data = serial_port.readline().decode().strip()
         data = serial_port.readline()
         if data:
-            if "New Received" in data.decode(errors="ignore").strip():
-                # Next line contains a new command data
-                data_contents = serial_port.readline()
-                process_header_data_contents(serial_port, data_contents)
-            print(f'Arduino: {data.decode(errors="ignore").strip()}')
-
-# Function to continuously send data to serial port
+            process_line(serial_port, data)
+
+
+def process_line(serial_port, data, show_images=True) -> int:
+    # Process one line of arduino output. Returns 1 if it started a new received packet
+    received = "New Received" in data.decode(errors="ignore").strip()
+    if received:
+        # Next line contains a new command data
+        data_contents = read_packet_contents(serial_port, data)
+        # Only the port commands are sent from answers them, other ports receive striped downlinks
+        scheduler = command_scheduler if command_scheduler is not None and command_scheduler.serial_port is serial_port else None
+        with scheduler.receiving() if scheduler else contextlib.nullcontext():
+            process_header_data_contents(serial_port, data_contents, show_images)
+        if scheduler and len(data_contents) > 4:
+            scheduler.response_received(data_contents[4], data_contents[4:])
+    print(f'Arduino: {data.decode(errors="ignore").strip()}')
+    return int(received)
+
+
+def read_packet_contents(serial_port, received_line: bytes) -> bytes:
+    '''
+    Read the packet printed after a "New Received - length:N, ..." line. The packet is
+    read by its length, as its contents may contain a newline
+    '''
+    try:
+        length = int(received_line.split(b'length:')[1].split(b',')[0])
+    except (IndexError, ValueError):
+        return serial_port.readline()
+    data = serial_port.read(length)
+    # The line ending after the packet
+    serial_port.readline()
+    return data
+
+# Function to continuously send data to serial port, or queue it on a CommandScheduler
 
 
 def serial_write(serial_port: serial.Serial):
@@ -47,12 +136,28 @@ def serial_write(serial_port: serial.Serial):
             else:
                 print("Invalid gettime command")
                 continue
-            # print(f'timestamp is: {timestamp}')
-            serial_port.write("settime ".encode())
-            serial_port.write(str(timestamp).encode())
-            serial_port.write(b'\n')
+            serial_port.write(f'settime {timestamp}\n'.encode())
         elif "getimage" in message:
             args = message.split()
+            # Optional compression, eg. compress=zlib:9, compress=rle or compress=lzma
+            compression, level = Compression.RAW, 0
+            # Optional progressive downlink, eg. progressive (all passes) or progressive=1 (thumbnail only)
+            ordering, passes = Ordering.ROW_MAJOR, 0
+            for arg in [a for a in args if a.startswith("progressive")]:
+                args.remove(arg)
+                ordering = Ordering.INTERLACED
+                _, _, passes = arg.partition("=")
+                passes = int(passes) if passes.isdigit() else 0
+            for arg in [a for a in args if a.startswith("compress=")]:
+                args.remove(arg)
+                try:
+                    compression, level = parse_compression(arg[len("compress="):])
+                except ValueError:
+                    print(
+                        "Compression should be raw, rle, zlib[:level] or lzma[:level]")
+                    compression = None
+            if compression is None:
+                continue
             # If we are given 4 arguments, then use live timestamp
             # Otherwise use the given timestamp
             if len(args) == 4:
@@ -80,7 +185,15 @@ def serial_write(serial_port: serial.Serial):
             print(f'{camera}: {camera_num}')
 
             serial_port.write(
-                f'getimg 0 {camera_num} {resume_packet_number} {packets_to_send}\n'.encode())
+                f'getimg 0 {camera_num} {resume_packet_number} {packets_to_send} {compression.value} {level} {ordering.value} {passes}\n'.encode())
+        elif "moredetail" in message:
+            # moredetail <left|right> [passes to add, default 1]
+            args = message.split()
+            if len(args) not in (2, 3) or args[1] not in ('left', 'right') or (len(args) == 3 and not args[2].isdigit()):
+                print("Incorrect moredetail args provided. Usage: moredetail <left|right> [passes]")
+                continue
+            request_more_detail(serial_port, 0 if args[1] == 'left' else 1,
+                                int(args[2]) if len(args) == 3 else 1)
         elif "getsciencereading" in message:
             args = message.split()
             if len(args) == 1:
@@ -106,6 +219,78 @@ def serial_write(serial_port: serial.Serial):
                 serial_port.write(f'setmode {mode}\n'.encode())
             else:
                 print("Incorrect setmode command")
+        elif "wodrollup" in message:
+            # wodrollup <1m|10m|1h> [number of windows, default 24]
+            args = message.split()
+            windows = {'1m': 60, '10m': 600, '1h': 3600}
+            if len(args) not in (2, 3) or args[1] not in windows or (len(args) == 3 and not args[2].isdigit()):
+                print("Incorrect wodrollup args provided. Usage: wodrollup <1m|10m|1h> [number of windows]")
+                continue
+            n_windows = min(int(args[2]) if len(args) == 3 else 24, 255)
+            send_raw_command(serial_port, struct.pack('<BB', GROUND_STATION_COMMAND, REQUEST_WOD_ROLLUP)
+                             + WOD_ROLLUP_REQUEST.pack(windows[args[1]], n_windows))
+        elif "resend" in message:
+            # resend <wod|left|right|rollup> <packet indices, eg. 0 4 10-20>
+            args = message.split()
+            if len(args) < 3 or args[1] not in ('wod', 'left', 'right', 'rollup'):
+                print("Incorrect resend args provided. Usage: resend <wod|left|right|rollup> <packets, eg. 0 4 10-20>")
+                continue
+            msg_type = {'wod': 1, 'rollup': 8}.get(args[1], 2)
+            camera_num = 1 if args[1] == 'right' else 0
+            try:
+                indices = parse_packet_indices(args[2:])
+            except ValueError:
+                print("Packet indices should be numbers or ranges like 10-20")
+                continue
+            request_retransmit(serial_port, msg_type, camera_num, indices)
+        elif "fec" in message:
+            # fec <block packets> <parity packets> or fec off
+            args = message.split()
+            if args[1:] == ['off']:
+                args = ['fec', '0', '0']
+            if len(args) != 3 or not all(arg.isdigit() and int(arg) < 256 for arg in args[1:]) or int(args[2]) > int(args[1]):
+                print("Incorrect fec args provided. Usage: fec <block packets> <parity packets, at most the block> or fec off")
+                continue
+            set_fec(serial_port, int(args[1]), int(args[2]))
+        elif "creditwindow" in message:
+            # creditwindow <packets>, 0 turns credit flow control off. The arduino keeps the window
+            # to grant credits by and passes it on to the CubeSat
+            args = message.split()
+            if len(args) != 2 or not args[1].isdigit() or int(args[1]) > 0xFFFF:
+                print("Incorrect creditwindow args provided. Usage: creditwindow <packets, 0 for off>")
+                continue
+            serial_port.write(f'creditwindow {int(args[1])}\n'.encode())
+        elif message == "ping":
+            send_ping(serial_port)
+        elif "timesync" in message:
+            # timesync [number of exchanges, default 4]
+            args = message.split()
+            if len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+                print("Incorrect timesync args provided. Usage: timesync [number of exchanges]")
+                continue
+            send_time_syncs(serial_port, int(args[1]) if len(args) == 2 else 4)
+        elif "linkstats" in message:
+            print_link_timing()
+        elif message == "imagestats":
+            image_pipeline.print_stats()
+        elif message == "pending":
+            print_pending_requests()
+        elif "passplan" in message:
+            # passplan <seconds left in the pass> <product[@value]>... or passplan stop
+            # Products: wod, rollup:<1m|10m|1h>:<windows>, left[:passes], right[:passes]
+            args = message.split()
+            if args[1:] == ['stop']:
+                if pass_planner is not None:
+                    pass_planner.stop()
+                continue
+            try:
+                products = parse_pass_products(args[2:])
+                seconds = float(args[1])
+            except (ValueError, IndexError):
+                print("Incorrect passplan args provided. Usage: passplan <seconds> <product[@value]>..., "
+                      "products: wod, rollup:<1m|10m|1h>:<windows>, left[:passes], right[:passes]")
+                continue
+            start_pass_plan(serial_port, products, seconds)
         elif "clearstorage" in message:
             serial_port.write("clearstorage\n".encode())
         elif "payloadstrike" in message:
@@ -113,10 +298,215 @@ def serial_write(serial_port: serial.Serial):
         elif "sciencemeasurement" in message:
             serial_port.write("sciencemeasurement\n".encode())
         else:
-            serial_port.write(message.encode())
+            serial_port.write(f'{message}\n'.encode())
 
 
-def process_header_data_contents(serial_port: serial.Serial, data):
+def parse_packet_indices(args) -> list:
+    # Each argument is a packet index or an inclusive range such as 10-20
+    indices = []
+    for arg in args:
+        if '-' in arg:
+            first, last = map(int, arg.split('-'))
+            indices.extend(range(first, last + 1))
+        else:
+            indices.append(int(arg))
+    return indices
+
+
+def parse_compression(option: str) -> tuple:
+    # eg. 'zlib:9' -> (Compression.ZLIB, 9). Level 0 lets the CubeSat pick
+    names = {'raw': Compression.RAW, 'rle': Compression.DELTA_RLE,
+             'zlib': Compression.ZLIB, 'lzma': Compression.LZMA}
+    name, _, level = option.partition(':')
+    if name not in names:
+        raise ValueError(f"Unknown compression {name}")
+    return names[name], int(level) if level else 0
+
+
+def raw_command(contents: bytes) -> bytes:
+    # The arduino transmits the contents straight after the target address
+    return f'raw {contents.hex()}\n'.encode()
+
+
+def send_raw_command(serial_port: serial.Serial, contents: bytes):
+    serial_port.write(raw_command(contents))
+
+
+def send_command(serial_port, command, priority=None):
+    '''
+    Write a command line, or queue it if serial_port is a CommandScheduler.
+    command may be a function building the line, called just before it is sent
+    '''
+    if isinstance(serial_port, CommandScheduler):
+        return serial_port.submit(command, priority)
+    serial_port.write(command() if callable(command) else command)
+
+
+def parse_pass_products(args) -> list:
+    # eg. ['left:4@10', 'wod@5', 'rollup:1h:24@2'] -> pass_planner Products
+    windows = {'1m': 60, '10m': 600, '1h': 3600}
+    products = []
+    for arg in args:
+        spec, _, value = arg.partition('@')
+        value = float(value) if value else 1.0
+        name, *options = spec.split(':')
+        if name == 'wod' and not options:
+            products.append(wod_product(value))
+        elif name == 'rollup' and len(options) == 2 and options[0] in windows:
+            products.append(rollup_product(windows[options[0]], min(int(options[1]), 255), value))
+        elif name in ('left', 'right') and len(options) <= 1:
+            passes = int(options[0]) if options else 4
+            if not 1 <= passes <= 4:
+                raise ValueError(f"{name} passes should be 1 to 4")
+            products.append(image_product(0 if name == 'left' else 1, passes, value))
+        else:
+            raise ValueError(f"Unknown product {arg}")
+    if not products:
+        raise ValueError("No products")
+    return products
+
+
+def start_pass_plan(serial_port, products, seconds: float):
+    '''Run a pass plan in the background, typed commands are still sent alongside it'''
+    global pass_planner
+    if not isinstance(serial_port, CommandScheduler):
+        print("Pass plans need the command scheduler")
+        return
+    if pass_planner is not None and not pass_planner.stopped:
+        print("A pass plan is already running, use passplan stop first")
+        return
+    round_trip = link_timing.percentile(50)
+    pass_planner = PassPlanner(serial_port, products, seconds, pass_packets_per_second,
+                               round_trip if round_trip is not None else 0.2)
+
+    def run(planner):
+        global pass_packets_per_second
+        try:
+            stats = planner.run()
+        finally:
+            # Even if the plan failed, so the next passplan isn't refused
+            planner.stopped = True
+        # Start the next pass from what this one measured
+        pass_packets_per_second = stats.packets_per_second
+    threading.Thread(target=run, args=(pass_planner,), daemon=True).start()
+
+
+def print_pending_requests():
+    if command_scheduler is None:
+        return
+    queued, outstanding = command_scheduler.pending()
+    print(f'--- {len(queued)} queued, {len(outstanding)} waiting for a response ---')
+    for request in outstanding:
+        print(f'waiting {time.monotonic() - request.sent_time:.1f}s: {request.name()}')
+    for request in queued:
+        print(f'queued (priority {request.priority}): {request.name()}')
+
+
+def send_ping(serial_port: serial.Serial):
+    # Timed from when it is actually sent, it may be queued
+    def ping():
+        global ping_sent
+        ping_sent = time.monotonic()
+        return b'ping\n'
+    return send_command(serial_port, ping, PRIORITY_HIGH)
+
+
+def send_time_syncs(serial_port: serial.Serial, count: int):
+    '''Send time syncs with this computer's time, the CubeSat replies are handled by process_time_sync'''
+    def time_sync():
+        global time_sync_sequence
+        time_sync_sequence = (time_sync_sequence + 1) & 0xFFFF
+        return raw_command(struct.pack('<BB', GROUND_STATION_COMMAND, TIME_SYNC)
+                           + TIME_SYNC_REQUEST.pack(time_sync_sequence, ground_clock.now()))
+    for i in range(count):
+        if i:
+            time.sleep(TIME_SYNC_INTERVAL)
+        send_command(serial_port, time_sync, PRIORITY_HIGH)
+
+
+def process_pong():
+    global ping_sent
+    if ping_sent is None:
+        print("Pong received!")
+        return
+    rtt = time.monotonic() - ping_sent
+    ping_sent = None
+    link_timing.add_rtt(rtt)
+    print(f"Pong received! Round trip {rtt * 1000:.1f}ms")
+
+
+def process_time_sync(data) -> tuple:
+    # data is the header packet after the callsign. Returns the sequence number and the TimeSyncSample
+    received = ground_clock.now()
+    _, sequence, sent, cubesat_received, cubesat_sent = TIME_SYNC_REPLY.unpack_from(data)
+    sample = time_sync_sample(sent, cubesat_received, cubesat_sent, received)
+    link_timing.add_sync(sample)
+    print(f'Time sync {sequence}: round trip {sample.rtt * 1000:.1f}ms, CubeSat clock offset {sample.offset:+.3f}s')
+    return sequence, sample
+
+
+def print_link_timing():
+    summary = link_timing.summary()
+    print('--- Link timing ---')
+    if not summary.samples:
+        print("No round trip times measured yet, use ping or timesync")
+    else:
+        print(f'{summary.samples} round trips, min {summary.min * 1000:.1f}ms, p50 {summary.p50 * 1000:.1f}ms, '
+              f'p90 {summary.p90 * 1000:.1f}ms, p99 {summary.p99 * 1000:.1f}ms, max {summary.max * 1000:.1f}ms')
+        print(f'Suggested reply timeout: {link_timing.suggested_timeout():.2f}s')
+    if summary.offset is not None:
+        print(f'CubeSat clock offset: {summary.offset:+.3f}s '
+              f'(CubeSat time now {parse_seconds_to_datetime(int(ground_clock.now() + summary.offset))})')
+    print('-------------------')
+
+
+def request_more_detail(serial_port: serial.Serial, camera_num: int, extra_passes: int = 1):
+    '''
+    Ask for the next passes of the last progressive image from a camera, starting
+    from the first packet that hasn't been received
+    '''
+    image = received_images.get(camera_num)
+    if image is None or image.ordering != Ordering.INTERLACED:
+        print("No progressive image received from that camera yet, use getimage ... progressive")
+        return
+    resume_packet = image.assembler.next_missing
+    passes_received = sum(resume_packet >= end for end in image.pass_ends)
+    if passes_received == len(image.pass_ends):
+        print("The full resolution image has already been received")
+        return
+    passes = min(passes_received + extra_passes, len(image.pass_ends))
+    print(f'Requesting up to pass {passes} from packet {resume_packet}')
+    serial_port.write(
+        f'getimg {image.img_time} {camera_num} {resume_packet} 0 {image.compression.value} {image.level} {Ordering.INTERLACED.value} {passes}\n'.encode())
+
+
+def set_fec(serial_port: serial.Serial, block_packets: int, parity_packets: int):
+    '''
+    Ask the CubeSat to send parity_packets parity packets after every block_packets information
+    packets, so lost packets are rebuilt without a retransmit request. 0 parity packets turns it off.
+    Each product's header packet says how its parity packets were sent, see obc_framing.header_fec
+    '''
+    send_raw_command(serial_port, struct.pack('<BBBB', GROUND_STATION_COMMAND, SET_FEC, block_packets, parity_packets))
+
+
+def request_retransmit(serial_port: serial.Serial, msg_type: int, camera_num: int, indices):
+    '''
+    Ask the CubeSat to resend only the given packet indices (0 is the first packet)
+    of the last product it sent for msg_type. Any indices that don't fit in one
+    request are sent in further requests
+    '''
+    indices = sorted(set(indices))
+    while indices:
+        mode, selection, encoded = encode_packet_selection(
+            indices, RETRANSMIT_SELECTION_LENGTH)
+        print(f'Requesting {len(encoded)} packets again')
+        send_raw_command(serial_port, struct.pack(
+            '<BBBbB', GROUND_STATION_COMMAND, REQUEST_RETRANSMIT, msg_type, camera_num, mode) + selection)
+        encoded = set(encoded)
+        indices = [i for i in indices if i not in encoded]
+
+
+def process_header_data_contents(serial_port: serial.Serial, data, show_images=True):
     # first 4 bytes are the USYD callsign which has already been verified by the arduino
     # skip these 4 bytes
     data = data[4:]
@@ -127,27 +517,21 @@ def process_header_data_contents(serial_port: serial.Serial, data):
     # Process accordingly to the message type (defined by MessageType enum in the arduino script)
     if msg_type == 1:
         print("message type is wod")
-        wod_bytes = process_wod_content_stream(serial_port)
+        wod_bytes = process_wod_content_stream(serial_port, header_fec(data))
         process_wod(wod_bytes)
 
     elif msg_type == 2:
         # SCIENCE_IMAGE
         print("Science image received")
-        # Process the header data
-        camera_number = struct.unpack("<B", data[1:2])[0]
-        img_width, img_height = struct.unpack("<hh", data[2:6])
-        img_time = struct.unpack("<I", data[6:10])[0]
-        start_packet_number = struct.unpack("<h", data[10:12])[0]
-        print(f'camera number: {camera_number}, img dimensions: {img_width}x{img_height}, time_taken: {parse_seconds_to_datetime(img_time)}, start packet number: {start_packet_number}')
-
-        # Now process the information packets
-        image_bytes = process_image_content_stream(serial_port)
-        print(f'len bytes: {len(image_bytes)}')
-        # There may be some excess bytes in the final packet, be sure to ignore those
-        image_bytes = image_bytes[:img_width*img_height]
-        image = reconstructImage(image_bytes, img_width, img_height)
-        save_and_display_image(
-            image, f"images/{img_time}_{'left' if camera_number == 0 else 'right'}")
+        camera_number, img_time, image = receive_science_image(
+            serial_port, data)
+        if image is not None:
+            file_name = f"images/{img_time}_{'left' if camera_number == 0 else 'right'}"
+            stages = [('decode', decode_science_image),
+                      ('save', lambda decoded: save_image(decoded, file_name))]
+            if show_images:
+                stages.append(('display', lambda decoded: decoded.show()))
+            image_pipeline.submit(file_name, image, stages)
 
     elif msg_type == 3:
         # SCIENCE_THERMO_AND_CURRENT
@@ -164,58 +548,181 @@ def process_header_data_contents(serial_port: serial.Serial, data):
         pass
     elif msg_type == 6:
         # PONG
-        print("Pong received!")
-        pass
+        process_pong()
+    elif msg_type == 9:
+        # TIME_SYNC
+        process_time_sync(data)
+    elif msg_type == 8:
+        # WOD_ROLLUP
+        window_seconds, n_buckets = struct.unpack("<HH", data[1:5])
+        print(f"WOD rollup received, {n_buckets} windows of {window_seconds}s")
+        assembler = PacketAssembler(
+            math.ceil(n_buckets * ROLLUP_BUCKET.size / INFO_PAYLOAD_LENGTH), INFO_PAYLOAD_LENGTH, header_fec(data))
+        read_packet_stream(serial_port, "WOD Rollup", assembler)
+        report_missing_packets(assembler, 'rollup')
+        process_wod_rollup(unpack_rollup(assembler.data, n_buckets), window_seconds)
     else:
         print("Invalid message type received, ignoring the rest of the packet.")
 
 
-def process_wod_content_stream(serial_port: serial.Serial) -> bytes:
-    wod_bytes = b''
-
-    data = serial_port.readline()  # This is an additional print in the arduino
+def receive_science_image(serial_port: serial.Serial, data):
+    '''
+    Decode a science image header (data is the header packet after the callsign) and
+    read the information packets that follow.
+    Returns the camera number, the time the image was taken and a snapshot of the received
+    image to decode (see decode_science_image), or None if another port is still receiving it
+    '''
+    # Process the header data
+    camera_number = struct.unpack("<B", data[1:2])[0]
+    img_width, img_height = struct.unpack("<hh", data[2:6])
+    img_time = struct.unpack("<I", data[6:10])[0]
+    start_packet_number = struct.unpack("<h", data[10:12])[0]
+    # Compression mode and length of the compressed data. Senders that don't compress leave these as 0
+    compression, data_length = struct.unpack("<BI", data[12:17])
+    # Compression level, pixel ordering and for interlaced images the number of packets up to the end of each pass
+    level, ordering, n_passes = struct.unpack("<BBB", data[17:20])
+    pass_ends = struct.unpack("<4H", data[20:28])[:n_passes]
+    print(f'camera number: {camera_number}, img dimensions: {img_width}x{img_height}, time_taken: {parse_seconds_to_datetime(img_time)}, start packet number: {start_packet_number}')
+
+    header = ReceivedImage(img_time, img_width, img_height, Compression(compression), level, Ordering(ordering),
+                           pass_ends, data_length or img_width * img_height, None)
+    # How the parity packets that follow are sent, if at all
+    fec = header_fec(data)
+    with received_images_lock:
+        previous = received_images.get(camera_number)
+        if previous is not None and previous._replace(assembler=None) == header and (
+                not previous.assembler.complete() or image_streams.get(camera_number)):
+            # More packets of an image already partly received, eg. a retransmission, the next pass
+            # or the image being striped over another port
+            image = previous
+            image.assembler.set_fec(fec)
+        else:
+            image = header._replace(assembler=PacketAssembler(
+                math.ceil(header.data_length / INFO_PAYLOAD_LENGTH), INFO_PAYLOAD_LENGTH, fec))
+            image_passes_saved[camera_number] = 0
+        received_images[camera_number] = image
+        image_streams[camera_number] = image_streams.get(camera_number, 0) + 1
+    camera = 'left' if camera_number == 0 else 'right'
+
+    # Save each pass of an interlaced image as soon as all of its packets have arrived
+    def save_passes(assembler, index):
+        passes_saved = image_passes_saved[camera_number]
+        while passes_saved < len(pass_ends) and assembler.next_missing >= pass_ends[passes_saved]:
+            passes_saved += 1
+            image_passes_saved[camera_number] = passes_saved
+            file_name = f"images/{img_time}_{camera}_pass{passes_saved}.png"
+            # Later passes show more, so a pass can be dropped if the pipeline is behind
+            image_pipeline.submit(file_name, snapshot_image(image), [
+                ('decode', decode_science_image),
+                ('save', lambda decoded, file_name=file_name: decoded.save(file_name))], droppable=True)
+            print(
+                f'Pass {passes_saved}/{len(pass_ends)} received, saving to {file_name}')
+
+    on_packet = save_passes if image.ordering == Ordering.INTERLACED else None
+
+    # Now process the information packets
+    read_packet_stream(serial_port, "Science Image",
+                       image.assembler, on_packet, received_images_lock)
+    with received_images_lock:
+        image_streams[camera_number] -= 1
+        if image_streams[camera_number]:
+            # The last port to finish decodes the image
+            print(f'Finished this port, the {camera} image is still being received on another')
+            return camera_number, img_time, None
+    report_missing_packets(image.assembler, camera)
+    return camera_number, img_time, snapshot_image(image)
+
+
+def snapshot_image(image: ReceivedImage) -> ReceivedImage:
+    '''A copy of the image that later packets (eg. retransmissions) don't change, to decode on another thread'''
+    assembler = copy.copy(image.assembler)
+    assembler.data = bytes(assembler.data)
+    assembler.bitmap = bytes(assembler.bitmap)
+    return image._replace(assembler=assembler)
+
+
+def decode_science_image(image: ReceivedImage):
+    '''The image from the packets received so far. Missing pixels are left black'''
+    assembler = image.assembler
+    if image.compression == Compression.RAW and image.ordering == Ordering.ROW_MAJOR:
+        pixels = assembler.data
+    else:
+        # Compressed or interlaced data can only be decoded up to the first missing packet
+        contents = assembler.data[:min(
+            assembler.contiguous_length(), image.data_length)]
+        if image.compression != Compression.RAW:
+            print(
+                f'Decompressing {len(contents)} bytes ({image.compression.name})')
+        pixels = decompress_image(
+            contents, image.width, image.height, image.compression)
+        if image.ordering == Ordering.INTERLACED:
+            pixels = render_interlaced(pixels, image.width, image.height)
+    # There may be some excess bytes in the final packet, be sure to ignore those
+    return reconstructImage(pixels[:image.width * image.height], image.width, image.height)
+
+
+def read_packet_stream(serial_port: serial.Serial, name: str, assembler: PacketAssembler, on_packet=None,
+                       lock=None):
+    '''
+    Read the information packets the arduino prints between <name> and <name/> into assembler.
+    on_packet is called with the assembler and the packet index after each packet, eg. to show a partial image
+    lock is held while each packet is added, for a product being received on several ports at once
+    '''
+    lock = lock or contextlib.nullcontext()
+    serial_port.readline()  # This is an additional print in the arduino
     data = serial_port.readline()
-    if data.decode().strip() == "<WOD Message>":
-        data = serial_port.read(64)
-        wod_bytes += data[3:]
-        while True:
-            # First 2 bytes are the packets remaining
-            packets_remaining = struct.unpack("<H", data[:2])[0]
-            print(f'wod data: {data}')
-            print(f'packets remaining: {packets_remaining}')
-            if packets_remaining == 0:
-                data = serial_port.readline()
-            else:
-                data = serial_port.read(64)
-            if len(data) < 64 or data.decode(errors='ignore').strip() == "<WOD Message/>":
-                break
-            wod_bytes += data[3:]
-    print("Finished reading all wod bytes")
-    return wod_bytes
+    if data.decode(errors='ignore').strip() != f"<{name}>":
+        return
+    while True:
+        # The packets end with a new line then the closing tag, or an error from the arduino.
+        # Check the start of each packet so the read never waits for bytes that won't come
+        data = serial_port.read(2)
+        if data in (b'\r\n', b'In'):
+            serial_port.readline()
+            break
+        data += serial_port.read(62)
+        if len(data) < 64:
+            break
+        if is_parity_packet(data):
+            with lock:
+                rebuilt = assembler.add_parity(data)
+                for index in rebuilt or []:
+                    if on_packet:
+                        on_packet(assembler, index)
+            if rebuilt is None:
+                print(f'{name} parity packet does not belong to this product: {data}')
+            for index in rebuilt or []:
+                print(f'{name} packet {index} rebuilt from parity')
+            continue
+        with lock:
+            index = assembler.add(data)
+            if index is not None and on_packet:
+                on_packet(assembler, index)
+        if index is None:
+            print(f'{name} packet does not belong to this product: {data}')
+            continue
+        print(f'{name} packet {index}, packets remaining: {assembler.n_packets - index - 1}')
+    rebuilt = f" ({assembler.packets_rebuilt} rebuilt from parity)" if assembler.packets_rebuilt else ""
+    print(
+        f"Finished reading {name}, {assembler.packets_received}/{assembler.n_packets} packets received{rebuilt}")
 
 
-def process_image_content_stream(serial_port: serial.Serial) -> bytes:
-    image_bytes = b''
+def report_missing_packets(assembler: PacketAssembler, resend_target: str):
+    missing = assembler.missing()
+    if not missing:
+        return
+    ranges = ' '.join(str(first) if count == 1 else f'{first}-{first + count - 1}'
+                      for first, count in packet_ranges(missing))
+    print(f'Missing {len(missing)} of {assembler.n_packets} packets. To request them again: resend {resend_target} {ranges}')
 
-    data = serial_port.readline()  # This is an additional print in the arduino
-    data = serial_port.readline()
-    if data.decode().strip() == "<Science Image>":
-        data = serial_port.read(64)
-        image_bytes += data[3:]
-        while True:
-            # First 2 bytes are the packets remaining
-            packets_remaining = struct.unpack("<H", data[:2])[0]
-            print(f'image data: {data}')
-            print(f'packets remaining: {packets_remaining}')
-            if packets_remaining == 0:
-                data = serial_port.readline()
-            else:
-                data = serial_port.read(64)
-            if len(data) < 64 or data.decode(errors='ignore').strip() == "<Science Image/>":
-                break
-            image_bytes += data[3:]
-    print("Finished reading all image bytes")
-    return image_bytes
+
+def process_wod_content_stream(serial_port: serial.Serial, fec=None) -> bytes:
+    # fec: the FecParameters from the WOD header packet
+    assembler = PacketAssembler(
+        math.ceil(WOD_LENGTH / INFO_PAYLOAD_LENGTH), INFO_PAYLOAD_LENGTH, fec)
+    read_packet_stream(serial_port, "WOD Message", assembler)
+    report_missing_packets(assembler, 'wod')
+    return bytes(assembler.data)
 
 
 def reconstructImage(bytes: bytes, width: int, height: int):
@@ -226,55 +733,34 @@ def reconstructImage(bytes: bytes, width: int, height: int):
     return image
 
 
-def save_and_display_image(image, file_name):
+def save_image(image, file_name):
     # Save the image as PNG
     image.save(file_name + ".png")
-    image.show()
+    return image
 
 
 def process_wod(contents):
-    # print("Processing WOD...")
-    # print(len(packets))
-    # chunk_size = 64
-    # contents = b''
-    # # WOD fits in 5 packets
-    # # We want to loop through and extract the actual data (we dont really need packets remaining and datatype here, but its there for debugging)
-    # for i in range(0, 5):
-    #     contents += packets[chunk_size*i+3:(chunk_size*(i+1))]
-
-    # Parse contents. 4 byte unsigned int, then 8x32 bytes unsigned chars
-    # Since there is extra space left on the last packet, truncate that so we can unpack exactly what we need
-    print(len(contents))
-    print(contents)
-    unpacked_data = struct.unpack('<I' + 'B'*8*32, contents[0:8*32+4])
-    time = unpacked_data[0]
+    # Decode the 32 rows (the extra space in the last packet is ignored) and add them to the
+    # dataset of every WOD received, see wod_dataset.py
+    rows = decode_wod(contents)
+    time = int(rows['time'][0])
     print(f'WOD time: {parse_seconds_to_datetime(time)} ({time})')
-    # Write to a csv file
-    with open('wod.csv', 'w', newline='') as csvfile:
-        header = ['time', 'mode', 'bat_voltage', 'bat_current', 'bus_3v_current',
-                  'bus_5v_current', 'temp_comm', 'temp_eps', 'temp_battery']
+    wod_dataset.append(rows)
+    print(f"WOD added to {wod_dataset.csv_path} and {wod_dataset.binary_path}")
+
+
+def process_wod_rollup(buckets, window_seconds: int):
+    # Write to a csv file, one row per window with the min, max and mean of each reading
+    with open('wod_rollup.csv', 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(header)
-        for i in range(0, 32):
-            # Increment by 1 minute for each iteration
-            time_column = [time + 60*i]
-            data_row = [unpacked_data[8*i + j + 1] for j in range(8)]
-            # Check the mode value. It should only be 0 or 1
-            # If it is another value then set it to -1 because it's invalid
-            if data_row[0] > 1:
-                data_row[0] = 0
-
-            # mode            = unpacked_data[8*i + 1]
-            # bat_voltage     = unpacked_data[8*i + 2]
-            # bat_current     = unpacked_data[8*i + 3]
-            # bus_3v_current  = unpacked_data[8*i + 4]
-            # bus_5v_current  = unpacked_data[8*i + 5]
-            # temp_comm       = unpacked_data[8*i + 6]
-            # temp_eps        = unpacked_data[8*i + 7]
-            # temp_battery    = unpacked_data[8*i + 8]
-            # print(f"{mode}, {bat_voltage}, {bat_current}, {bus_3v_current}, {bus_5v_current}, {temp_comm}, {temp_eps}, {temp_battery}")
-            writer.writerow(time_column + data_row)
-        print("WOD saved to wod.csv")
+        writer.writerow(['time', 'window_seconds', 'samples'] + [f'{field}_{stat}' for field in ROLLUP_FIELDS
+                                                                 for stat in ('min', 'max', 'mean')])
+        for bucket in buckets:
+            print(f'{parse_seconds_to_datetime(bucket.start)}: {bucket.count} samples, '
+                  f'battery {bucket.min[0]:.3g}-{bucket.max[0]:.3g}V')
+            writer.writerow([bucket.start, window_seconds, bucket.count] + [
+                f'{value:.4g}' for i in range(len(ROLLUP_FIELDS)) for value in (bucket.min[i], bucket.max[i], bucket.mean[i])])
+    print("WOD rollup saved to wod_rollup.csv")
 
 
 def current_time_to_seconds():
@@ -322,21 +808,47 @@ def parse_datetime_to_seconds(datetime_str, sydney_zone=True):
     return seconds_since_epoch
 
 
-# Open serial port
-ser = serial.Serial(COM_PORT, BAUD_RATE, timeout=5)
+def main():
+    # Open serial port. Everything read and written is recorded so the pass can be replayed
+    # later, see serial_capture.py
+    capture_name = f"{CAPTURE_DIR}/{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+    ser = CaptureSerial(serial.Serial(COM_PORT, BAUD_RATE, timeout=5), CaptureWriter(
+        f"{capture_name}.zcap"))
 
-# Start reading and writing threads
-read_thread = threading.Thread(target=serial_read, args=(ser,), daemon=True)
-read_thread.start()
+    # Images are decoded and saved off the reader threads
+    image_pipeline.start()
 
-write_thread = threading.Thread(target=serial_write, args=(ser,), daemon=True)
-write_thread.start()
+    # Start reading and writing threads
+    read_thread = threading.Thread(
+        target=serial_read, args=(ser,), daemon=True)
+    read_thread.start()
 
-# Keep the main thread alive
-try:
+    # Further ground stations only receive, commands are all sent from the first one
+    for port, channel in EXTRA_PORTS:
+        extra = CaptureSerial(serial.Serial(port, BAUD_RATE, timeout=5), CaptureWriter(
+            f"{capture_name}_{port}.zcap"))
+        extra.write(f'setchannel {channel}\n'.encode())
+        threading.Thread(target=serial_read, args=(extra,), daemon=True).start()
 
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    print("Exiting...")
-    ser.close()
+    # Typed commands are queued and pipelined rather than written straight to the arduino
+    global command_scheduler
+    command_scheduler = CommandScheduler(ser)
+    command_scheduler.start()
+    write_thread = threading.Thread(
+        target=serial_write, args=(command_scheduler,), daemon=True)
+    write_thread.start()
+
+    # Keep the main thread alive
+    try:
+
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Exiting...")
+        ser.close()
+        # Finish saving the images already received
+        image_pipeline.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+'''
+Compression ratio and CPU cost of each image_codec mode on the images in sample_img/
+Each image is converted to 8-bit greyscale first, as the CubeSat would store it.
+
+Usage: python bench_compression.py [image directory]
+'''
+
+import math
+import os
+import sys
+import time
+from PIL import Image
+from image_codec import Compression, compress_image, decompress_image
+from obc_framing import INFO_PAYLOAD_LENGTH
+
+# (mode, level) pairs to compare
+MODES = [
+    (Compression.RAW, 0),
+    (Compression.DELTA_RLE, 0),
+    (Compression.ZLIB, 1),
+    (Compression.ZLIB, 6),
+    (Compression.ZLIB, 9),
+    (Compression.LZMA, 6),
+    (Compression.LZMA, 9),
+]
+
+
+def time_call(function, *args):
+    '''Best of a few runs, in ms'''
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'sample_img'
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith(('.png', '.jpg', '.jpeg')))
+
+    print(f'{"image":28} {"mode":12} {"bytes":>7} {"ratio":>6} {"packets":>7} {"compress ms":>12} {"decompress ms":>14}')
+    for path in paths:
+        with Image.open(path) as img:
+            grey_img = img.convert('L')
+        width, height = grey_img.size
+        pixels = grey_img.tobytes()
+        for mode, level in MODES:
+            compressed, compress_ms = time_call(
+                compress_image, pixels, width, height, mode, level)
+            decompressed, decompress_ms = time_call(
+                decompress_image, compressed, width, height, mode)
+            assert decompressed == pixels, f'{mode.name} did not round trip on {path}'
+            name = mode.name.lower() + (f':{level}' if level else '')
+            print(f'{os.path.basename(path) + f" {width}x{height}":28} {name:12} {len(compressed):7} '
+                  f'{len(pixels) / len(compressed):6.2f} {math.ceil(len(compressed) / INFO_PAYLOAD_LENGTH):7} '
+                  f'{compress_ms:12.2f} {decompress_ms:14.2f}')
+
+
+if __name__ == '__main__':
+    main()
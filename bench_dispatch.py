@@ -0,0 +1,57 @@
+'''
+Microbenchmark for ground station command dispatch in OBCCommunication.
+No serial port is needed, the handlers are replaced with ones that do nothing
+so only the lookup, argument decoding and call are measured.
+
+Usage: python bench_dispatch.py [iterations]
+'''
+
+import contextlib
+import os
+import struct
+import sys
+import time
+from obc_comms import OBCCommunication, CommandType, MessageType
+
+
+def noop(obc, *args):
+    pass
+
+
+def build_command(cmd_type: CommandType, args: bytes = b'') -> bytes:
+    return (b'CUBE' + struct.pack('BB', MessageType.GROUND_STATION_COMMAND.value, cmd_type.value) + args).ljust(64, b'\x00')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    # Keep the argument formats but swap in handlers that do nothing
+    for cmd_value, command in list(OBCCommunication.commands.items()):
+        OBCCommunication.commands[cmd_value] = command._replace(handler=noop)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # No transceiver attached, the serial port fails to open and transmit is a no-op
+        obc = OBCCommunication(uart_port='/dev/null/no-port')
+
+    packets = [
+        build_command(CommandType.SEND_PING),
+        build_command(CommandType.SET_TIME, struct.pack('<I', 769831935)),
+        build_command(CommandType.REQUEST_SCIENCE_IMAGE,
+                      struct.pack('<bhhi', 0, 0, 0, 769831935)),
+        build_command(CommandType.PERFORM_SCIENCE_MEASUREMENT),
+    ]
+
+    print(f'Dispatching {iterations} packets per command')
+    with open(os.devnull, 'w') as devnull:
+        for packet in packets:
+            cmd_type = packet[5]
+            with contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    obc.dispatch_command(cmd_type, packet)
+                elapsed = time.perf_counter() - start
+            print(f'{CommandType(cmd_type).name:30} {elapsed / iterations * 1e9:8.1f} ns/packet')
+
+
+if __name__ == '__main__':
+    main()
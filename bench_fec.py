@@ -0,0 +1,126 @@
+'''
+Science image goodput over a lossy simulated link, with and without forward error correction.
+
+For each loss rate and FEC setting (block packets:parity packets, see obc_framing) the image is
+requested over the simulated link of bench_link.LinkBench, and the packets still missing are
+asked for again until it is complete, as a ground station would. Goodput is the image bytes
+over the time from the request to the last packet. Parity packets cost airtime on every pass
+but save the round trips of retransmit requests.
+
+Usage: python bench_fec.py [--losses 0 0.02 0.05 0.1 0.2] [--fec off 16:1 8:1 8:2] [--repeat 2] [--rounds 10]
+'''
+
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import time
+import SerialTest
+from bench_link import LinkBench
+from zetaplus_sim import GroundStationSim
+
+IMAGE_REQUEST = b'getimg 769831935 0 0 0 0 0 0 0\n'
+ADDRESS = b'USYD'
+# sample_img/nerd64.bin, sent raw
+IMAGE_BYTES = 64 * 64
+
+
+def parse_fec(option: str) -> tuple:
+    if option == 'off':
+        return 0, 0
+    block_packets, parity_packets = option.split(':')
+    return int(block_packets), int(parity_packets)
+
+
+def set_fec(bench: LinkBench, block_packets: int, parity_packets: int, timeout=5.0) -> bool:
+    '''Send the fec command until the CubeSat has taken it, the uplink can lose it too'''
+    expected = (block_packets, parity_packets) if parity_packets else None
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        SerialTest.set_fec(bench.pc, block_packets, parity_packets)
+        sent = time.monotonic()
+        while time.monotonic() - sent < 0.5:
+            if (tuple(bench.obc.fec) if bench.obc.fec else None) == expected:
+                return True
+            time.sleep(0.01)
+    return False
+
+
+def wait_for_image_header(bench: LinkBench, timeout=2.0) -> bytes:
+    '''Information packets that lost their header packet are printed as new packets, skip those'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        data = bench.wait_for_header(deadline - time.monotonic())
+        if data is not None and data[:4] == ADDRESS and data[4] == GroundStationSim.SCIENCE_IMAGE:
+            return data
+    return None
+
+
+def fetch_image(bench: LinkBench, max_rounds: int):
+    '''
+    Request the image, then the packets still missing until it is complete.
+    Returns the seconds taken, packets put on air, retransmit requests and packets rebuilt
+    from parity, or None if it wasn't complete after max_rounds
+    '''
+    SerialTest.received_images.clear()
+    SerialTest.image_streams.clear()
+    packets_before = bench.link.packets_sent
+    start = time.monotonic()
+    retransmits = 0
+    bench.pc.write(IMAGE_REQUEST)
+    for _ in range(max_rounds):
+        data = wait_for_image_header(bench)
+        if data is not None:
+            SerialTest.receive_science_image(bench.pc, data[4:])
+        image = SerialTest.received_images.get(0)
+        if image is not None and image.assembler.complete():
+            return (time.monotonic() - start, bench.link.packets_sent - packets_before, retransmits,
+                    image.assembler.packets_rebuilt)
+        if image is None:
+            # The request or its header packet was lost
+            bench.pc.write(IMAGE_REQUEST)
+        else:
+            SerialTest.request_retransmit(bench.pc, GroundStationSim.SCIENCE_IMAGE, 0, image.assembler.missing())
+            retransmits += 1
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--losses', type=float, nargs='+', default=[0.0, 0.02, 0.05, 0.1, 0.2])
+    parser.add_argument('--fec', nargs='+', default=['off', '16:1', '8:1', '8:2'],
+                        help='FEC settings as <block packets>:<parity packets>, or off')
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=10, help='requests before giving up on an image')
+    parser.add_argument('--rf-bitrate', type=int, default=38400)
+    parser.add_argument('--baud', type=int, default=19200)
+    args = parser.parse_args()
+
+    out = sys.stdout
+    print(f'RF {args.rf_bitrate} bit/s, UART {args.baud} baud, {args.repeat} images each', file=out)
+    print(f'{"loss":>5} {"fec":>5} {"seconds":>8} {"goodput B/s":>12} {"on air":>7} {"resends":>8} '
+          f'{"rebuilt":>8} {"failed":>7}', file=out)
+    for loss in args.losses:
+        for option in args.fec:
+            # The CubeSat and decoders print every packet, keep that out of the results
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                bench = LinkBench(loss, rf_bitrate=args.rf_bitrate, baud=args.baud)
+                bench.start()
+                if set_fec(bench, *parse_fec(option)):
+                    results = [fetch_image(bench, args.rounds) for _ in range(args.repeat)]
+                else:
+                    results = [None] * args.repeat
+                bench.stop()
+            done = [r for r in results if r is not None]
+            failed = len(results) - len(done)
+            if not done:
+                print(f'{loss:5.2f} {option:>5} {"-":>8} {"-":>12} {"-":>7} {"-":>8} {"-":>8} {failed:>7}', file=out)
+                continue
+            seconds, packets, retransmits, rebuilt = (statistics.median(column) for column in zip(*done))
+            print(f'{loss:5.2f} {option:>5} {seconds:8.2f} {IMAGE_BYTES / seconds:12.0f} {packets:7.0f} '
+                  f'{retransmits:8.1f} {rebuilt:8.1f} {failed:>7}', file=out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+'''
+End to end throughput benchmark over the simulated ZetaPlus link (zetaplus_sim.py)
+OBCCommunication runs on a simulated CubeSat transceiver, GroundStationSim stands in for the
+ground station arduino and the SerialTest.py decoders read its output, exactly as on a pass.
+
+For each request reports the latency from the command being typed to the product being
+decoded, and the packets/s and payload bytes/s achieved over that time. The round trip times
+of the pings and time syncs are summarised with the CubeSat clock offset estimated from them,
+the CubeSat clock is set --clock-offset seconds ahead of the ground station to check it.
+--pipeline n times n pings and gettimes sent one at a time against the same requests queued on a
+ground_scheduler.CommandScheduler, which keeps --window of them in flight at once.
+With --links n the image is striped over n transceivers on channels 0 to n-1, each with its own
+ground station, see obc_multilink.py.
+
+Usage: python bench_link.py [--loss 0.0] [--latency 0.005] [--rf-bitrate 38400] [--baud 19200] [--repeat 3]
+                            [--compression raw|delta_rle|zlib|lzma] [--level 0] [--progressive] [--clock-offset 5]
+                            [--links 1] [--pipeline 12] [--window 3]
+'''
+
+import argparse
+import contextlib
+import math
+import os
+import statistics
+import struct
+import sys
+import threading
+import time
+import SerialTest
+from ground_scheduler import CommandScheduler
+from image_codec import Compression, Ordering
+from obc_comms import OBCCommunication
+from obc_framing import INFO_PAYLOAD_LENGTH, header_fec
+from obc_multilink import StripedOBCCommunication
+from zetaplus_sim import GroundStationSim, SimulatedLink, SimulatedZetaPlus
+
+
+class LinkBench:
+    def __init__(self, loss=0.0, latency=0.005, rf_bitrate=38400, baud=19200, additional_packets_timeout=0.25, seed=1,
+                 links=1) -> None:
+        self.link = SimulatedLink(rf_bitrate, latency, loss, seed=seed)
+        # Every further link is a CubeSat transceiver and a ground station on the next channel
+        extra_links = [OBCCommunication(ser=SimulatedZetaPlus(self.link, baud).host, channel=channel)
+                       for channel in range(1, links)]
+        self.obc = StripedOBCCommunication(
+            ser=SimulatedZetaPlus(self.link, baud).host, links=extra_links)
+        self.ground = GroundStationSim(SimulatedZetaPlus(
+            self.link, baud), additional_packets_timeout=additional_packets_timeout)
+        self.extra_grounds = [GroundStationSim(SimulatedZetaPlus(self.link, baud), additional_packets_timeout=additional_packets_timeout,
+                                               channel=channel) for channel in range(1, links)]
+        self.pc = self.ground.pc
+        self.running = False
+
+    def cubesat_loop(self):
+        while self.running:
+            self.obc.receiveTransmission()
+            time.sleep(0.001)
+
+    def extra_ground_loop(self, pc):
+        # The further ground stations only receive the image stripes
+        while self.running:
+            line = pc.readline()
+            if b'New Received' in line:
+                data = SerialTest.read_packet_contents(pc, line)
+                if len(data) > 4 and data[4] == GroundStationSim.SCIENCE_IMAGE:
+                    SerialTest.receive_science_image(pc, data[4:])
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.cubesat_loop, daemon=True).start()
+        self.ground.start()
+        for ground in self.extra_grounds:
+            ground.start()
+            threading.Thread(target=self.extra_ground_loop, args=(ground.pc,), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.ground.stop()
+        for ground in self.extra_grounds:
+            ground.stop()
+
+    def wait_for_header(self, timeout=5.0) -> bytes:
+        '''Read arduino output until a new packet is received, returns the packet contents'''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = self.pc.readline()
+            if b'New Received' in line:
+                return SerialTest.read_packet_contents(self.pc, line)
+        return None
+
+    def ping(self):
+        SerialTest.send_ping(self.pc)
+        data = self.wait_for_header()
+        if data is None or data[4] != GroundStationSim.PONG:
+            return None
+        SerialTest.process_pong()
+        return 1, 0
+
+    def timesync(self):
+        SerialTest.send_time_syncs(self.pc, 1)
+        data = self.wait_for_header()
+        if data is None or data[4] != GroundStationSim.TIME_SYNC:
+            return None
+        SerialTest.process_time_sync(data[4:])
+        return 1, 0
+
+    def wod(self):
+        self.pc.write(b'wod\n')
+        data = self.wait_for_header()
+        if data is None or data[4] != GroundStationSim.WOD:
+            return None
+        wod_bytes = SerialTest.process_wod_content_stream(self.pc, header_fec(data[4:]))
+        return 1 + math.ceil(len(wod_bytes) / INFO_PAYLOAD_LENGTH), len(wod_bytes)
+
+    def image(self, compression=Compression.RAW, level=0, ordering=Ordering.ROW_MAJOR):
+        self.pc.write(
+            f'getimg 769831935 0 0 0 {compression.value} {level} {ordering.value} 0\n'.encode())
+        data = self.wait_for_header()
+        if data is None or data[4] != GroundStationSim.SCIENCE_IMAGE:
+            return None
+        data_length = struct.unpack('<I', data[17:21])[0]
+        n_packets = math.ceil(data_length / INFO_PAYLOAD_LENGTH)
+        SerialTest.receive_science_image(self.pc, data[4:])
+        # Wait for the stripes still arriving on the other ground stations
+        deadline = time.monotonic() + 5.0
+        while SerialTest.image_streams.get(0) and time.monotonic() < deadline:
+            time.sleep(0.001)
+        image = SerialTest.received_images[0]
+        if not image.assembler.complete():
+            return None
+        return 1 + n_packets, image.width * image.height
+
+    def gettime(self):
+        self.pc.write(b'gettime\n')
+        data = self.wait_for_header()
+        if data is None or data[4] != GroundStationSim.TIME:
+            return None
+        return 1, 0
+
+    def pipelined(self, n_requests: int, window: int) -> int:
+        '''Send the requests through a CommandScheduler, returns how many were answered'''
+        scheduler = CommandScheduler(self.pc, window, timeout=5.0)
+        SerialTest.command_scheduler = scheduler
+        reading = True
+
+        def read():
+            while reading:
+                line = self.pc.readline()
+                if line:
+                    SerialTest.process_line(self.pc, line, False)
+        threading.Thread(target=read, daemon=True).start()
+        scheduler.start()
+        requests = [scheduler.submit(b'gettime\n') if i % 2 else SerialTest.send_ping(scheduler)
+                    for i in range(n_requests)]
+        answered = 0
+        for request in requests:
+            try:
+                request.result(timeout=10)
+                answered += 1
+            except Exception:
+                pass
+        reading = False
+        scheduler.stop()
+        SerialTest.command_scheduler = None
+        return answered
+
+    def run(self, request):
+        start = time.monotonic()
+        result = request()
+        latency = time.monotonic() - start
+        if result is None:
+            return None
+        packets, n_bytes = result
+        return latency, packets / latency, n_bytes / latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--rf-bitrate', type=int, default=38400)
+    parser.add_argument('--baud', type=int, default=19200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compression', choices=[c.name.lower() for c in Compression], default='raw',
+                        help='compression for the image request')
+    parser.add_argument('--level', type=int, default=0)
+    parser.add_argument('--progressive', action='store_true',
+                        help='send the image interlaced, saving each pass as it arrives')
+    parser.add_argument('--clock-offset', type=float, default=5.0,
+                        help='seconds the CubeSat clock is set ahead of the ground station')
+    parser.add_argument('--links', type=int, default=1,
+                        help='number of transceivers the image is striped over')
+    parser.add_argument('--pipeline', type=int, default=12,
+                        help='number of requests to time one at a time and pipelined, 0 to skip')
+    parser.add_argument('--window', type=int, default=3,
+                        help='requests in flight at once when pipelined')
+    args = parser.parse_args()
+
+    out = sys.stdout
+    print(f'loss {args.loss}, latency {args.latency}s, RF {args.rf_bitrate} bit/s, UART {args.baud} baud, '
+          f'{args.links} link{"s" if args.links > 1 else ""}', file=out)
+    print(f'{"request":8} {"latency s":>10} {"packets/s":>10} {"bytes/s":>10} {"failed":>7}', file=out)
+    # The CubeSat and decoders print every packet, keep that out of the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        bench = LinkBench(args.loss, args.latency,
+                          args.rf_bitrate, args.baud, links=args.links)
+        bench.obc.clock.set(SerialTest.ground_clock.now() + args.clock_offset)
+        bench.start()
+        compression = Compression[args.compression.upper()]
+        ordering = Ordering.INTERLACED if args.progressive else Ordering.ROW_MAJOR
+        requests = (('ping', bench.ping), ('timesync', bench.timesync), ('wod', bench.wod),
+                    ('image', lambda: bench.image(compression, args.level, ordering)))
+        for name, request in requests:
+            results = [bench.run(request) for _ in range(args.repeat)]
+            done = [r for r in results if r is not None]
+            failed = len(results) - len(done)
+            if not done:
+                print(f'{name:8} {"-":>10} {"-":>10} {"-":>10} {failed:>7}', file=out)
+                continue
+            latency, packets_per_second, bytes_per_second = (
+                statistics.median(column) for column in zip(*done))
+            print(f'{name:8} {latency:10.3f} {packets_per_second:10.1f} {bytes_per_second:10.0f} {failed:>7}', file=out)
+        if args.pipeline:
+            start = time.monotonic()
+            serial_answered = sum((bench.gettime() if i % 2 else bench.ping()) is not None
+                                  for i in range(args.pipeline))
+            serial_seconds = time.monotonic() - start
+            start = time.monotonic()
+            answered = bench.pipelined(args.pipeline, args.window)
+            pipelined_seconds = time.monotonic() - start
+        bench.stop()
+    if args.pipeline:
+        print(f'{args.pipeline} requests: one at a time {serial_seconds:.2f}s ({serial_answered} answered), '
+              f'pipelined window {args.window} {pipelined_seconds:.2f}s ({answered} answered)', file=out)
+    timing = SerialTest.link_timing.summary()
+    if timing.samples:
+        print(f'round trip ms: min {timing.min * 1000:.1f}, p50 {timing.p50 * 1000:.1f}, p90 {timing.p90 * 1000:.1f}, '
+              f'p99 {timing.p99 * 1000:.1f}, max {timing.max * 1000:.1f} ({timing.samples} samples)', file=out)
+    if timing.offset is not None:
+        print(f'clock offset {timing.offset:+.3f}s (set {args.clock_offset:+.3f}s)', file=out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+'''
+Pipelined ground station command scheduler.
+
+Commands are queued with a priority and given a request ID. One is sent whenever fewer than
+window requests are waiting for a response, so several requests can be in flight during a
+short pass rather than one per typed line. Nothing is written while a product is being
+received, as the arduino doesn't read the PC serial then.
+
+The request ID stays on the ground: the uplink packet has no byte to spare for it (a
+retransmit request already fills all 64). Instead every command knows the message type of its
+response, and a response completes the oldest request waiting for that type, as the CubeSat
+answers commands in the order they arrive.
+
+Each request is a concurrent.futures.Future. It completes with the response's header packet
+(after the callsign), with None once sent for commands that have no response, or with a
+TimeoutError.
+'''
+
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from obc_comms import CommandType, MessageType
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Message types of the responses to the arduino commands, see GroundStation.ino.
+# The CubeSat doesn't answer getsciencereading yet, so like settime it completes once sent
+RESPONSE_TYPES = {'ping': MessageType.PONG.value, 'wod': MessageType.WOD.value, 'gettime': MessageType.TIME.value,
+                  'getimg': MessageType.SCIENCE_IMAGE.value}
+# and to raw commands by command type
+RAW_RESPONSE_TYPES = {CommandType.REQUEST_WOD_ROLLUP.value: MessageType.WOD_ROLLUP.value,
+                      CommandType.TIME_SYNC.value: MessageType.TIME_SYNC.value}
+# A retransmit request is answered with the message type it asks for
+REQUEST_RETRANSMIT = CommandType.REQUEST_RETRANSMIT.value
+
+# Quick commands go ahead of whole products
+PRIORITIES = {'ping': PRIORITY_HIGH, 'gettime': PRIORITY_HIGH, 'settime': PRIORITY_HIGH, 'getimg': PRIORITY_LOW}
+
+
+def response_type(command: bytes) -> int:
+    '''Message type of the response to a command line, None if it has no response'''
+    words = command.split()
+    if not words:
+        return None
+    if words[0] == b'raw' and len(words) == 2:
+        try:
+            contents = bytes.fromhex(words[1].decode())
+        except ValueError:
+            return None
+        if len(contents) > 2 and contents[1] == REQUEST_RETRANSMIT:
+            return contents[2]
+        return RAW_RESPONSE_TYPES.get(contents[1]) if len(contents) > 1 else None
+    return RESPONSE_TYPES.get(words[0].decode(errors='ignore'))
+
+
+def default_priority(command: bytes) -> int:
+    words = command.split()
+    if words and words[0] == b'raw':
+        # Retransmits and time syncs are small and keep the current product moving
+        return PRIORITY_HIGH
+    return PRIORITIES.get(words[0].decode(errors='ignore'), PRIORITY_NORMAL) if words else PRIORITY_NORMAL
+
+
+class Request(Future):
+    def __init__(self, request_id: int, command, priority: int) -> None:
+        super().__init__()
+        self.request_id = request_id
+        self.command = command
+        self.priority = priority
+        self.response_type = None
+        self.sent_time = None
+
+    def name(self) -> str:
+        command = self.command if isinstance(self.command, bytes) else b''
+        return f'#{self.request_id} {command.decode(errors="ignore").strip()[:40]}'
+
+
+class CommandScheduler:
+    def __init__(self, serial_port, window=3, timeout=10.0) -> None:
+        '''
+            window: most requests waiting for a response at once
+            timeout: seconds to wait for a response before the request fails
+        '''
+        self.serial_port = serial_port
+        self.window = window
+        self.timeout = timeout
+        # (priority, request ID, request) still to be sent
+        self.queue = []
+        # Sent and waiting for a response, oldest first
+        self.outstanding = []
+        self.ids = itertools.count(1)
+        self.condition = threading.Condition()
+        self.busy = False
+        self.running = False
+        self.thread = None
+
+    def submit(self, command, priority=None) -> Request:
+        '''
+            Queue a command line. command is bytes, or a function returning them that is called
+            just before it is sent, eg. for a command carrying the current time
+        '''
+        if priority is None:
+            priority = PRIORITY_NORMAL if callable(command) else default_priority(command)
+        with self.condition:
+            request = Request(next(self.ids), command, priority)
+            heapq.heappush(self.queue, (priority, request.request_id, request))
+            self.condition.notify_all()
+        return request
+
+    def write(self, data: bytes) -> Request:
+        '''So the scheduler can stand in for the serial port'''
+        return self.submit(bytes(data))
+
+    @contextlib.contextmanager
+    def receiving(self):
+        '''Hold back commands while the arduino is printing a received product'''
+        with self.condition:
+            self.busy = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def response_received(self, msg_type: int, data: bytes):
+        '''Complete the oldest request waiting for a response of this message type'''
+        with self.condition:
+            request = next((r for r in self.outstanding if r.response_type == msg_type), None)
+            if request is None:
+                return
+            self.outstanding.remove(request)
+            self.condition.notify_all()
+        print(f'[{request.name()}] response after {time.monotonic() - request.sent_time:.2f}s')
+        request.set_result(bytes(data))
+
+    def expire(self, now: float):
+        # Must hold self.condition
+        for request in [r for r in self.outstanding if now - r.sent_time > self.timeout]:
+            self.outstanding.remove(request)
+            print(f'[{request.name()}] no response after {self.timeout}s')
+            request.set_exception(TimeoutError(f'No response to request {request.request_id}'))
+
+    def next_request(self) -> Request:
+        '''Wait until a request can be sent and take it from the queue, None once stopped'''
+        with self.condition:
+            while self.running:
+                now = time.monotonic()
+                self.expire(now)
+                if self.queue and not self.busy and len(self.outstanding) < self.window:
+                    return heapq.heappop(self.queue)[2]
+                wait = 0.1
+                if self.outstanding:
+                    wait = min(wait, max(self.outstanding[0].sent_time + self.timeout - now, 0))
+                self.condition.wait(wait)
+        return None
+
+    def run(self):
+        while True:
+            request = self.next_request()
+            if request is None:
+                return
+            command = request.command() if callable(request.command) else request.command
+            request.command = command
+            request.response_type = response_type(command)
+            with self.condition:
+                request.sent_time = time.monotonic()
+                if request.response_type is not None:
+                    self.outstanding.append(request)
+            self.serial_port.write(command)
+            print(f'[{request.name()}] sent')
+            if request.response_type is None:
+                request.set_result(None)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def pending(self) -> tuple:
+        '''Requests queued and requests waiting for a response'''
+        with self.condition:
+            return [entry[2] for entry in sorted(self.queue)], list(self.outstanding)
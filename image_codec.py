@@ -0,0 +1,246 @@
+'''
+Compression of greyscale science images for the downlink.
+Used by the CubeSat (obc_comms.py) to compress and the ground station (SerialTest.py) to decompress.
+The mode is sent in the science image header packet so the ground station decodes automatically.
+
+Modes:
+RAW - 8-bit pixels as is
+DELTA_RLE - each pixel minus its left neighbour (the first pixel of a row minus the first pixel of the
+            row above), then PackBits style run length encoding. Cheap enough for the CubeSat CPU
+ZLIB - zlib at the given level (1-9)
+LZMA - LZMA at the given preset (0-9), smallest but slowest
+
+Images can also be sent progressively (Ordering.INTERLACED): a coarse grid of pixels first and
+then finer passes, so the ground station can show a low resolution image before the rest arrives.
+'''
+
+import lzma
+import zlib
+from enum import Enum, unique
+
+
+@unique
+class Compression(Enum):
+    RAW = 0
+    DELTA_RLE = 1
+    ZLIB = 2
+    LZMA = 3
+
+
+# Raw LZMA stream, the .xz container headers would waste most of a packet
+LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2}]
+
+
+def row_delta(pixels, width: int) -> bytearray:
+    deltas = bytearray(len(pixels))
+    previous_row_start = 0
+    for row_start in range(0, len(pixels), width):
+        row = pixels[row_start:row_start + width]
+        deltas[row_start] = (row[0] - previous_row_start) & 0xFF
+        deltas[row_start + 1:row_start + width] = bytes(
+            (b - a) & 0xFF for a, b in zip(row, row[1:]))
+        previous_row_start = row[0]
+    return deltas
+
+
+def undo_row_delta(deltas, width: int) -> bytearray:
+    pixels = bytearray(len(deltas))
+    previous_row_start = 0
+    for row_start in range(0, len(deltas), width):
+        value = (previous_row_start + deltas[row_start]) & 0xFF
+        pixels[row_start] = value
+        previous_row_start = value
+        for i in range(row_start + 1, min(row_start + width, len(deltas))):
+            value = (value + deltas[i]) & 0xFF
+            pixels[i] = value
+    return pixels
+
+
+def rle_encode(data) -> bytearray:
+    '''
+        PackBits. A control byte n of 0-127 is followed by n+1 literal bytes,
+        n of 129-255 means the next byte is repeated 257-n times
+    '''
+    out = bytearray()
+    n = len(data)
+    i = 0
+    literal_start = 0
+    while i < n:
+        # Length of the run starting at i
+        run = 1
+        while i + run < n and run < 128 and data[i + run] == data[i]:
+            run += 1
+        if run >= 3:
+            # Flush any literals before the run
+            while literal_start < i:
+                chunk = min(i - literal_start, 128)
+                out.append(chunk - 1)
+                out += data[literal_start:literal_start + chunk]
+                literal_start += chunk
+            out.append(257 - run)
+            out.append(data[i])
+            i += run
+            literal_start = i
+        else:
+            i += run
+    while literal_start < n:
+        chunk = min(n - literal_start, 128)
+        out.append(chunk - 1)
+        out += data[literal_start:literal_start + chunk]
+        literal_start += chunk
+    return out
+
+
+def rle_decode(data, expected_length: int) -> bytearray:
+    out = bytearray()
+    i = 0
+    while i < len(data) and len(out) < expected_length:
+        control = data[i]
+        if control < 128:
+            out += data[i + 1:i + 2 + control]
+            i += 2 + control
+        elif control > 128:
+            if i + 1 >= len(data):
+                # Cut off part way through the data
+                break
+            out += bytes((data[i + 1],)) * (257 - control)
+            i += 2
+        else:
+            i += 1
+    return out
+
+
+def compress_image(pixels, width: int, height: int, mode: Compression, level: int = 6) -> bytes:
+    '''Compress width*height 8-bit pixels (any bytes-like object)'''
+    if mode == Compression.RAW:
+        return pixels
+    if mode == Compression.DELTA_RLE:
+        return bytes(rle_encode(row_delta(pixels, width)))
+    if mode == Compression.ZLIB:
+        return zlib.compress(pixels, level)
+    if mode == Compression.LZMA:
+        return lzma.compress(pixels, format=lzma.FORMAT_RAW,
+                             filters=[dict(LZMA_FILTERS[0], preset=level)])
+    raise ValueError(f"Unknown compression mode {mode}")
+
+
+def decompress_image(data, width: int, height: int, mode: Compression) -> bytes:
+    '''
+        Returns the width*height pixels, any padding after the compressed data is ignored.
+        If only the start of the data is given, returns as many pixels as can be decoded from it
+    '''
+    n_pixels = width * height
+    if mode == Compression.RAW:
+        return bytes(data[:n_pixels])
+    if mode == Compression.DELTA_RLE:
+        return bytes(undo_row_delta(rle_decode(data, n_pixels), width))
+    if mode == Compression.ZLIB:
+        return zlib.decompressobj().decompress(data, n_pixels)
+    if mode == Compression.LZMA:
+        decompressor = lzma.LZMADecompressor(
+            format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+        return decompressor.decompress(data, n_pixels)
+    raise ValueError(f"Unknown compression mode {mode}")
+
+
+@unique
+class Ordering(Enum):
+    ROW_MAJOR = 0
+    # Progressive, a coarse grid of pixels first and then finer and finer passes
+    INTERLACED = 1
+
+
+# Pixel spacing of each interlaced pass. Pass 0 is every 8th pixel of every 8th row,
+# each later pass adds the pixels on a grid half the size
+INTERLACE_STRIDES = (8, 4, 2, 1)
+
+
+def interlace_order(width: int, height: int) -> list:
+    '''Pixel indices for each interlaced pass, coarsest first'''
+    passes = []
+    previous_stride = None
+    for stride in INTERLACE_STRIDES:
+        indices = []
+        for y in range(0, height, stride):
+            for x in range(0, width, stride):
+                if previous_stride and y % previous_stride == 0 and x % previous_stride == 0:
+                    # Already sent in a coarser pass
+                    continue
+                indices.append(y * width + x)
+        passes.append(indices)
+        previous_stride = stride
+    return passes
+
+
+def interlace(pixels, width: int, height: int) -> tuple:
+    '''Reorder row major pixels into interlaced passes. Returns (pixels, number of pixels in each pass)'''
+    passes = interlace_order(width, height)
+    ordered = bytearray()
+    for indices in passes:
+        ordered += bytes(map(pixels.__getitem__, indices))
+    return bytes(ordered), [len(indices) for indices in passes]
+
+
+def render_interlaced(ordered, width: int, height: int) -> bytes:
+    '''
+        Row major image from however many interlaced pixels have been received.
+        Each known pixel is drawn as a block the size of its pass grid, so a partial
+        image shows at the resolution of the passes received so far
+    '''
+    image = bytearray(width * height)
+    position = 0
+    for stride, indices in zip(INTERLACE_STRIDES, interlace_order(width, height)):
+        for index in indices:
+            if position >= len(ordered):
+                return bytes(image)
+            value = ordered[position]
+            position += 1
+            if stride == 1:
+                image[index] = value
+                continue
+            y, x = divmod(index, width)
+            block_width = min(stride, width - x)
+            block = bytes((value,)) * block_width
+            for row in range(y, min(y + stride, height)):
+                start = row * width + x
+                image[start:start + block_width] = block
+    return bytes(image)
+
+
+def compress_segments(pixels, width: int, mode: Compression, level: int, segment_lengths) -> tuple:
+    '''
+        Compress pixels so that each segment (eg. an interlaced pass) can be decompressed without
+        anything after it. Returns (compressed data, offset in the compressed data where each segment ends)
+        LZMA can't flush part way through a stream so it isn't supported here, use ZLIB instead.
+    '''
+    if mode == Compression.LZMA:
+        raise ValueError("LZMA streams can't be split into segments")
+    ends = []
+    if mode == Compression.RAW:
+        position = 0
+        for length in segment_lengths:
+            position += length
+            ends.append(position)
+        return pixels, ends
+    if mode == Compression.DELTA_RLE:
+        # PackBits runs never cross a segment, so each segment is a valid stream on its own
+        deltas = row_delta(pixels, width)
+        out = bytearray()
+        position = 0
+        for length in segment_lengths:
+            out += rle_encode(deltas[position:position + length])
+            position += length
+            ends.append(len(out))
+        return bytes(out), ends
+    compressor = zlib.compressobj(level)
+    out = bytearray()
+    position = 0
+    for length in segment_lengths:
+        out += compressor.compress(pixels[position:position + length])
+        out += compressor.flush(zlib.Z_SYNC_FLUSH)
+        position += length
+        ends.append(len(out))
+    out += compressor.flush()
+    ends[-1] = len(out)
+    return bytes(out), ends
+
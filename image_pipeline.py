@@ -0,0 +1,148 @@
+'''
+Image post-processing off the serial reader thread.
+
+Decoding a science image, writing the PNG and showing it take far longer than the arduino
+takes to print the next packets, so the thread reading the serial port only reads and
+reassembles packets and hands the image to ImagePipeline. A few worker threads take jobs from a
+bounded queue and run each job's stages in turn (eg. decode, save, display).
+
+If the queue is full a droppable job (eg. the preview of one interlaced pass) is dropped rather
+than holding up the reader; other jobs wait for space. Until start is called jobs run straight
+away on the calling thread, eg. when replaying a capture.
+
+The queue depth when each job is added, and the time each job waits in the queue and spends in
+each stage, are kept for print_stats.
+'''
+
+import math
+import queue
+import threading
+import time
+from collections import namedtuple
+from obc_link_metrics import RingBuffer
+
+# Seconds a job waited in the queue or spent in a stage
+StageStats = namedtuple('StageStats', ['count', 'mean', 'p50', 'p90', 'max'])
+
+QUEUED = 'queued'
+
+
+def percentile(values: list, p: float) -> float:
+    '''Nearest rank percentile (0-100) of sorted values'''
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class ImagePipeline:
+    def __init__(self, workers=2, max_queued=8, capacity=256) -> None:
+        '''
+            workers: threads processing jobs
+            max_queued: jobs waiting before droppable jobs are dropped and others wait
+            capacity: latencies kept for each stage
+        '''
+        self.n_workers = workers
+        self.capacity = capacity
+        self.jobs = queue.Queue(max_queued)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.depths = RingBuffer(capacity, 'H')
+        self.max_depth = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, name: str, value, stages, droppable=False) -> bool:
+        '''
+            Queue a job. stages is a list of (stage name, function), the first function is called
+            with value and each one after with what the one before returned.
+            Returns False if the job was dropped
+        '''
+        job = (name, value, stages, time.monotonic())
+        if not self.threads:
+            self.process(job)
+            return True
+        depth = self.jobs.qsize()
+        with self.lock:
+            self.depths.append(depth)
+            self.max_depth = max(self.max_depth, depth)
+        try:
+            self.jobs.put(job, block=not droppable)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            print(f'Image pipeline full, dropped {name}')
+            return False
+        return True
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            if stage not in self.latencies:
+                self.latencies[stage] = RingBuffer(self.capacity)
+            self.latencies[stage].append(seconds)
+
+    def process(self, job):
+        name, value, stages, queued_time = job
+        start = time.monotonic()
+        self.record(QUEUED, start - queued_time)
+        try:
+            for stage, function in stages:
+                value = function(value)
+                end = time.monotonic()
+                self.record(stage, end - start)
+                start = end
+        except Exception as e:
+            with self.lock:
+                self.failed += 1
+            print(f'Processing {name} failed at {stage}: {e}')
+            return
+        with self.lock:
+            self.processed += 1
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                self.process(job)
+            finally:
+                self.jobs.task_done()
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(self.n_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        '''Wait for every queued job to be processed'''
+        self.jobs.join()
+
+    def stop(self):
+        '''Process the jobs already queued then stop the workers'''
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self) -> dict:
+        '''StageStats by stage name, QUEUED being the time jobs waited in the queue'''
+        with self.lock:
+            latencies = {stage: sorted(buffer.values()) for stage, buffer in self.latencies.items()}
+        return {stage: StageStats(len(values), sum(values) / len(values), percentile(values, 50),
+                                  percentile(values, 90), values[-1])
+                for stage, values in latencies.items() if values}
+
+    def print_stats(self):
+        print('--- Image pipeline ---')
+        with self.lock:
+            depths = self.depths.values()
+            print(f'{self.processed} jobs processed, {self.dropped} dropped, {self.failed} failed, '
+                  f'{self.jobs.qsize()} queued now')
+        if depths:
+            print(f'Queue depth when added: mean {sum(depths) / len(depths):.1f}, max {self.max_depth} '
+                  f'of {self.jobs.maxsize}')
+        for stage, stats in self.stats().items():
+            print(f'{stage:>8}: {stats.count} jobs, mean {stats.mean * 1000:.1f}ms, p50 {stats.p50 * 1000:.1f}ms, '
+                  f'p90 {stats.p90 * 1000:.1f}ms, max {stats.max * 1000:.1f}ms')
+        print('-------------------')
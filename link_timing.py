@@ -0,0 +1,98 @@
+'''
+Link round trip time and CubeSat clock offset.
+
+MissionClock keeps time in seconds since 01/01/2000 from a monotonic base. It is set once
+(eg. by a settime command) and from then on advances with time.monotonic(), so it neither
+stands still between commands nor jumps when the host's wall clock is adjusted.
+
+Time sync works like NTP. The ground station sends its time t1, the CubeSat notes on its clock
+when the request arrived (t2) and when the reply left (t3), and the ground station notes when
+the reply arrived (t4). Then
+    round trip time = (t4 - t1) - (t3 - t2)
+    clock offset    = ((t2 - t1) + (t3 - t4)) / 2, the CubeSat clock minus the ground clock
+The offset assumes the link is as slow one way as the other, so it is taken from the recent
+exchange with the lowest round trip time.
+'''
+
+import math
+import struct
+import time
+from collections import deque, namedtuple
+
+# Unix time of 01/01/2000 00:00:00 UTC
+UNIX_TIME_2000 = 946684800
+
+# Time sync request arguments: sequence number, ground station time t1
+TIME_SYNC_REQUEST = struct.Struct('<Hd')
+# Time sync reply header packet contents: message type, sequence number, t1 echoed, t2, t3
+TIME_SYNC_REPLY = struct.Struct('<BHddd')
+# t3 is the last field of the reply, filled in as the reply is written to the transceiver
+TIME_SYNC_SEND_TIME = struct.Struct('<d')
+TIME_SYNC_SEND_TIME_OFFSET = TIME_SYNC_REPLY.size - TIME_SYNC_SEND_TIME.size
+
+TimeSyncSample = namedtuple('TimeSyncSample', ['rtt', 'offset'])
+
+# Round trip times in seconds and the current clock offset estimate (None before any time sync)
+RttSummary = namedtuple('RttSummary', ['samples', 'min', 'p50', 'p90', 'p99', 'max', 'offset'])
+
+
+class MissionClock:
+    def __init__(self, seconds=0.0) -> None:
+        self.set(seconds)
+
+    def set(self, seconds: float):
+        '''Set the time, in seconds since 01/01/2000'''
+        self.base = seconds
+        self.base_monotonic = time.monotonic()
+
+    def now(self) -> float:
+        return self.base + time.monotonic() - self.base_monotonic
+
+
+def wall_clock() -> MissionClock:
+    '''A MissionClock started from this computer's clock'''
+    return MissionClock(time.time() - UNIX_TIME_2000)
+
+
+def time_sync_sample(t1: float, t2: float, t3: float, t4: float) -> TimeSyncSample:
+    return TimeSyncSample((t4 - t1) - (t3 - t2), ((t2 - t1) + (t3 - t4)) / 2)
+
+
+class LinkTiming:
+    def __init__(self, max_samples=256, sync_samples=8) -> None:
+        '''
+            max_samples: round trip times kept for the percentiles
+            sync_samples: recent time syncs the clock offset is picked from
+        '''
+        self.rtts = deque(maxlen=max_samples)
+        self.syncs = deque(maxlen=sync_samples)
+
+    def add_rtt(self, rtt: float):
+        self.rtts.append(rtt)
+
+    def add_sync(self, sample: TimeSyncSample):
+        self.syncs.append(sample)
+        self.add_rtt(sample.rtt)
+
+    def offset(self) -> float:
+        if not self.syncs:
+            return None
+        return min(self.syncs, key=lambda sample: sample.rtt).offset
+
+    def percentile(self, p: float) -> float:
+        '''Nearest rank percentile (0-100) of the round trip times'''
+        if not self.rtts:
+            return None
+        rtts = sorted(self.rtts)
+        return rtts[max(math.ceil(p / 100 * len(rtts)) - 1, 0)]
+
+    def summary(self) -> RttSummary:
+        if not self.rtts:
+            return RttSummary(0, None, None, None, None, None, self.offset())
+        return RttSummary(len(self.rtts), min(self.rtts), self.percentile(50), self.percentile(90),
+                          self.percentile(99), max(self.rtts), self.offset())
+
+    def suggested_timeout(self, margin=2.0) -> float:
+        '''A reply timeout that a healthy link will almost always meet'''
+        p99 = self.percentile(99)
+        return None if p99 is None else p99 * margin
@@ -0,0 +1,155 @@
+'''
+asyncio transport for OBCCommunication.
+
+The serial port is watched by the event loop instead of polling in_waiting, and
+everything to transmit goes through a write queue that a single writer task drains
+with the pacing from obc_pacing. Command handlers only queue their packets, so a long
+downlink never stops new commands being received. Handlers may also be coroutines.
+
+Usage: python obc_async.py [uart_port] [capture file]
+'''
+
+import asyncio
+import sys
+import time
+from obc_comms import OBCCommunication, Command, MessageType
+
+
+class AsyncOBCCommunication(OBCCommunication):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self.write_queue = None
+        self.writer_task = None
+        self.snapshot_task = None
+        self.tasks = set()
+
+    def start(self):
+        '''Start reading and writing on the running event loop'''
+        self.loop = asyncio.get_running_loop()
+        self.write_queue = asyncio.Queue()
+        if self.ser:
+            # Reads only happen once the port is readable, so they should never block
+            self.ser.timeout = 0
+            self.loop.add_reader(self.ser.fileno(), self.on_readable)
+        self.writer_task = self.loop.create_task(self.writer())
+        self.snapshot_task = self.loop.create_task(self.save_metrics()) if self.metrics_path else None
+
+    async def stop(self):
+        '''Stop reading and wait for everything queued to be transmitted'''
+        if self.ser:
+            self.loop.remove_reader(self.ser.fileno())
+        await self.write_queue.join()
+        self.writer_task.cancel()
+        if self.snapshot_task is not None:
+            self.snapshot_task.cancel()
+            self.metrics.save_snapshot(self.metrics_path)
+
+    def on_readable(self):
+        data = self.ser.read(self.ser.in_waiting or 1)
+        if data:
+            self.process_received(data)
+
+    def run_command(self, command: Command, args: tuple):
+        # Handlers only queue their packets, coroutine handlers are run as a task
+        result = command.handler(self, *args)
+        if asyncio.iscoroutine(result):
+            task = self.loop.create_task(result)
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def transmit(self, data: bytes, stamp=None):
+        '''
+            Queue one packet. It is copied now as the frame builder buffer is reused.
+            stamp is called with the ATS command once it is its turn, just before it is written
+        '''
+        command = bytes(self.frame_builder.ats_command(data))
+        self.write_queue.put_nowait(command if stamp is None else (bytearray(command), stamp))
+
+    def downlink_information_packets(self, msg_type: MessageType, contents: bytes, indices=None):
+        # Frames are built lazily by the writer, so the product is never held twice in memory.
+        # Take a view of the contents now so it outlives the caller's view
+        self.write_queue.put_nowait(self.frame_builder.information_frames(
+            msg_type.value, memoryview(contents), indices, self.fec))
+
+    async def writer(self):
+        '''Drain the write queue, pacing every packet'''
+        while True:
+            job = await self.write_queue.get()
+            try:
+                if isinstance(job, bytes):
+                    await self.pace()
+                    await self.write(job)
+                    continue
+                if isinstance(job, tuple):
+                    command, stamp = job
+                    await self.pace()
+                    stamp(command)
+                    await self.write(command)
+                    continue
+
+                # A product, pull each frame from the builder only once it is its turn to
+                # be sent, so packets queued in the meantime can't overwrite it
+                packets = 0
+                start_time = time.monotonic()
+                while True:
+                    await self.pace()
+                    frame = next(job, None)
+                    if frame is None:
+                        break
+                    await self.write(self.frame_builder.ats_command(frame))
+                    packets += 1
+                seconds = time.monotonic() - start_time
+                self.metrics.record_downlink(packets, seconds)
+                print(
+                    f"Downlinked {packets} packets in {seconds:.2f}s ({packets / seconds if seconds else 0:.1f} packets/s)")
+            finally:
+                self.write_queue.task_done()
+
+    async def save_metrics(self):
+        '''Snapshot the link metrics to disk every metrics.snapshot_interval seconds'''
+        while True:
+            await asyncio.sleep(self.metrics.snapshot_interval)
+            self.metrics.save_snapshot(self.metrics_path)
+
+    async def pace(self):
+        pacer = self.pacer
+        if pacer.window:
+            deadline = time.monotonic() + pacer.credit_timeout
+            while pacer.credits <= 0:
+                if time.monotonic() >= deadline:
+                    # The grant never arrived, treat it as a loss and carry on with one packet
+                    pacer.report_loss()
+                    pacer.credits = 1
+                    break
+                # Credits arrive through on_readable while we wait
+                await asyncio.sleep(0.005)
+
+        delay = pacer.last_send + pacer.gap - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def write(self, command):
+        if not self.ser:
+            print("Serial connection does not exist, cannot transmit data")
+            return
+        start = time.monotonic()
+        self.ser.write(command)
+        # Let the UART drain without blocking the loop so the pacer can measure the link
+        while self.ser.out_waiting:
+            await asyncio.sleep(0.001)
+        self.pacer.sent(time.monotonic() - start)
+
+
+async def main(uart_port='/dev/ttyS4', capture_path=None, metrics_path='link_metrics.jsonl'):
+    obc_com = AsyncOBCCommunication(uart_port, capture_path=capture_path, metrics_path=metrics_path)
+    obc_com.start()
+    try:
+        # Everything happens in the reader callback and writer task
+        await asyncio.Event().wait()
+    finally:
+        await obc_com.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:3]))
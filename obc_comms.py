@@ -2,7 +2,17 @@ import serial
 import struct
 import time
 import math
+from collections import namedtuple
 from enum import Enum, unique
+from image_codec import Compression, Ordering, compress_image, compress_segments, interlace
+from link_timing import TIME_SYNC_REPLY, TIME_SYNC_REQUEST, TIME_SYNC_SEND_TIME, TIME_SYNC_SEND_TIME_OFFSET, MissionClock
+from obc_framing import ATS_HEADER, FecParameters, FrameBuilder, FrameReassembler, ReceivedFrame, decode_packet_selection
+from obc_image_store import ImageStore
+from obc_link_metrics import LinkMetrics
+from obc_pacing import AdaptivePacer
+from obc_utils import get_wod_rollup
+from obc_wod_rollup import pack_rollup
+from serial_capture import CaptureSerial, CaptureWriter
 
 
 @unique
@@ -14,6 +24,8 @@ class MessageType(Enum):
     TIME = 5
     PONG = 6
     DEBUG = 7
+    WOD_ROLLUP = 8
+    TIME_SYNC = 9
 
 
 @unique
@@ -28,20 +40,83 @@ class CommandType(Enum):
     CLEAR_STORAGE_DATA = 8
     ACTIVATE_PAYLOAD_STRIKING_MECHANISM = 9
     PERFORM_SCIENCE_MEASUREMENT = 10
+    GRANT_DOWNLINK_CREDIT = 11
+    REQUEST_RETRANSMIT = 12
+    REQUEST_WOD_ROLLUP = 13
+    TIME_SYNC = 14
+    SET_FEC = 15
+    SET_CREDIT_WINDOW = 16
+
+
+# Arguments of a ground station command start after the address, message type and command type
+COMMAND_ARGS_OFFSET = 6
+
+# A registered ground station command. decoder is a precompiled struct.Struct for the arguments
+Command = namedtuple('Command', ['name', 'handler', 'decoder'])
+
+# A downlinked product. Images are read back from the image store, so only their path is kept
+Product = namedtuple('Product', ['header_contents', 'contents', 'image_path'])
+
+# Science image header packet contents: message type, camera number, width, height, timestamp,
+# first packet index, compression mode, the length of the (compressed) image data, compression level,
+# pixel ordering, number of interlaced passes and the number of packets up to the end of each pass
+SCIENCE_IMAGE_HEADER = struct.Struct('<BbhhihBIBBB4H')
+MAX_IMAGE_PASSES = 4
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# WOD rollup header packet contents: message type, window size in seconds and number of buckets
+WOD_ROLLUP_HEADER = struct.Struct('<BHH')
+# WOD rollup request arguments: window size in seconds and number of windows
+WOD_ROLLUP_REQUEST = struct.Struct('<HB')
+
+# Bytes left in a retransmit request for the packet selection
+RETRANSMIT_SELECTION_LENGTH = 55
+
+# Message types followed by information packets, their header packets carry the FEC parameters
+PRODUCT_TYPES = {MessageType.WOD.value, MessageType.SCIENCE_IMAGE.value, MessageType.WOD_ROLLUP.value}
 
 
 class OBCCommunication:
-    def __init__(self, uart_port='/dev/ttyS4', baud_rate=19200, timeout=2, channel=0, packet_length=64, SSID="CUBE") -> None:
+    # Maps the command type byte to its Command, see register_command
+    commands = {}
+
+    def __init__(self, uart_port='/dev/ttyS4', baud_rate=19200, timeout=2, channel=0, packet_length=64, SSID="CUBE", ser=None,
+                 capture_path=None, metrics_path=None, credit_window=0) -> None:
+        '''
+            ser: an already open serial port (or stand-in such as zetaplus_sim) to use instead of opening uart_port
+            capture_path: record all serial traffic to this file, see serial_capture.py
+            metrics_path: link metrics snapshots are appended to this file, see obc_link_metrics.py. None keeps
+            the metrics in memory only. Each link needs a file of its own
+            credit_window: packets sent before waiting for a credit grant from the ground station, 0 disables
+            credit flow control. The ground station can change it with the set credit window command
+        '''
+        self.SSID = SSID
+        self.packet_length = packet_length
+        self.channel = channel
+        # CubeSat time in seconds since 01/01/2000, set by the ground station
+        self.clock = MissionClock()
+        self.reassembler = FrameReassembler(packet_length)
+        self.frame_builder = FrameBuilder(channel, packet_length)
+        # With a window packets are only sent against credits granted by the ground station
+        self.pacer = AdaptivePacer(window=credit_window)
+        self.deferred_commands = []
+        self.image_store = ImageStore()
+        # Last product downlinked for each message type, kept for retransmit requests
+        self.products = {}
+        # FecParameters for the parity packets sent with information packets, None sends none
+        self.fec = None
+        self.metrics = LinkMetrics()
+        self.metrics_path = metrics_path
         try:
-            self.SSID = SSID
-            self.packet_length = packet_length
-            self.channel = channel
-            self.ser = serial.Serial(uart_port, baud_rate, timeout=timeout)
-            self.latestTimeStamp = 0
+            self.ser = ser if ser is not None else serial.Serial(
+                uart_port, baud_rate, timeout=timeout)
         except serial.SerialException as e:
             print("Serial port error:", e)
             self.ser = None
             return
+        if capture_path:
+            self.ser = CaptureSerial(self.ser, CaptureWriter(capture_path))
         # Initialise transceiver
         # Set to receive mode on channel 0 with packet sizes of 64
         self.ATR(channel, packet_length)
@@ -55,29 +130,39 @@ class OBCCommunication:
 
     # Check if we've received a ground station command and process accordingly
     def receiveTransmission(self):
+        if self.metrics_path:
+            self.metrics.save_if_due(self.metrics_path)
         if self.ser.in_waiting == 0:
             return
 
         data = self.ser.read(self.ser.in_waiting)
         print(data.decode(errors='ignore').strip())
+        self.process_received(data)
 
-        if len(data) < 64:
-            return
-
-        # Validate header byte of a new packet
-        if data[:2] != b"#R":
-            return
+    def process_received(self, data: bytes):
+        # A read can hold part of a packet or several packets back to back
+        discarded = self.reassembler.bytes_discarded
+        frames = self.reassembler.feed(data)
+        self.metrics.record_discarded(self.reassembler.bytes_discarded - discarded)
+        for frame in frames:
+            self.process_frame(frame)
 
-        # Read packet length and signal strength
-        packet_length, signal_strength = struct.unpack("BB", data[2:4])
+    def process_frame(self, frame: ReceivedFrame):
         print(
-            f'packet length: {packet_length}, signal_strength: {signal_strength}')
+            f'packet length: {frame.packet_length}, signal_strength: {frame.signal_strength}')
+
+        self.metrics.record_frame(frame.signal_strength)
 
-        # Now read the actual packet contents
-        data = data[4:]  # Trim out the header stuf from zetaplus
+        # Now read the actual packet contents, the zetaplus header has already been removed
+        data = frame.payload
+        # Need at least the address, message type and command type
+        if len(data) < 6:
+            self.metrics.record_frame_error()
+            return
         # Check the target address matches the CubeSat's address
         target_address = data[:4].decode(errors="ignore")
         if target_address != self.SSID:
+            self.metrics.record_frame_error()
             return
 
         msg_type = struct.unpack("<B", data[4:5])[0]
@@ -86,89 +171,259 @@ class OBCCommunication:
         if msg_type != MessageType.GROUND_STATION_COMMAND.value:
             return
 
-        cmd_type = struct.unpack("<B", data[5:6])[0]
-
-        if cmd_type == CommandType.REQUEST_WOD.value:
-            print("CommandType is REQUEST_WOD")
-            self.CMD_request_wod(data[6:])
-
-        elif cmd_type == CommandType.REQUEST_SCIENCE_IMAGE.value:
-            print("CommandType is REQUEST_SCIENCE_IMAGE")
-            self.CMD_request_science_image(data[6:])
-        elif cmd_type == CommandType.REQUEST_SCIENCE_THERMO_AND_CURRENT.value:
-            print("CommandType is REQUEST_SCIENCE_THERMO_AND_CURRENT")
-        elif cmd_type == CommandType.SEND_PING.value:
-            print("CommandType is SEND_PING")
-            self.CMD_ping(data)
-        elif cmd_type == CommandType.REQUEST_TIME.value:
-            print("CommandType is REQUEST_TIME")
-            self.CMD_request_time()
-        elif cmd_type == CommandType.SET_TIME.value:
-            print("CommandType is SET_TIME")
-            self.CMD_set_time(data[6:])
-        elif cmd_type == CommandType.SET_OPERATING_MODE.value:
-            self.CMD_set_operating_mode(data[6:])
-            print("CommandType is SET_OPERATING_MODE")
-        elif cmd_type == CommandType.CLEAR_STORAGE_DATA.value:
-            print("CommandType is CLEAR_STORAGE_DATA")
-        elif cmd_type == CommandType.ACTIVATE_PAYLOAD_STRIKING_MECHANISM.value:
-            print("CommandType is ACTIVATE_PAYLOAD_STRIKING_MECHANISM")
-            self.CMD_activate_payload_strike()
-        elif cmd_type == CommandType.PERFORM_SCIENCE_MEASUREMENT.value:
-            print("CommandType is PERFORM_SCIENCE_MEASUREMENT")
-            self.CMD_perform_science_measurement()
-        else:
+        self.dispatch_command(data[5], data)
+
+    def dispatch_command(self, cmd_type: int, data: bytes):
+        '''
+            Look up the handler for a command type and call it with the decoded arguments.
+            data is the whole packet contents, the arguments start after the command type byte
+        '''
+        command = self.commands.get(cmd_type)
+        if command is None:
             print("Unknown CommandType")
+            return
+        if self.pacer.busy and cmd_type != CommandType.GRANT_DOWNLINK_CREDIT.value:
+            # Received while waiting for downlink credits, run it once the downlink has finished
+            self.deferred_commands.append((cmd_type, bytes(data)))
+            return
+        print(f"CommandType is {command.name}")
+        if command.decoder is None:
+            args = ()
+        else:
+            try:
+                args = command.decoder.unpack_from(data, COMMAND_ARGS_OFFSET)
+            except struct.error as e:
+                print(f"Invalid arguments for {command.name}: {e}")
+                self.metrics.record_frame_error()
+                return
+
+        if cmd_type == CommandType.GRANT_DOWNLINK_CREDIT.value:
+            command.handler(self, *args)
+            return
+
+        self.run_command(command, args)
+
+        while self.deferred_commands:
+            self.dispatch_command(*self.deferred_commands.pop(0))
+
+    def run_command(self, command: Command, args: tuple):
+        '''Run a command handler, which transmits any response before returning'''
+        self.pacer.begin()
+        command.handler(self, *args)
+        stats = self.pacer.end()
+        self.metrics.record_downlink(stats.packets, stats.seconds)
+        if stats.packets:
+            print(
+                f"Downlinked {stats.packets} packets in {stats.seconds:.2f}s ({stats.packets_per_second:.1f} packets/s)")
 
-    ''' For all CMD functions, bytes contains all the data AFTER the command type, ie any additional arguments'''
+    @classmethod
+    def register_command(cls, cmd_type, handler, arg_format: str = None, name: str = None):
+        '''
+            Register a handler for a ground station command. Existing handlers can be replaced.
+            cmd_type: CommandType or the raw command type byte
+            handler: called as handler(obc_communication, *args)
+            arg_format: struct format of the arguments after the command type byte, or None if there are none
+        '''
+        if isinstance(cmd_type, CommandType):
+            name = name or cmd_type.name
+            cmd_type = cmd_type.value
+        decoder = struct.Struct(arg_format) if arg_format else None
+        cls.commands[cmd_type] = Command(
+            name or f"COMMAND_{cmd_type}", handler, decoder)
 
-    def CMD_request_wod(self, data: bytes = None):
+    ''' For all CMD functions, the arguments have already been decoded using the format they were registered with'''
+
+    def CMD_request_wod(self):
         header_contents = struct.pack('B', MessageType.WOD.value)
+        contents = b'a'*260
+        self.products[MessageType.WOD.value] = Product(
+            header_contents, contents, None)
+        self.downlink_header_packet(header_contents)
+        self.downlink_information_packets(MessageType.WOD, contents)
+
+    def CMD_request_wod_rollup(self, window_seconds: int, n_windows: int):
+        '''
+            Min/max/mean of each WOD reading over the last n_windows windows of window_seconds
+            (60, 600 or 3600), instead of every sample. See obc_wod_rollup
+        '''
+        try:
+            buckets = get_wod_rollup().rollup(window_seconds, n_windows)
+        except ValueError as e:
+            self.downlink_debug_message(str(e))
+            return
+        header_contents = WOD_ROLLUP_HEADER.pack(
+            MessageType.WOD_ROLLUP.value, window_seconds, len(buckets))
+        contents = pack_rollup(buckets)
+        self.products[MessageType.WOD_ROLLUP.value] = Product(
+            header_contents, contents, None)
         self.downlink_header_packet(header_contents)
-        self.downlink_information_packets(MessageType.WOD, b'a'*260)
+        self.downlink_information_packets(MessageType.WOD_ROLLUP, contents)
 
-    def CMD_request_science_image(self, data: bytes):
-        camera_number, resume_packet, packets_to_send, timestamp = struct.unpack(
-            "<bhhi", data[:9])
+    def CMD_request_science_image(self, camera_number: int, resume_packet: int, packets_to_send: int, timestamp: int,
+                                  compression: int = 0, level: int = 0, ordering: int = 0, passes: int = 0):
+        '''
+            resume_packet: index of the first packet to send, 0 is the start of the image
+            packets_to_send: number of packets to send from resume_packet, 0 sends the rest of the image
+            compression: image_codec.Compression mode, level: compression level, 0 uses the default
+            ordering: image_codec.Ordering. INTERLACED sends a coarse image first and refines it in passes
+            passes: for INTERLACED, stop after this many passes (0 sends them all). The ground station asks
+                    for more detail by resuming from the end of the last pass it received
+        '''
         print(timestamp, camera_number, resume_packet, packets_to_send)
-        width, height, pixels = self.read_greyscale_data_from_binary(
-            'sample_img/nerd64.bin')
-
-        print(len(pixels))
-        print(f'width: {width}, height: {height}, num pixels: {len(pixels)}')
-        print(type(timestamp))
-        header_contents = struct.pack(
-            '<bhhih', camera_number, width, height, timestamp, resume_packet)
+        image_path = 'sample_img/nerd64.bin'
+        image = self.image_store.get(image_path)
+        if image is None:
+            return
+
+        print(
+            f'width: {image.width}, height: {image.height}, num pixels: {len(image.pixels)}')
+        try:
+            compression = Compression(compression)
+        except ValueError:
+            print(f"Unknown compression mode {compression}, sending raw")
+            compression = Compression.RAW
+        try:
+            ordering = Ordering(ordering)
+        except ValueError:
+            print(f"Unknown pixel ordering {ordering}, sending row major")
+            ordering = Ordering.ROW_MAJOR
+        level = level or DEFAULT_COMPRESSION_LEVEL
+
+        pass_ends = []
+        if ordering == Ordering.INTERLACED:
+            if compression == Compression.LZMA:
+                # Each pass has to be decodable on its own, which LZMA can't do
+                print("LZMA can't be sent progressively, using ZLIB")
+                compression = Compression.ZLIB
+            pixels, pass_lengths = interlace(
+                image.pixels, image.width, image.height)
+            contents, ends = compress_segments(
+                pixels, image.width, compression, level, pass_lengths)
+            pass_ends = [self.frame_builder.n_information_packets(end) for end in ends]
+        elif compression == Compression.RAW:
+            # The pixels are sent straight from the memory mapped file
+            contents = image.pixels
+        else:
+            contents = compress_image(
+                image.pixels, image.width, image.height, compression, level)
+        if compression != Compression.RAW:
+            print(
+                f'Compressed {len(image.pixels)} bytes to {len(contents)} ({compression.name})')
+
+        n_packets = self.frame_builder.n_information_packets(len(contents))
+        resume_packet = max(resume_packet, 0)
+        last_packet = n_packets
+        if pass_ends and 0 < passes <= len(pass_ends):
+            last_packet = pass_ends[passes - 1]
+        if packets_to_send > 0:
+            last_packet = min(resume_packet + packets_to_send, last_packet)
+        header_contents = SCIENCE_IMAGE_HEADER.pack(
+            MessageType.SCIENCE_IMAGE.value, camera_number, image.width, image.height, timestamp, resume_packet,
+            compression.value, len(contents), level, ordering.value, len(pass_ends),
+            *(pass_ends + [0] * (MAX_IMAGE_PASSES - len(pass_ends))))
+        if contents is image.pixels:
+            product = Product(header_contents, None, image_path)
+        else:
+            product = Product(header_contents, contents, None)
+        self.products[MessageType.SCIENCE_IMAGE.value] = product
         self.downlink_header_packet(header_contents)
         self.downlink_information_packets(
-            MessageType.SCIENCE_IMAGE, struct.pack(f'{len(pixels)}B', *pixels))
+            MessageType.SCIENCE_IMAGE, contents, range(resume_packet, last_packet))
+
+    def CMD_request_retransmit(self, msg_type: int, camera_number: int, mode: int, selection: bytes):
+        '''
+            Selective repeat, resend only the requested packets of the last product downlinked
+            for msg_type. The packets are given as a list of ranges or a NACK bitmap, see
+            obc_framing.encode_packet_selection
+        '''
+        product = self.products.get(msg_type)
+        if product is None:
+            print(f"Nothing to retransmit for message type {msg_type}")
+            return
+        if product.image_path is not None:
+            image = self.image_store.get(product.image_path)
+            if image is None:
+                return
+            contents = image.pixels
+        else:
+            contents = product.contents
+
+        indices = decode_packet_selection(
+            mode, selection, self.frame_builder.n_information_packets(len(contents)))
+        print(f"Retransmitting {len(indices)} packets")
+        self.metrics.record_retransmit(len(indices))
+        # Every retransmit request means packets were lost, so slow down
+        self.pacer.report_loss(len(indices))
+        self.downlink_header_packet(product.header_contents)
+        self.downlink_information_packets(
+            MessageType(msg_type), contents, indices)
 
-    def CMD_request_science_reading(self, data: bytes):
+    def CMD_request_science_reading(self, timestamp: int):
         pass
 
-    def CMD_ping(self, data: bytes = None):
+    def CMD_ping(self):
         response_contents = struct.pack('B', MessageType.PONG.value)
         self.downlink_header_packet(response_contents)
 
-    def CMD_request_time(self, data: bytes = None):
-        self.downlink_header_packet(struct.pack('<I', self.latestTimeStamp))
+    def CMD_request_time(self):
+        self.downlink_header_packet(struct.pack('<BI', MessageType.TIME.value, int(self.clock.now())))
+
+    def CMD_set_time(self, timestamp: int):
+        print(f"Setting time to {timestamp}")
+        self.clock.set(timestamp)
+
+    def CMD_time_sync(self, sequence: int, ground_time: float):
+        '''
+            Reply to a time sync with when the request arrived and when the reply left on the CubeSat clock,
+            see link_timing.py
+        '''
+        received = self.clock.now()
+        # The reply may wait for the pacer or behind a product being downlinked, so the time it
+        # leaves is only written in by stamp_time_sync_reply as it goes to the transceiver
+        self.transmit(self.frame_builder.header_frame(TIME_SYNC_REPLY.pack(
+            MessageType.TIME_SYNC.value, sequence, ground_time, received, 0.0)), self.stamp_time_sync_reply)
+
+    def stamp_time_sync_reply(self, command):
+        '''Write the time now into the ATS command of a time sync reply about to be written'''
+        TIME_SYNC_SEND_TIME.pack_into(
+            command, ATS_HEADER.size + len(self.frame_builder.address) + TIME_SYNC_SEND_TIME_OFFSET, self.clock.now())
+
+    def CMD_set_fec(self, block_packets: int, parity_packets: int):
+        '''
+            Send parity_packets parity packets after every block_packets information packets,
+            so the ground station can rebuild lost packets without a retransmit request.
+            0 parity packets turns it off, see obc_framing
+        '''
+        if parity_packets == 0 or block_packets == 0:
+            print("Forward error correction off")
+            self.fec = None
+            return
+        parity_packets = min(parity_packets, block_packets)
+        print(f"Forward error correction: {parity_packets} parity packets every {block_packets} packets")
+        self.fec = FecParameters(block_packets, parity_packets)
 
-    def CMD_set_time(self, data: bytes):
-        time = struct.unpack("<I", data[:4])
-        print(f"Setting time to {time}")
-        self.latestTimeStamp = time
+    def CMD_set_credit_window(self, window: int):
+        '''
+            Only send window packets ahead of the credits granted by the ground station, which grants
+            more as the packets arrive. 0 turns credit flow control off, see obc_pacing
+        '''
+        print(f"Credit window: {window} packets" if window else "Credit flow control off")
+        self.pacer.window = window
+        self.pacer.credits = window
 
-    def CMD_set_operating_mode(self, data: bytes):
-        operating_mode = struct.unpack("B", data[:1])
+    def CMD_set_operating_mode(self, operating_mode: int):
         print(f"Setting operating mode to {operating_mode}")
 
-    def CMD_clear_storage_data(self, data: bytes):
+    def CMD_grant_downlink_credit(self, credits: int):
+        self.pacer.grant(credits)
+
+    def CMD_clear_storage_data(self):
         pass
 
-    def CMD_activate_payload_strike(self, data: bytes = None):
+    def CMD_activate_payload_strike(self):
         pass
 
-    def CMD_perform_science_measurement(self, data: bytes):
+    def CMD_perform_science_measurement(self):
         pass
 
     # All contents to be sent in the header packet AFTER SSID
@@ -176,25 +431,21 @@ class OBCCommunication:
         '''
             Transmit a header packet. The target address is automatically added
             Provide all subsequent arguments as a byte array. Padding automatically added
+            A product's header also says how its parity packets are sent, see obc_framing.HEADER_FEC
         '''
-        data = (b'USYD' + contents).ljust(self.packet_length, b'\x00')
-        self.transmit(data)
+        fec = self.fec if contents[0] in PRODUCT_TYPES else None
+        self.transmit(self.frame_builder.header_frame(contents, fec))
 
-    def downlink_information_packets(self, msg_type: MessageType, contents: bytes):
+    def downlink_information_packets(self, msg_type: MessageType, contents: bytes, indices=None):
         # Each info packet contains:
         # uint16 with number of packets left
         # uint8 with message type
         # Remaining 61 bytes are the data contents, padded with 0
-        n_packets = math.ceil(len(contents)/61.0)
-        for i in range(n_packets - 1, -1, -1):
-            print(i)
-            buffer = struct.pack("<HB", i, msg_type.value)
-            buffer += contents[(n_packets-i-1)*61: (n_packets-i)*61]
-            buffer = buffer.ljust(self.packet_length, b'\x00')
-            print(buffer)
-            # Allow other side enough time to process
-            time.sleep(0.1)
-            self.transmit(buffer)
+        # indices selects which packets to send (0 is the first packet), None sends them all
+        # Parity packets follow each block if forward error correction is on, see CMD_set_fec
+        # transmit paces the packets so the other side has enough time to process
+        for frame in self.frame_builder.information_frames(msg_type.value, contents, indices, self.fec):
+            self.transmit(frame)
 
     def downlink_debug_message(self, message: str):
         '''
@@ -204,17 +455,27 @@ class OBCCommunication:
         n_messages = math.ceil(len(message)/59.0)
 
         for i in range(n_messages):
-            buffer = struct.pack("B", MessageType.DEBUG.value)
-            buffer += message[i*59:(i+1)*59].encode()
-            buffer = buffer.ljust(60, b'\x00')
-            time.sleep(0.1)
-            self.transmit(buffer)
+            frame = self.frame_builder.header_frame(
+                struct.pack('B', MessageType.DEBUG.value) + message[i*59:(i+1)*59].encode())
+            self.transmit(frame)
 
-    def transmit(self, data: bytes):
+    def transmit(self, data: bytes, stamp=None):
+        '''
+            Send one packet as a single ATS command.
+            Frames from self.frame_builder are already in the transmit buffer and are not copied
+            Packets are paced by self.pacer rather than a fixed sleep
+            stamp: called with the ATS command just before it is written, eg. stamp_time_sync_reply
+        '''
         if self.ser:
-            self.ser.write("ATS".encode())
-            self.ser.write(struct.pack("BB", self.channel, self.packet_length))
-            self.ser.write(data)
+            self.pacer.wait(self.receiveTransmission)
+            command = self.frame_builder.ats_command(data)
+            if stamp is not None:
+                stamp(command)
+            start = time.monotonic()
+            self.ser.write(command)
+            # Wait for the UART to drain so the pacer knows how fast the link is taking packets
+            self.ser.flush()
+            self.pacer.sent(time.monotonic() - start)
         else:
             print("Serial connection does not exist, cannot transmit data")
 
@@ -290,10 +551,46 @@ class OBCCommunication:
         # self.ser.write(img_msg)
         # time.sleep(0.5)
         # self.receiveTransmission()
-        self.CMD_request_science_image(img_msg[6:])
+        self.dispatch_command(img_msg[9], img_msg[4:])
+
+
+# Ground station commands understood by the CubeSat and the format of their arguments
+OBCCommunication.register_command(
+    CommandType.REQUEST_WOD, OBCCommunication.CMD_request_wod)
+OBCCommunication.register_command(
+    CommandType.REQUEST_SCIENCE_IMAGE, OBCCommunication.CMD_request_science_image, "<bhhiBBBB")
+OBCCommunication.register_command(
+    CommandType.REQUEST_SCIENCE_THERMO_AND_CURRENT, OBCCommunication.CMD_request_science_reading, "<I")
+OBCCommunication.register_command(
+    CommandType.SEND_PING, OBCCommunication.CMD_ping)
+OBCCommunication.register_command(
+    CommandType.REQUEST_TIME, OBCCommunication.CMD_request_time)
+OBCCommunication.register_command(
+    CommandType.SET_TIME, OBCCommunication.CMD_set_time, "<I")
+OBCCommunication.register_command(
+    CommandType.SET_OPERATING_MODE, OBCCommunication.CMD_set_operating_mode, "B")
+OBCCommunication.register_command(
+    CommandType.CLEAR_STORAGE_DATA, OBCCommunication.CMD_clear_storage_data)
+OBCCommunication.register_command(
+    CommandType.ACTIVATE_PAYLOAD_STRIKING_MECHANISM, OBCCommunication.CMD_activate_payload_strike)
+OBCCommunication.register_command(
+    CommandType.PERFORM_SCIENCE_MEASUREMENT, OBCCommunication.CMD_perform_science_measurement)
+OBCCommunication.register_command(
+    CommandType.GRANT_DOWNLINK_CREDIT, OBCCommunication.CMD_grant_downlink_credit, "<H")
+OBCCommunication.register_command(
+    CommandType.REQUEST_RETRANSMIT, OBCCommunication.CMD_request_retransmit, f"<BbB{RETRANSMIT_SELECTION_LENGTH}s")
+OBCCommunication.register_command(
+    CommandType.REQUEST_WOD_ROLLUP, OBCCommunication.CMD_request_wod_rollup, WOD_ROLLUP_REQUEST.format)
+OBCCommunication.register_command(
+    CommandType.TIME_SYNC, OBCCommunication.CMD_time_sync, TIME_SYNC_REQUEST.format)
+OBCCommunication.register_command(
+    CommandType.SET_FEC, OBCCommunication.CMD_set_fec, "<BB")
+OBCCommunication.register_command(
+    CommandType.SET_CREDIT_WINDOW, OBCCommunication.CMD_set_credit_window, "<H")
 
 
 if __name__ == '__main__':
-    obc_com = OBCCommunication()
-    while True:
-        obc_com.receiveTransmission()
+    # Run on the asyncio transport rather than polling receiveTransmission in a loop
+    import asyncio
+    from obc_async import main
+    asyncio.run(main())
@@ -0,0 +1,483 @@
+'''
+Framing helpers for the ZetaPlus UART stream.
+
+Received packets from the transceiver look like:
+#R - 2 byte header
+uint8 - packet length
+uint8 - signal strength (RSSI)
+packet length bytes - the packet contents
+
+Reads from the UART can end part way through a packet or contain several packets
+back to back, so frames are pulled out of a persistent receive buffer rather than
+assuming one read == one packet.
+
+Outgoing frames are built in place in a preallocated transmit buffer, see FrameBuilder.
+The ground station puts information packets back together with PacketAssembler.
+
+Forward error correction (optional, see FecParameters): after every block_packets information
+packets, parity_packets parity packets are sent. Parity packet j of a block is the XOR of the
+payloads of the packets j, j + parity_packets, j + 2 * parity_packets ... of the block, so the
+ground station can rebuild one lost packet from each of those groups without asking for it
+again. Up to parity_packets lost packets in a block are rebuilt as long as they are in different
+groups, which a burst of up to parity_packets packets in a row always is.
+A parity packet has the FEC_PARITY bit set in its message type, and block * parity_packets + j
+in place of the packets remaining. The header packet of a product ends with the FecParameters
+its information packets are sent with (HEADER_FEC), so the ground station needs no other state.
+'''
+
+import math
+import struct
+from collections import namedtuple
+
+
+FRAME_HEADER = b'#R'
+FRAME_HEADER_LENGTH = 4
+
+ReceivedFrame = namedtuple(
+    'ReceivedFrame', ['packet_length', 'signal_strength', 'payload'])
+
+
+class FrameReassembler:
+    '''
+        Incremental framing state machine for '#R' packets.
+        Feed it raw bytes as they arrive, and it returns every complete frame found so far.
+        Partial frames are kept in the buffer until the rest arrives.
+    '''
+
+    # States of the framing state machine
+    HUNT = 0      # Looking for the '#R' header
+    HEADER = 1    # Found '#R', waiting for the length and RSSI bytes
+    PAYLOAD = 2   # Header parsed, waiting for the packet contents
+
+    def __init__(self, max_packet_length=64) -> None:
+        self.max_packet_length = max_packet_length
+        self.buffer = bytearray()
+        self.state = FrameReassembler.HUNT
+        self.packet_length = 0
+        self.signal_strength = 0
+        # Statistics, useful to see how noisy the link is
+        self.frames_received = 0
+        self.bytes_discarded = 0
+
+    def feed(self, data: bytes) -> list:
+        '''
+            Add newly read bytes to the receive buffer and return a list of ReceivedFrame
+            for every complete frame now available
+        '''
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        # Offset of the first unconsumed byte. The buffer is only trimmed once per call
+        pos = 0
+        end = len(buffer)
+
+        while True:
+            if self.state == FrameReassembler.HUNT:
+                start = buffer.find(FRAME_HEADER, pos)
+                if start == -1:
+                    # Keep a trailing '#' in case the 'R' is in the next read
+                    keep = 1 if end > pos and buffer[end - 1] == FRAME_HEADER[0] else 0
+                    self.bytes_discarded += end - pos - keep
+                    pos = end - keep
+                    break
+                self.bytes_discarded += start - pos
+                pos = start
+                self.state = FrameReassembler.HEADER
+
+            if self.state == FrameReassembler.HEADER:
+                if end - pos < FRAME_HEADER_LENGTH:
+                    break
+                packet_length = buffer[pos + 2]
+                if packet_length == 0 or packet_length > self.max_packet_length:
+                    # Not a real header, skip the '#' and resync on the next '#R'
+                    self.bytes_discarded += 1
+                    pos += 1
+                    self.state = FrameReassembler.HUNT
+                    continue
+                self.packet_length = packet_length
+                self.signal_strength = buffer[pos + 3]
+                pos += FRAME_HEADER_LENGTH
+                self.state = FrameReassembler.PAYLOAD
+
+            if self.state == FrameReassembler.PAYLOAD:
+                if end - pos < self.packet_length:
+                    break
+                frames.append(ReceivedFrame(self.packet_length, self.signal_strength,
+                                            bytes(buffer[pos:pos + self.packet_length])))
+                pos += self.packet_length
+                self.frames_received += 1
+                self.state = FrameReassembler.HUNT
+
+        # Drop everything that has been consumed. A partial header or payload stays at the
+        # front of the buffer for the next call. Deleting from the front of a bytearray
+        # does not move the remaining bytes
+        del buffer[:pos]
+        return frames
+
+    def reset(self):
+        '''Discard any partially received frame'''
+        self.buffer.clear()
+        self.state = FrameReassembler.HUNT
+
+    def pending(self) -> int:
+        '''Number of bytes currently held waiting for the rest of a frame'''
+        return len(self.buffer)
+
+
+# Information packets start with uint16 packets remaining and uint8 message type
+INFO_HEADER = struct.Struct('<HB')
+# Bytes of the product in each information packet of the usual 64 byte packets
+INFO_PAYLOAD_LENGTH = 64 - INFO_HEADER.size
+ATS_HEADER = struct.Struct('<3sBB')
+
+# Set in the message type of a parity packet
+FEC_PARITY = 0x80
+
+# Parity packets sent after every block of information packets, see the module docstring
+FecParameters = namedtuple('FecParameters', ['block_packets', 'parity_packets'])
+# The last bytes of a product's header packet, its FecParameters or 0, 0 if it has no parity packets
+HEADER_FEC = struct.Struct('<BB')
+
+
+def header_fec(contents) -> FecParameters:
+    '''The FecParameters at the end of a received header packet (contents after the address), None if off'''
+    if len(contents) < HEADER_FEC.size:
+        return None
+    block_packets, parity_packets = HEADER_FEC.unpack_from(contents, len(contents) - HEADER_FEC.size)
+    if not block_packets or not parity_packets:
+        return None
+    return FecParameters(block_packets, parity_packets)
+
+
+def is_parity_packet(packet) -> bool:
+    return len(packet) >= INFO_HEADER.size and bool(packet[2] & FEC_PARITY)
+
+
+# A parity packet to send in place of an information packet index, see fec_schedule
+ParityIndex = namedtuple('ParityIndex', ['block', 'group', 'fec'])
+
+
+def parity_group(fec: FecParameters, n_packets: int, block: int, group: int) -> range:
+    '''Indices of the information packets parity packet group of block covers'''
+    start = block * fec.block_packets
+    return range(start + group, min(start + fec.block_packets, n_packets), fec.parity_packets)
+
+
+def fec_schedule(indices, n_packets: int, fec: FecParameters) -> list:
+    '''
+        The packet indices to send, with a ParityIndex for each parity packet of a block after its
+        last packet. Only blocks whose packets are all in indices get parity packets, so a
+        retransmission of a few packets sends none
+    '''
+    indices = list(dict.fromkeys(i for i in indices if 0 <= i < n_packets))
+    # Packets still to be sent of each block that is sent whole
+    blocks_left = {}
+    for index in indices:
+        block = index // fec.block_packets
+        blocks_left[block] = blocks_left.get(block, 0) + 1
+    blocks_left = {block: count for block, count in blocks_left.items()
+                   if count == len(range(block * fec.block_packets, min((block + 1) * fec.block_packets, n_packets)))}
+    schedule = []
+    for index in indices:
+        schedule.append(index)
+        block = index // fec.block_packets
+        if block in blocks_left:
+            blocks_left[block] -= 1
+            if not blocks_left[block]:
+                schedule.extend(ParityIndex(block, group, fec) for group in range(fec.parity_packets)
+                                if parity_group(fec, n_packets, block, group))
+    return schedule
+
+
+class FrameBuilder:
+    '''
+        Builds outgoing frames in place inside one preallocated transmit buffer.
+        The buffer holds the whole ATS command (ATS, channel, packet length, frame) so each
+        frame goes to the UART in a single write.
+
+        Frames handed out by this class are memoryviews into the shared buffer, they are only
+        valid until the next frame is built. Transmit (or copy) each one before asking for the next.
+    '''
+
+    def __init__(self, channel=0, packet_length=64, address=b'USYD') -> None:
+        self.packet_length = packet_length
+        self.address = address
+        self.info_payload_length = packet_length - INFO_HEADER.size
+        self.tx_buffer = bytearray(ATS_HEADER.size + packet_length)
+        self.command = memoryview(self.tx_buffer)
+        self.frame = self.command[ATS_HEADER.size:]
+        self.zeros = bytes(packet_length)
+        self.set_channel(channel)
+
+    def set_channel(self, channel):
+        ATS_HEADER.pack_into(self.tx_buffer, 0, b'ATS',
+                             channel, self.packet_length)
+
+    def fill(self, offset: int, contents) -> memoryview:
+        '''Copy contents into the frame at offset and zero the rest of the frame'''
+        end = offset + len(contents)
+        self.frame[offset:end] = contents
+        self.frame[end:] = self.zeros[end:]
+        return self.frame
+
+    def ats_command(self, data=None) -> memoryview:
+        '''
+            Return the full ATS command for data, ready to be written to the UART.
+            If data is the frame just built by this class no copy is made
+        '''
+        if data is not None and data is not self.frame:
+            self.fill(0, data[:self.packet_length])
+        return self.command
+
+    def header_frame(self, contents: bytes, fec: FecParameters = None) -> memoryview:
+        '''
+            Header packet, the target address followed by contents and zero padding.
+            fec: the FecParameters of the information packets that follow, written in the last bytes
+        '''
+        address_length = len(self.address)
+        self.frame[:address_length] = self.address
+        frame = self.fill(address_length, contents)
+        if fec is not None:
+            if address_length + len(contents) > self.packet_length - HEADER_FEC.size:
+                raise ValueError("Header contents too long to add the FEC parameters")
+            HEADER_FEC.pack_into(frame, self.packet_length - HEADER_FEC.size, *fec)
+        return frame
+
+    def n_information_packets(self, content_length: int) -> int:
+        return math.ceil(content_length / self.info_payload_length)
+
+    def information_frames(self, msg_type: int, contents, indices=None, fec: FecParameters = None):
+        '''
+            Generator of information packets for contents (bytes, bytearray, memoryview or mmap)
+            Each information packet contains:
+            uint16 with number of packets left
+            uint8 with message type
+            The remaining bytes are the data contents, padded with 0
+            Slices of contents are copied straight into the transmit buffer, so large products
+            are never held twice in memory.
+
+            indices: packet indices to build, where packet 0 is the first packet of the product.
+            None builds every packet. A ParityIndex builds that parity packet
+            fec: if given, the parity packets of each block follow its last packet, see fec_schedule
+        '''
+        payload_length = self.info_payload_length
+        with memoryview(contents) as view:
+            view = view.cast('B')
+            n_packets = self.n_information_packets(len(view))
+            if indices is None:
+                indices = range(n_packets)
+            if fec is not None:
+                indices = fec_schedule(indices, n_packets, fec)
+            for index in indices:
+                if isinstance(index, ParityIndex):
+                    yield self.parity_frame(msg_type, view, n_packets, index)
+                    continue
+                if not 0 <= index < n_packets:
+                    continue
+                offset = index * payload_length
+                INFO_HEADER.pack_into(
+                    self.frame, 0, n_packets - index - 1, msg_type)
+                yield self.fill(INFO_HEADER.size, view[offset:offset + payload_length])
+
+    def parity_frame(self, msg_type: int, view: memoryview, n_packets: int, parity: ParityIndex) -> memoryview:
+        '''A parity packet of a block, see the module docstring'''
+        payload_length = self.info_payload_length
+        fec = parity.fec
+        # XOR the payloads as integers, a short final payload is padded with 0 like its packet
+        payload = 0
+        for index in parity_group(fec, n_packets, parity.block, parity.group):
+            offset = index * payload_length
+            payload ^= int.from_bytes(view[offset:offset + payload_length], 'little')
+        INFO_HEADER.pack_into(
+            self.frame, 0, parity.block * fec.parity_packets + parity.group, msg_type | FEC_PARITY)
+        return self.fill(INFO_HEADER.size, payload.to_bytes(payload_length, 'little'))
+
+
+class PacketAssembler:
+    '''
+        Ground side inverse of FrameBuilder.information_frames.
+        Each information packet is written into a preallocated buffer at the offset given by its
+        packets remaining count, so packets can arrive in any order (eg. retransmissions) and
+        exactly which ones are missing is known.
+    '''
+
+    def __init__(self, n_packets: int, payload_length=61, fec: FecParameters = None) -> None:
+        '''fec: the FecParameters the product is sent with, to rebuild lost packets from parity packets'''
+        self.n_packets = n_packets
+        self.payload_length = payload_length
+        self.data = bytearray(n_packets * payload_length)
+        # Bit i set once packet i has been received
+        self.bitmap = bytearray((n_packets + 7) // 8)
+        self.packets_received = 0
+        self.duplicates = 0
+        self.invalid = 0
+        # Every packet before this index has been received
+        self.next_missing = 0
+        self.fec = fec
+        # Parity payloads received, keyed by (block, group)
+        self.parity = {}
+        self.packets_rebuilt = 0
+
+    def is_received(self, index: int) -> bool:
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def add(self, packet) -> int:
+        '''
+            Store an information packet (packets remaining, message type, payload).
+            Returns its index, or None if it doesn't belong to this product.
+            Parity packets go to add_parity
+        '''
+        if len(packet) < INFO_HEADER.size or is_parity_packet(packet):
+            self.invalid += 1
+            return None
+        packets_remaining = INFO_HEADER.unpack_from(packet)[0]
+        if packets_remaining >= self.n_packets:
+            self.invalid += 1
+            return None
+        index = self.n_packets - packets_remaining - 1
+        if self.is_received(index):
+            self.duplicates += 1
+            return index
+        self.store(index, packet[INFO_HEADER.size:INFO_HEADER.size + self.payload_length])
+        if self.parity:
+            # The packet may complete a parity group with another packet still missing
+            self.rebuild(index // self.fec.block_packets)
+        return index
+
+    def store(self, index: int, payload):
+        offset = index * self.payload_length
+        self.data[offset:offset + len(payload)] = payload
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+        self.packets_received += 1
+        while self.next_missing < self.n_packets and self.is_received(self.next_missing):
+            self.next_missing += 1
+
+    def set_fec(self, fec: FecParameters):
+        '''More packets are coming with other FecParameters, eg. a retransmission after fec was changed'''
+        if fec != self.fec:
+            self.fec = fec
+            self.parity.clear()
+
+    def add_parity(self, packet) -> list:
+        '''
+            Store a parity packet and rebuild what lost packets it can.
+            Returns the indices of the packets rebuilt, or None if it doesn't belong to this product
+        '''
+        if self.fec is None or len(packet) < INFO_HEADER.size + self.payload_length:
+            self.invalid += 1
+            return None
+        block, group = divmod(INFO_HEADER.unpack_from(packet)[0], self.fec.parity_packets)
+        if block * self.fec.block_packets >= self.n_packets:
+            self.invalid += 1
+            return None
+        if (block, group) in self.parity:
+            self.duplicates += 1
+            return []
+        self.parity[(block, group)] = bytes(packet[INFO_HEADER.size:INFO_HEADER.size + self.payload_length])
+        return self.rebuild(block)
+
+    def rebuild(self, block: int) -> list:
+        '''Rebuild the packets of a block that are the only one missing from a parity group received'''
+        rebuilt = []
+        for group in range(self.fec.parity_packets):
+            parity = self.parity.get((block, group))
+            if parity is None:
+                continue
+            members = parity_group(self.fec, self.n_packets, block, group)
+            missing = [index for index in members if not self.is_received(index)]
+            if len(missing) != 1:
+                continue
+            payload = int.from_bytes(parity, 'little')
+            for index in members:
+                if index != missing[0]:
+                    offset = index * self.payload_length
+                    payload ^= int.from_bytes(self.data[offset:offset + self.payload_length], 'little')
+            self.store(missing[0], payload.to_bytes(self.payload_length, 'little'))
+            self.packets_rebuilt += 1
+            rebuilt.append(missing[0])
+        return rebuilt
+
+    def complete(self) -> bool:
+        return self.packets_received == self.n_packets
+
+    def missing(self) -> list:
+        '''Indices of the packets not received yet'''
+        return [index for index in range(self.next_missing, self.n_packets) if not self.is_received(index)]
+
+    def contiguous_length(self) -> int:
+        '''Number of bytes at the start of the product received without a gap'''
+        return self.next_missing * self.payload_length
+
+
+# How a set of packet indices is encoded in a retransmit request
+SELECTION_RANGES = 0   # uint8 count, then count pairs of uint16 first index and uint16 number of packets
+SELECTION_BITMAP = 1   # uint16 first index, then a bitmap where bit i set means packet first + i is wanted
+
+RANGE = struct.Struct('<HH')
+BITMAP_BASE = struct.Struct('<H')
+
+
+def packet_ranges(indices) -> list:
+    '''Collapse packet indices into a sorted list of (first index, number of packets)'''
+    ranges = []
+    for index in sorted(set(indices)):
+        if ranges and ranges[-1][0] + ranges[-1][1] == index:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([index, 1])
+    return [tuple(r) for r in ranges]
+
+
+def encode_packet_selection(indices, selection_length: int) -> tuple:
+    '''
+        Encode packet indices into at most selection_length bytes, using whichever of
+        the range list or bitmap fits more of them.
+        Returns (mode, selection bytes, list of the indices that were encoded)
+    '''
+    ranges = packet_ranges(indices)
+    max_ranges = min((selection_length - 1) // RANGE.size, 255)
+    if len(ranges) <= max_ranges or not ranges:
+        selection = bytearray([len(ranges)])
+        for first, count in ranges:
+            selection += RANGE.pack(first, count)
+        return SELECTION_RANGES, bytes(selection), [i for first, count in ranges for i in range(first, first + count)]
+
+    # Too many gaps for a list of ranges, use a bitmap from the first missing packet
+    base = ranges[0][0]
+    n_bits = (selection_length - BITMAP_BASE.size) * 8
+    bitmap = bytearray(selection_length - BITMAP_BASE.size)
+    encoded = []
+    for first, count in ranges:
+        for index in range(first, first + count):
+            if index - base >= n_bits:
+                break
+            bitmap[(index - base) >> 3] |= 1 << ((index - base) & 7)
+            encoded.append(index)
+    return SELECTION_BITMAP, BITMAP_BASE.pack(base) + bytes(bitmap), encoded
+
+
+def decode_packet_selection(mode: int, selection: bytes, n_packets: int = None) -> list:
+    '''
+        Packet indices from an encoded selection, see encode_packet_selection.
+        The selection comes off the uplink, so a range count past the end of it is cut to the
+        ranges it holds, and if n_packets is given indices of n_packets or more are left out
+    '''
+    limit = 0x10000 if n_packets is None else n_packets
+    indices = []
+    if mode == SELECTION_RANGES:
+        if not selection:
+            return indices
+        count = min(selection[0], (len(selection) - 1) // RANGE.size)
+        for i in range(count):
+            first, n = RANGE.unpack_from(selection, 1 + i * RANGE.size)
+            indices.extend(range(first, min(first + n, limit)))
+    elif mode == SELECTION_BITMAP:
+        if len(selection) < BITMAP_BASE.size:
+            return indices
+        base = BITMAP_BASE.unpack_from(selection, 0)[0]
+        for byte_index, byte in enumerate(selection[BITMAP_BASE.size:]):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit) and base + byte_index * 8 + bit < limit:
+                        indices.append(base + byte_index * 8 + bit)
+    return indices
@@ -0,0 +1,89 @@
+'''
+Memory-mapped store of greyscale .bin images (see ImageDownscale.py for the format)
+The file is a uint32 width and height followed by width*height 8-bit pixels.
+
+Images are kept mapped in a small LRU cache so repeated or resumed requests for the
+same image don't touch the disk again. A cached image is reused only while the
+file's mtime and size are unchanged.
+'''
+
+import mmap
+import os
+import struct
+from collections import OrderedDict, namedtuple
+
+IMAGE_HEADER = struct.Struct('II')
+
+# pixels is a zero-copy memoryview over the mapped pixel region
+StoredImage = namedtuple('StoredImage', ['width', 'height', 'pixels'])
+
+CacheEntry = namedtuple('CacheEntry', ['mtime_ns', 'size', 'mapping', 'image'])
+
+
+class ImageStore:
+    def __init__(self, max_open=8) -> None:
+        '''max_open: maximum number of images kept mapped at once'''
+        self.max_open = max_open
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path) -> StoredImage:
+        '''
+            Return the StoredImage for path, or None if it can't be read.
+            The pixels memoryview stays valid until the image is evicted from the cache
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            print(f"An error occurred: {e}")
+            self.evict(path)
+            return None
+
+        entry = self.cache.get(path)
+        if entry is not None:
+            if entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                self.hits += 1
+                self.cache.move_to_end(path)
+                return entry.image
+            # The file has changed since it was mapped
+            self.evict(path)
+
+        self.misses += 1
+        try:
+            entry = self.map_image(path, stat)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"An error occurred: {e}")
+            return None
+
+        self.cache[path] = entry
+        while len(self.cache) > self.max_open:
+            self.evict(next(iter(self.cache)))
+        return entry.image
+
+    def map_image(self, path, stat) -> CacheEntry:
+        with open(path, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        width, height = IMAGE_HEADER.unpack_from(mapping, 0)
+        pixel_end = IMAGE_HEADER.size + width * height
+        if pixel_end > len(mapping):
+            mapping.close()
+            raise ValueError(
+                f"{path} is too short for a {width}x{height} image")
+        pixels = memoryview(mapping)[IMAGE_HEADER.size:pixel_end]
+        return CacheEntry(stat.st_mtime_ns, stat.st_size, mapping, StoredImage(width, height, pixels))
+
+    def evict(self, path):
+        entry = self.cache.pop(path, None)
+        if entry is None:
+            return
+        entry.image.pixels.release()
+        try:
+            entry.mapping.close()
+        except BufferError:
+            # Something still holds a view of the pixels, the mapping is closed when it is released
+            pass
+
+    def clear(self):
+        for path in list(self.cache):
+            self.evict(path)
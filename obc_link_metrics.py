@@ -0,0 +1,218 @@
+'''
+Link quality telemetry for tuning the packet length, pacing and channel.
+
+Every frame received records its RSSI and the time since the previous frame, and every
+downlink records the packets/s it achieved, in fixed size ring buffers so a long mission
+never grows them. Histograms of the most recent values are worked out when asked for.
+
+Frames are grouped into passes: a frame after pass_gap seconds of silence starts a new pass.
+Each pass counts its frames, frame errors (packets too short, for another address or with bad
+arguments), bytes the framer discarded, retransmitted packets and what was downlinked. The last
+max_passes passes are kept.
+
+Snapshots are appended to a file as one JSON object per line. Once the file reaches
+max_file_bytes it is moved to <file>.1, replacing the one moved before, so the snapshots never
+take more than twice that.
+Print the latest snapshot with: python obc_link_metrics.py [link_metrics.jsonl]
+'''
+
+import bisect
+import contextlib
+import json
+import os
+import sys
+import time
+from array import array
+from collections import deque, namedtuple
+
+Histogram = namedtuple('Histogram', ['edges', 'counts'])
+
+PassMetrics = namedtuple('PassMetrics', ['start', 'end', 'frames', 'frame_errors', 'bytes_discarded',
+                                         'retransmit_requests', 'packets_retransmitted', 'packets_sent',
+                                         'downlink_seconds', 'mean_rssi'])
+
+# Default histogram bin edges, a value v is counted in the bin edges[i] <= v < edges[i + 1],
+# with one bin below the first edge and one from the last edge up
+RSSI_EDGES = tuple(range(0, 256, 16))
+INTER_ARRIVAL_EDGES = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+THROUGHPUT_EDGES = (1, 2, 5, 10, 15, 20, 30, 50, 100)
+
+
+class RingBuffer:
+    '''The last capacity values, stored in a preallocated array'''
+
+    def __init__(self, capacity: int, typecode='d') -> None:
+        self.data = array(typecode, [0]) * capacity
+        self.capacity = capacity
+        self.next = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, value):
+        self.data[self.next] = value
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def values(self) -> list:
+        '''Oldest first'''
+        if self.count < self.capacity:
+            return self.data[:self.count].tolist()
+        return (self.data[self.next:] + self.data[:self.next]).tolist()
+
+
+def histogram(values, edges) -> Histogram:
+    counts = [0] * (len(edges) + 1)
+    for value in values:
+        counts[bisect.bisect_right(edges, value)] += 1
+    return Histogram(tuple(edges), counts)
+
+
+class LinkMetrics:
+    def __init__(self, capacity=1024, pass_gap=600, max_passes=32, snapshot_interval=60,
+                 max_file_bytes=1_000_000) -> None:
+        '''
+            capacity: values kept in each ring buffer
+            pass_gap: seconds without a frame that ends a pass
+            snapshot_interval: seconds between snapshots written by save_if_due
+            max_file_bytes: size of the snapshot file before it is moved aside and a new one started
+        '''
+        self.rssi = RingBuffer(capacity, 'B')
+        self.inter_arrival = RingBuffer(capacity)
+        self.throughput = RingBuffer(capacity)
+        self.pass_gap = pass_gap
+        self.passes = deque(maxlen=max_passes)
+        self.snapshot_interval = snapshot_interval
+        self.max_file_bytes = max_file_bytes
+        self.last_snapshot = time.monotonic()
+        self.last_frame = None
+        self.current = None
+
+    def new_pass(self):
+        if self.current is not None:
+            self.passes.append(self.pass_metrics(self.current))
+        now = time.time()
+        self.current = {'start': now, 'end': now, 'frames': 0, 'frame_errors': 0,
+                        'bytes_discarded': 0, 'retransmit_requests': 0, 'packets_retransmitted': 0,
+                        'packets_sent': 0, 'downlink_seconds': 0.0, 'rssi_total': 0}
+
+    def pass_for(self, now: float) -> dict:
+        if self.current is None or (self.last_frame is not None and now - self.last_frame > self.pass_gap):
+            self.new_pass()
+        self.current['end'] = time.time()
+        return self.current
+
+    def record_frame(self, signal_strength: int, now=None):
+        now = time.monotonic() if now is None else now
+        current = self.pass_for(now)
+        # Only time frames within a pass, the gap between passes says nothing about the link
+        if self.last_frame is not None and now - self.last_frame <= self.pass_gap:
+            self.inter_arrival.append(now - self.last_frame)
+        self.last_frame = now
+        self.rssi.append(min(max(signal_strength, 0), 255))
+        current['frames'] += 1
+        current['rssi_total'] += signal_strength
+
+    def record_frame_error(self):
+        '''A packet that was received but couldn't be used'''
+        self.pass_for(time.monotonic())['frame_errors'] += 1
+
+    def record_discarded(self, n_bytes: int):
+        '''Bytes the framer threw away looking for the next packet'''
+        if n_bytes:
+            self.pass_for(time.monotonic())['bytes_discarded'] += n_bytes
+
+    def record_retransmit(self, packets: int):
+        current = self.pass_for(time.monotonic())
+        current['retransmit_requests'] += 1
+        current['packets_retransmitted'] += packets
+
+    def record_downlink(self, packets: int, seconds: float):
+        if not packets:
+            return
+        current = self.pass_for(time.monotonic())
+        current['packets_sent'] += packets
+        current['downlink_seconds'] += seconds
+        if seconds > 0:
+            self.throughput.append(packets / seconds)
+
+    def pass_metrics(self, current: dict) -> PassMetrics:
+        return PassMetrics(current['start'], current['end'], current['frames'], current['frame_errors'],
+                           current['bytes_discarded'], current['retransmit_requests'],
+                           current['packets_retransmitted'], current['packets_sent'],
+                           current['downlink_seconds'],
+                           current['rssi_total'] / current['frames'] if current['frames'] else None)
+
+    def all_passes(self) -> list:
+        '''Finished passes then the current one, oldest first'''
+        passes = list(self.passes)
+        if self.current is not None:
+            passes.append(self.pass_metrics(self.current))
+        return passes
+
+    def rssi_histogram(self, edges=RSSI_EDGES) -> Histogram:
+        return histogram(self.rssi.values(), edges)
+
+    def inter_arrival_histogram(self, edges=INTER_ARRIVAL_EDGES) -> Histogram:
+        return histogram(self.inter_arrival.values(), edges)
+
+    def throughput_histogram(self, edges=THROUGHPUT_EDGES) -> Histogram:
+        return histogram(self.throughput.values(), edges)
+
+    def snapshot(self) -> dict:
+        return {
+            'time': time.time(),
+            'rssi': self.rssi_histogram()._asdict(),
+            'inter_arrival': self.inter_arrival_histogram()._asdict(),
+            'throughput': self.throughput_histogram()._asdict(),
+            'passes': [p._asdict() for p in self.all_passes()],
+        }
+
+    def save_snapshot(self, path='link_metrics.jsonl'):
+        with contextlib.suppress(FileNotFoundError):
+            if os.path.getsize(path) >= self.max_file_bytes:
+                os.replace(path, f'{path}.1')
+        with open(path, 'a') as file:
+            file.write(json.dumps(self.snapshot()) + '\n')
+        self.last_snapshot = time.monotonic()
+
+    def save_if_due(self, path='link_metrics.jsonl'):
+        if time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self.save_snapshot(path)
+
+
+def read_snapshots(path='link_metrics.jsonl') -> list:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def print_histogram(name: str, histogram: dict, unit=''):
+    edges, counts = histogram['edges'], histogram['counts']
+    print(f'{name}:')
+    for i, count in enumerate(counts):
+        low = f'{edges[i - 1]}{unit}' if i > 0 else ''
+        high = f'{edges[i]}{unit}' if i < len(edges) else ''
+        print(f'  {low:>8} - {high:<8} {count}')
+
+
+def main():
+    snapshots = read_snapshots(sys.argv[1] if len(sys.argv) > 1 else 'link_metrics.jsonl')
+    if not snapshots:
+        print('No snapshots')
+        return
+    snapshot = snapshots[-1]
+    print(f'{len(snapshots)} snapshots, latest at {time.ctime(snapshot["time"])}')
+    for p in snapshot['passes']:
+        rate = p['packets_sent'] / p['downlink_seconds'] if p['downlink_seconds'] else 0
+        rssi = f'{p["mean_rssi"]:.0f}' if p['mean_rssi'] is not None else '-'
+        print(f'Pass {time.ctime(p["start"])}: {p["frames"]} frames, mean RSSI {rssi}, {p["frame_errors"]} frame errors, '
+              f'{p["bytes_discarded"]} bytes discarded, {p["packets_retransmitted"]} packets retransmitted '
+              f'in {p["retransmit_requests"]} requests, {p["packets_sent"]} packets sent at {rate:.1f} packets/s')
+    print_histogram('RSSI', snapshot['rssi'])
+    print_histogram('Time between frames', snapshot['inter_arrival'], 's')
+    print_histogram('Downlink packets/s', snapshot['throughput'])
+
+
+if __name__ == '__main__':
+    main()
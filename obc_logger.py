@@ -0,0 +1,132 @@
+'''
+Background logger for the OBC.
+
+Logging a message only puts it on a queue. A writer thread formats the queued messages and
+writes them in batches to a file that stays open. The file is flushed once flush_size bytes
+are waiting or every flush_interval seconds, and on shutdown. Once the file reaches max_bytes
+it is rotated to log.txt.1, log.txt.2 ... keeping backup_count old files.
+
+Messages are written as text lines ("2024-05-23 22:33:06 - message"), or with binary=True as
+records of float64 unix time, uint16 length and the utf-8 message, which is smaller and
+cheaper to write. Print a binary log with: python obc_logger.py log.bin
+'''
+
+import atexit
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+BINARY_RECORD = struct.Struct('<dH')
+
+
+class BackgroundLogger:
+    # Most messages written together, so a large backlog still rotates at about max_bytes
+    BATCH_LENGTH = 256
+
+    def __init__(self, path='log.txt', flush_interval=1.0, flush_size=1 << 14, max_bytes=1 << 20,
+                 backup_count=5, binary=False) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.binary = binary
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+        # The writer is a daemon thread, make sure whatever is queued is written before exiting
+        atexit.register(self.close)
+
+    def log(self, message):
+        '''Queue a message, this is all the caller waits for'''
+        self.queue.put((time.time(), message))
+
+    def close(self):
+        '''Write everything queued and stop the writer'''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def writer(self):
+        self.open()
+        pending = 0
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            # Take everything else already queued so it is written as one batch
+            batch = [item] if item else []
+            if item is None:
+                running = False
+                batch = []
+            while running:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+
+            for start in range(0, len(batch), self.BATCH_LENGTH):
+                data = b''.join(
+                    map(self.format, batch[start:start + self.BATCH_LENGTH]))
+                self.file.write(data)
+                pending += len(data)
+                if self.file.tell() >= self.max_bytes:
+                    self.rotate()
+                    pending = 0
+                    last_flush = time.monotonic()
+            now = time.monotonic()
+            if pending and (pending >= self.flush_size or now - last_flush >= self.flush_interval or not running):
+                self.file.flush()
+                pending = 0
+                last_flush = now
+        self.file.close()
+
+    def format(self, item) -> bytes:
+        timestamp, message = item
+        if self.binary:
+            message = str(message).encode()[:0xFFFF]
+            return BINARY_RECORD.pack(timestamp, len(message)) + message
+        return f"{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')} - {message}\n".encode()
+
+    def open(self):
+        self.file = open(self.path, 'ab')
+
+    def rotate(self):
+        self.file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f'{self.path}.{i}'):
+                    os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.open()
+
+
+def read_binary_log(path: str):
+    '''Generator of (unix time, message) from a binary log'''
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset + BINARY_RECORD.size <= len(data):
+        timestamp, length = BINARY_RECORD.unpack_from(data, offset)
+        offset += BINARY_RECORD.size
+        yield timestamp, data[offset:offset + length].decode(errors='replace')
+        offset += length
+
+
+if __name__ == '__main__':
+    for timestamp, message in read_binary_log(sys.argv[1]):
+        print(f"{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')} - {message}")
@@ -0,0 +1,106 @@
+'''
+Striped downlink over several transceivers.
+
+StripedOBCCommunication takes commands on its own port like OBCCommunication, but sends large
+products over every link at once: itself and the extra OBCCommunication links, each with its
+own transceiver on its own channel. Each link sends the product's header packet, then takes
+the next packet still to be sent whenever its pacer lets it send, so a faster link sends more
+of the product. The ground stations merge the packets by index (see SerialTest.EXTRA_PORTS),
+so the throughput adds up over the radios.
+
+Only message types in stripe_types are striped, by default science images. Everything else
+goes over the command link alone. Forward error correction follows the command link's setting.
+
+Usage: python obc_multilink.py <command uart port> <uart port for channel 1> [channel 2 port] ...
+'''
+
+import sys
+import threading
+import time
+from collections import deque
+from obc_comms import MessageType, OBCCommunication
+from obc_framing import fec_schedule
+
+
+class StripedOBCCommunication(OBCCommunication):
+    def __init__(self, *args, links=(), stripe_types=(MessageType.SCIENCE_IMAGE,), **kwargs) -> None:
+        '''
+            links: further OBCCommunication to downlink over, each on its own transceiver and channel
+            stripe_types: MessageTypes whose information packets are striped over every link
+        '''
+        super().__init__(*args, **kwargs)
+        self.links = list(links)
+        self.stripe_types = {msg_type.value for msg_type in stripe_types}
+        # Header of a striped product, sent over every link once its packets are
+        self.striped_header = None
+
+    def receiveTransmission(self):
+        # The links only read while striping, save their metrics as the command link reads
+        for link in self.links:
+            if link.metrics_path:
+                link.metrics.save_if_due(link.metrics_path)
+        super().receiveTransmission()
+
+    def downlink_header_packet(self, contents: bytes):
+        if self.links and contents[0] in self.stripe_types:
+            self.striped_header = bytes(contents)
+            return
+        super().downlink_header_packet(contents)
+
+    def downlink_information_packets(self, msg_type: MessageType, contents: bytes, indices=None):
+        header, self.striped_header = self.striped_header, None
+        if not self.links or msg_type.value not in self.stripe_types:
+            super().downlink_information_packets(msg_type, contents, indices)
+            return
+
+        n_packets = self.frame_builder.n_information_packets(memoryview(contents).nbytes)
+        indices = range(n_packets) if indices is None else indices
+        # Parity packets are striped like the rest, after the last packet of their block
+        remaining = deque(indices if self.fec is None else fec_schedule(indices, n_packets, self.fec))
+        lock = threading.Lock()
+        start = time.monotonic()
+
+        def stripe(link: OBCCommunication, sent: list):
+            def next_index():
+                # Only claim a packet once this link is ready to send it
+                link.pacer.wait(link.receiveTransmission)
+                with lock:
+                    return remaining.popleft() if remaining else None
+
+            if header is not None:
+                # Every link's header says the parity packets are sent as on the command link
+                link.transmit(link.frame_builder.header_frame(header, self.fec))
+            for frame in link.frame_builder.information_frames(msg_type.value, contents, iter(next_index, None)):
+                link.transmit(frame)
+                sent[0] += 1
+
+        links = [self] + self.links
+        sent = [[0] for _ in links]
+        threads = [threading.Thread(target=stripe, args=(link, link_sent), daemon=True)
+                   for link, link_sent in zip(links[1:], sent[1:])]
+        for thread in threads:
+            thread.start()
+        stripe(self, sent[0])
+        for thread in threads:
+            thread.join()
+
+        seconds = time.monotonic() - start
+        total = sum(link_sent[0] for link_sent in sent)
+        for link, link_sent in zip(links[1:], sent[1:]):
+            link.metrics.record_downlink(link_sent[0], seconds)
+        print(f"Striped {total} packets over {len(links)} links in {seconds:.2f}s "
+              f"({total / seconds if seconds else 0:.1f} packets/s, per link {[link_sent[0] for link_sent in sent]})")
+
+
+def main(command_port: str, *downlink_ports):
+    # Each link keeps its own metrics file
+    links = [OBCCommunication(port, channel=channel, metrics_path=f'link_metrics_{channel}.jsonl')
+             for channel, port in enumerate(downlink_ports, 1)]
+    obc_com = StripedOBCCommunication(command_port, links=links, metrics_path='link_metrics.jsonl')
+    while True:
+        obc_com.receiveTransmission()
+        time.sleep(0.001)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
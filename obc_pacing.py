@@ -0,0 +1,112 @@
+'''
+Adaptive pacing of downlink packets.
+
+Rather than sleeping a fixed 100ms between packets, the gap between packets starts
+conservatively and shrinks towards the fastest rate the link has shown it can carry:
+- The time the UART takes to drain each ATS command puts a floor under the gap
+- Every packet sent without a reported loss shrinks the gap a little
+- A reported loss (eg. the ground station asking for packets again) backs the gap off
+Optionally a credit window can be used, where the ground station grants credits for
+the number of packets it is ready to receive and each packet sent uses one up. The ground
+station sets the window on both ends with its creditwindow command (see GroundStation.ino)
+and grants half the window each time that many packets have arrived.
+'''
+
+import time
+from collections import namedtuple
+
+PacingStats = namedtuple(
+    'PacingStats', ['packets', 'seconds', 'packets_per_second', 'gap'])
+
+
+class AdaptivePacer:
+    def __init__(self, initial_gap=0.1, min_gap=0.02, max_gap=1.0, decrease=0.9, backoff=2.0,
+                 window=0, credit_timeout=1.0) -> None:
+        '''
+            initial_gap: seconds between packets before anything has been measured
+            min_gap, max_gap: limits on the gap between packets
+            decrease: the gap is multiplied by this after each packet sent without loss
+            backoff: the gap is multiplied by this for every loss event reported
+            window: number of credits the ground station starts with, 0 disables credit flow control
+            credit_timeout: seconds to wait for a credit before assuming the grant was lost
+        '''
+        self.initial_gap = initial_gap
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.decrease = decrease
+        self.backoff = backoff
+        self.window = window
+        self.credit_timeout = credit_timeout
+
+        self.gap = initial_gap
+        # Lower bound on the gap measured from how long the UART takes to drain a packet
+        self.drain_gap = 0
+        self.credits = window
+        self.last_send = 0
+        self.busy = False
+        self.packets = 0
+        self.start_time = 0
+        self.lost_packets = 0
+
+    def begin(self):
+        '''Start of a downlink, resets the counters used for the achieved packets/s'''
+        self.busy = True
+        self.packets = 0
+        self.start_time = time.monotonic()
+        self.credits = self.window
+
+    def end(self) -> PacingStats:
+        '''End of a downlink, returns what was achieved'''
+        self.busy = False
+        return self.stats()
+
+    def stats(self) -> PacingStats:
+        seconds = time.monotonic() - self.start_time
+        rate = self.packets / seconds if seconds > 0 else 0
+        return PacingStats(self.packets, seconds, rate, self.gap)
+
+    def wait(self, poll=None):
+        '''
+            Block until the next packet may be sent.
+            poll is called while waiting for credits so grants from the ground station can be received
+        '''
+        if self.window:
+            deadline = time.monotonic() + self.credit_timeout
+            while self.credits <= 0:
+                if time.monotonic() >= deadline:
+                    # The grant never arrived, treat it as a loss and carry on with one packet
+                    self.report_loss()
+                    self.credits = 1
+                    break
+                if poll:
+                    poll()
+                time.sleep(0.001)
+
+        delay = self.last_send + self.gap - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def sent(self, drain_time: float):
+        '''
+            Record that a packet was sent, drain_time is how long the UART took to write it out
+        '''
+        # The gap is measured from the start of the write, the drain is part of it
+        self.last_send = time.monotonic() - drain_time
+        self.packets += 1
+        if self.window:
+            self.credits -= 1
+        self.drain_gap = min(drain_time, self.max_gap)
+        self.gap = max(self.gap * self.decrease,
+                       self.min_gap, self.drain_gap)
+
+    def report_loss(self, n_packets=1):
+        '''
+            Back off after the ground station reports n_packets were lost.
+            One report is one loss event, so the gap is only backed off once however many packets it covers
+        '''
+        self.lost_packets += n_packets
+        self.gap = min(self.gap * self.backoff, self.max_gap)
+
+    def grant(self, credits: int):
+        '''Credits granted by the ground station'''
+        self.credits += credits
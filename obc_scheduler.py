@@ -0,0 +1,144 @@
+'''
+Fixed rate scheduler for the OBC's sampling jobs (WOD, science readings).
+
+Each run of a job is due at start + n * period on the monotonic clock, never "period after the
+last run", so a late or slow run doesn't push every later sample back. If a job falls behind by
+a whole period the missed runs are skipped and counted as overruns rather than run back to back.
+
+Sampling jobs can batch what they persist: each run returns a sample, and the samples are handed
+to the job's persist function every batch_size runs (and when the scheduler stops).
+'''
+
+import heapq
+import threading
+import time
+from collections import namedtuple
+
+JobStats = namedtuple('JobStats', ['name', 'period', 'runs', 'overruns', 'mean_jitter', 'max_jitter',
+                                   'max_duration', 'batches'])
+
+
+class PeriodicJob:
+    def __init__(self, name: str, period: float, function, persist=None, batch_size=1) -> None:
+        '''
+            function: called every period seconds. If persist is given, what function returns is
+            kept and persist(list of samples) is called every batch_size runs
+        '''
+        self.name = name
+        self.period = period
+        self.function = function
+        self.persist = persist
+        self.batch_size = batch_size
+        self.samples = []
+        self.start = None
+        self.run_number = 0
+        # Statistics
+        self.runs = 0
+        self.overruns = 0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+        self.max_duration = 0.0
+        self.batches = 0
+
+    def due(self) -> float:
+        return self.start + self.run_number * self.period
+
+    def run(self, now: float):
+        # How late this run started
+        jitter = now - self.due()
+        self.runs += 1
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+
+        start = time.monotonic()
+        try:
+            sample = self.function()
+        except Exception as e:
+            print(f"Scheduled job {self.name} failed: {e}")
+            sample = None
+        if self.persist is not None and sample is not None:
+            self.samples.append(sample)
+            if len(self.samples) >= self.batch_size:
+                self.flush()
+        finished = time.monotonic()
+        self.max_duration = max(self.max_duration, finished - start)
+
+        # Next run on the fixed grid. Skip any runs that are already a whole period late
+        self.run_number += 1
+        if finished - self.due() >= self.period:
+            missed = int((finished - self.due()) // self.period)
+            self.overruns += missed
+            self.run_number += missed
+
+    def flush(self):
+        if self.samples:
+            samples, self.samples = self.samples, []
+            self.persist(samples)
+            self.batches += 1
+
+    def stats(self) -> JobStats:
+        return JobStats(self.name, self.period, self.runs, self.overruns,
+                        self.total_jitter / self.runs if self.runs else 0.0,
+                        self.max_jitter, self.max_duration, self.batches)
+
+
+class Scheduler:
+    def __init__(self) -> None:
+        self.jobs = []
+        # (due time, order added, job)
+        self.queue = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def add_job(self, job: PeriodicJob, start=None) -> PeriodicJob:
+        '''Schedule a job, its first run is at start (monotonic time), by default now'''
+        job.start = time.monotonic() if start is None else start
+        with self.lock:
+            self.jobs.append(job)
+            heapq.heappush(self.queue, (job.due(), len(self.jobs), job))
+        # The new job may be due before whatever the scheduler is waiting for
+        self.wake.set()
+        return job
+
+    def run_pending(self) -> float:
+        '''Run every job that is due. Returns the seconds until the next job is due'''
+        # Only jobs due when this was called, so a job slower than its period can't keep it here
+        started = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.queue:
+                    return None
+                due, order, job = self.queue[0]
+                now = time.monotonic()
+                if due > started:
+                    return max(due - now, 0)
+                heapq.heappop(self.queue)
+            job.run(now)
+            with self.lock:
+                heapq.heappush(self.queue, (job.due(), order, job))
+
+    def run(self):
+        while self.running:
+            delay = self.run_pending()
+            self.wake.wait(delay)
+            self.wake.clear()
+
+    def start(self):
+        '''Run the jobs on a background thread'''
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''Stop the thread and persist any samples still batched'''
+        self.running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        for job in self.jobs:
+            job.flush()
+
+    def stats(self) -> list:
+        return [job.stats() for job in self.jobs]
@@ -3,21 +3,47 @@ from datetime import datetime, timedelta
 import time
 import random
 import csv
+import threading
+from obc_logger import BackgroundLogger
+from obc_scheduler import PeriodicJob, Scheduler
+from obc_wod_rollup import ROLLUP_FIELDS, WodRollup
+from obc_wod_store import WOD_FIELDS, WodStore
+
+# Background loggers by log file, see get_logger
+loggers = {}
+# Loggers are created from the sampling, scheduler and comms threads
+loggers_lock = threading.Lock()
+
+# Open WOD stores and their rollups by path, see get_wod_store and get_wod_rollup
+wod_stores = {}
+wod_rollups = {}
+# Number of store records each rollup has been given
+wod_rollup_counts = {}
+# Samples are logged from the sampling thread while commands read them
+wod_lock = threading.RLock()
+
+
+def get_logger(log_file='log.txt') -> BackgroundLogger:
+    # One background logger per file, .bin files are written in the binary format
+    logger = loggers.get(log_file)
+    if logger is None:
+        with loggers_lock:
+            if log_file not in loggers:
+                loggers[log_file] = BackgroundLogger(
+                    log_file, binary=log_file.endswith('.bin'))
+            logger = loggers[log_file]
+    return logger
 
 
 def write_log(log_message, log_file='log.txt'):
     """
     Write a log message to a log file with a timestamp.
-    If the file does not exist, create it. Otherwise, append to the end of the file.
+    The message is only queued, a background thread appends it to the file (see obc_logger.py)
 
     :param log_message: The message to log
     :param log_file: The log file to write to (default: 'log.txt')
     """
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_entry = f"{timestamp} - {log_message}\n"
-
-    with open(log_file, 'a') as file:
-        file.write(log_entry)
+    get_logger(log_file).log(log_message)
 
 
 def set_system_time(new_time):
@@ -49,58 +75,138 @@ def generate_wod(seconds_timestamp: int):
     return [seconds_timestamp, mode, bat_voltage, bat_current, bus_3v_current, bus_5v_current, temp_comm, temp_eps, temp_battery]
 
 
-def log_wod_data(wod_array, file_path='wod.csv'):
-    # Check if the file exists
-    file_exists = os.path.isfile(file_path)
+def generate_science_reading(seconds_timestamp: int):
+    payload_current = 0.235 + random.randint(0, 100)*0.00015353
+    return [seconds_timestamp, payload_current]
 
-    # Open the file in append mode
-    with open(file_path, mode='a', newline='') as file:
-        writer = csv.writer(file)
 
-        # If the file does not exist, write the headers
-        if not file_exists:
-            writer.writerow(['time', 'mode', 'bat_voltage', 'bat_current', 'bus_3v_current',
-                             'bus_5v_current', 'temp_comm', 'temp_eps', 'temp_battery'])
+def get_wod_store(file_path='wod.bin') -> WodStore:
+    # Stores stay open, so logging a sample doesn't reopen the file
+    with wod_lock:
+        if file_path not in wod_stores:
+            wod_stores[file_path] = WodStore(file_path)
+        return wod_stores[file_path]
+
+
+def get_wod_rollup(file_path='wod.bin') -> WodRollup:
+    # Built from the stored samples the first time, then given the samples added to the store since
+    # the last call. They may have been logged by another process, eg. obc_input's sampler
+    with wod_lock:
+        store = get_wod_store(file_path) if os.path.exists(file_path) else None
+        count = len(store) if store is not None else 0
+        rollup = wod_rollups.get(file_path)
+        ingested = wod_rollup_counts.get(file_path, 0)
+        if rollup is None or count < ingested:
+            # First use, or the store was cleared
+            rollup = WodRollup()
+            if count:
+                rollup.rebuild(store)
+        elif count > ingested:
+            for record in store.records(ingested, count):
+                rollup.add(record)
+        wod_rollups[file_path] = rollup
+        wod_rollup_counts[file_path] = count
+        return rollup
+
 
-        # Write the row
-        writer.writerow(wod_array)
-    write_log("Logged WOD")
+def log_wod_data(wod_array, file_path='wod.bin'):
+    log_wod_batch([wod_array], file_path)
+
+
+def log_wod_batch(wod_arrays, file_path='wod.bin'):
+    # Several samples in one write, see start_sampling
+    with wod_lock:
+        get_wod_store(file_path).append_many(wod_arrays)
+        # The rollup reads the new samples back from the store
+        get_wod_rollup(file_path)
+    write_log("Logged WOD" if len(wod_arrays) == 1 else f"Logged {len(wod_arrays)} WOD samples")
 
 
 def generate_and_log_wod():
     log_wod_data(generate_wod(current_time_to_seconds()))
 
 
-def print_latest_wod(file_path='wod.csv', num_rows=32):
-    if not os.path.exists(file_path):
-        print("No WOD logs")
-        return
-    print('--- LATEST Whole Orbit Data ---')
-    rows = []
+def log_science_readings(readings, file_path='science.csv'):
+    file_exists = os.path.isfile(file_path)
+    with open(file_path, mode='a', newline='') as file:
+        writer = csv.writer(file)
+        if not file_exists:
+            writer.writerow(['time', 'payload_current'])
+        writer.writerows(readings)
 
-    # Open the CSV file and read all rows
-    with open(file_path, mode='r', newline='') as file:
-        reader = csv.reader(file)
 
-        # Extract header
-        header = next(reader)
+def start_sampling(wod_period=60, science_period=10) -> Scheduler:
+    '''
+    Sample WOD every wod_period seconds and the science payload every science_period seconds
+    on a background thread. Samples are written in batches, call stop() on the returned
+    scheduler to write any still waiting
+    '''
+    scheduler = Scheduler()
+    scheduler.add_job(PeriodicJob('wod', wod_period, lambda: generate_wod(current_time_to_seconds()),
+                                  log_wod_batch, batch_size=5))
+    scheduler.add_job(PeriodicJob('science', science_period, lambda: generate_science_reading(current_time_to_seconds()),
+                                  log_science_readings, batch_size=6))
+    scheduler.start()
+    return scheduler
+
+
+def print_sampling_stats(scheduler: Scheduler):
+    print('--- Sampling ---')
+    for stats in scheduler.stats():
+        print(f'{stats.name}: every {stats.period}s, {stats.runs} runs, {stats.overruns} overruns, '
+              f'jitter mean {stats.mean_jitter * 1000:.2f}ms max {stats.max_jitter * 1000:.2f}ms, '
+              f'longest run {stats.max_duration * 1000:.2f}ms, {stats.batches} batches written')
+    print('----------------------')
 
-        # Collect all rows in a list
-        for row in reader:
-            rows.append(row)
 
-    # Determine the starting point to print last `num_rows` rows
-    start_index = max(0, len(rows) - num_rows)
+def print_latest_wod(file_path='wod.bin', num_rows=32):
+    if not os.path.exists(file_path) or len(get_wod_store(file_path)) == 0:
+        print("No WOD logs")
+        return
+    print('--- LATEST Whole Orbit Data ---')
+    # Only the last num_rows records are read
+    with wod_lock:
+        rows = get_wod_store(file_path).latest(num_rows)
 
     # Print the header
-    print(','.join(header))
+    print(','.join(WOD_FIELDS))
 
     # Print the last `num_rows` rows
-    for row in rows[start_index:]:
-        print(','.join([parse_seconds_to_datetime(int(row[0]))] + row[1:]))
+    for row in rows:
+        print(','.join([parse_seconds_to_datetime(row.time)] + [str(row.mode)] + [f'{value:.7g}' for value in row[2:]]))
+    print('----------------------')
+
+
+def print_wod_rollup(window_seconds=600, num_windows=24, file_path='wod.bin'):
+    with wod_lock:
+        buckets = get_wod_rollup(file_path).rollup(window_seconds, num_windows)
+    if not buckets:
+        print("No WOD logs")
+        return
+    print(f'--- WOD rollup, {window_seconds}s windows ---')
+    print(','.join(['time', 'samples'] + [f'{field}_{stat}' for field in ROLLUP_FIELDS
+                                          for stat in ('min', 'max', 'mean')]))
+    for bucket in buckets:
+        stats = [f'{value:.4g}' for i in range(len(ROLLUP_FIELDS))
+                 for value in (bucket.min[i], bucket.max[i], bucket.mean[i])]
+        print(','.join([parse_seconds_to_datetime(bucket.start), str(bucket.count)] + stats))
     print('----------------------')
 
 
+def export_wod_csv(file_path='wod.bin', csv_path='wod.csv'):
+    with wod_lock:
+        get_wod_store(file_path).export_csv(csv_path)
+    write_log(f"Exported WOD to {csv_path}")
+
+
+def clear_wod(file_path='wod.bin'):
+    with wod_lock:
+        if os.path.exists(file_path):
+            get_wod_store(file_path).clear()
+        wod_rollups.pop(file_path, None)
+        wod_rollup_counts.pop(file_path, None)
+
+
 def current_time_to_seconds():
     # Reference epoch (01/01/2000 00:00:00 UTC)
     reference_epoch = datetime(2000, 1, 1, 0, 0, 0)
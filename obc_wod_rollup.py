@@ -0,0 +1,115 @@
+'''
+Min/max/mean rollups of the WOD history, so hours of samples can be downlinked as an overview.
+
+Every sample updates the current window of each window size in O(1). When a sample falls in a
+new window the finished one is kept, up to a fixed number per window size.
+
+Rollups are downlinked as fixed size buckets (little endian):
+uint32 - window start time
+uint16 - number of samples in the window
+3 x 7 float16 - min, max and mean of each WOD reading
+'''
+
+import struct
+from collections import deque, namedtuple
+from obc_wod_store import WOD_FIELDS
+
+# Readings that are rolled up, the time and mode are not
+ROLLUP_FIELDS = WOD_FIELDS[2:]
+
+# Window size in seconds and the number of finished windows to keep:
+# an hour of 1 minute windows, a day of 10 minute windows and a week of 1 hour windows
+ROLLUP_WINDOWS = {60: 60, 600: 144, 3600: 168}
+
+RollupBucket = namedtuple('RollupBucket', ['start', 'count', 'min', 'max', 'mean'])
+
+ROLLUP_BUCKET = struct.Struct(f'<IH{3 * len(ROLLUP_FIELDS)}e')
+
+
+class RollupWindow:
+    def __init__(self, seconds: int, keep: int) -> None:
+        self.seconds = seconds
+        self.buckets = deque(maxlen=keep)
+        # The window being filled
+        self.start = None
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = None
+
+    def add(self, time: int, values):
+        start = time - time % self.seconds
+        if start != self.start:
+            if self.count:
+                self.buckets.append(self.current())
+            self.start = start
+            self.count = 0
+            self.min = list(values)
+            self.max = list(values)
+            self.sum = [0.0] * len(values)
+        self.count += 1
+        for i, value in enumerate(values):
+            if value < self.min[i]:
+                self.min[i] = value
+            elif value > self.max[i]:
+                self.max[i] = value
+            self.sum[i] += value
+
+    def current(self) -> RollupBucket:
+        return RollupBucket(self.start, self.count, tuple(self.min), tuple(self.max),
+                            tuple(total / self.count for total in self.sum))
+
+    def latest(self, n: int) -> list:
+        '''The last n windows oldest first, including the one still being filled'''
+        buckets = list(self.buckets)
+        if self.count:
+            buckets.append(self.current())
+        return buckets[-n:] if n > 0 else []
+
+
+class WodRollup:
+    def __init__(self, windows=None) -> None:
+        windows = ROLLUP_WINDOWS if windows is None else windows
+        self.windows = {seconds: RollupWindow(seconds, keep)
+                        for seconds, keep in windows.items()}
+        self.last_time = None
+
+    def add(self, sample):
+        '''Add a sample, a sequence of the WOD_FIELDS values'''
+        time = sample[0]
+        values = sample[2:]
+        for window in self.windows.values():
+            window.add(time, values)
+        self.last_time = time
+
+    def rollup(self, window_seconds: int, n: int) -> list:
+        '''The last n RollupBuckets of the given window size, oldest first'''
+        if window_seconds not in self.windows:
+            raise ValueError(f"No rollup with a {window_seconds}s window")
+        return self.windows[window_seconds].latest(n)
+
+    def rebuild(self, store):
+        '''Fill the rollups from a WodStore, eg. after a reboot. Only the samples still kept are read'''
+        if not len(store):
+            return
+        horizon = max(seconds * (window.buckets.maxlen + 1)
+                      for seconds, window in self.windows.items())
+        last_time = store.latest(1)[0].time
+        for record in store.find(max(last_time - horizon, 0), last_time + 1):
+            self.add(record)
+
+
+def pack_rollup(buckets) -> bytes:
+    return b''.join(ROLLUP_BUCKET.pack(bucket.start, min(bucket.count, 0xFFFF), *bucket.min, *bucket.max, *bucket.mean)
+                    for bucket in buckets)
+
+
+def unpack_rollup(data, n_buckets: int) -> list:
+    n_fields = len(ROLLUP_FIELDS)
+    buckets = []
+    for i in range(n_buckets):
+        values = ROLLUP_BUCKET.unpack_from(data, i * ROLLUP_BUCKET.size)
+        readings = values[2:]
+        buckets.append(RollupBucket(values[0], values[1], readings[:n_fields],
+                                    readings[n_fields:2 * n_fields], readings[2 * n_fields:]))
+    return buckets
@@ -0,0 +1,165 @@
+'''
+Append-only binary store of Whole Orbit Data samples.
+
+Every sample is a fixed size record, so the latest N samples are read straight from the end
+of the file and a time range is found by binary search, however long the OBC has been running.
+Records must be appended in time order. Several processes may append to the same file (eg. the
+sampler and the comms), so the number of records is read again from the file size before use.
+
+File format (little endian):
+Header: 4 byte magic 'WODS', uint8 version, uint8 number of fields, uint16 record size
+Records: uint32 time (seconds since 01/01/2000), uint8 mode, 7 float32 readings
+'''
+
+import bisect
+import csv
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+WOD_FIELDS = ['time', 'mode', 'bat_voltage', 'bat_current', 'bus_3v_current',
+              'bus_5v_current', 'temp_comm', 'temp_eps', 'temp_battery']
+
+WodRecord = namedtuple('WodRecord', WOD_FIELDS)
+
+STORE_MAGIC = b'WODS'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sBBH')
+WOD_RECORD = struct.Struct('<IB7f')
+
+
+class WodStore:
+    def __init__(self, path='wod.bin') -> None:
+        self.path = path
+        # Opened once, every sample is appended to the end
+        self.file = open(path, 'ab+')
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() == 0:
+            self.file.write(STORE_HEADER.pack(
+                STORE_MAGIC, STORE_VERSION, len(WOD_FIELDS), WOD_RECORD.size))
+            self.file.flush()
+        else:
+            self.file.seek(0)
+            magic, version, n_fields, record_size = STORE_HEADER.unpack(
+                self.file.read(STORE_HEADER.size))
+            if magic != STORE_MAGIC or version != STORE_VERSION or record_size != WOD_RECORD.size:
+                raise ValueError(f"{path} is not a version {STORE_VERSION} WOD store")
+            self.file.seek(0, os.SEEK_END)
+        # Any partly written record at the end (eg. power lost mid write) is ignored
+        self.count = (self.file.tell() - STORE_HEADER.size) // WOD_RECORD.size
+        self.map = None
+
+    def __len__(self) -> int:
+        return self.refresh()
+
+    def refresh(self) -> int:
+        '''Count the records again, another process may have added or cleared some. Returns the count'''
+        # Any partly written record at the end is left out
+        count = max(os.fstat(self.file.fileno()).st_size - STORE_HEADER.size, 0) // WOD_RECORD.size
+        if count < self.count and self.map is not None:
+            # The file shrank, a map past its end can't be read
+            self.map.close()
+            self.map = None
+        self.count = count
+        return count
+
+    def append(self, sample):
+        '''Add a sample, a sequence of the WOD_FIELDS values'''
+        self.refresh()
+        end = STORE_HEADER.size + self.count * WOD_RECORD.size
+        if self.file.tell() != end:
+            # Drop a partly written record so the file stays aligned
+            self.file.truncate(end)
+            self.file.seek(end)
+        self.file.write(WOD_RECORD.pack(*sample))
+        self.file.flush()
+        self.count += 1
+
+    def append_many(self, samples):
+        '''Add several samples with one write'''
+        if not samples:
+            return
+        self.refresh()
+        end = STORE_HEADER.size + self.count * WOD_RECORD.size
+        if self.file.tell() != end:
+            self.file.truncate(end)
+            self.file.seek(end)
+        self.file.write(b''.join(WOD_RECORD.pack(*sample) for sample in samples))
+        self.file.flush()
+        self.count += len(samples)
+
+    def view(self) -> mmap.mmap:
+        '''Read only map of the file, mapped again whenever records have been added'''
+        size = STORE_HEADER.size + self.count * WOD_RECORD.size
+        if self.map is None or len(self.map) < size:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        return self.map
+
+    def record(self, index: int) -> WodRecord:
+        return WodRecord._make(WOD_RECORD.unpack_from(
+            self.view(), STORE_HEADER.size + index * WOD_RECORD.size))
+
+    def records(self, start: int, stop: int) -> list:
+        '''Records start to stop (exclusive) by index'''
+        start = max(start, 0)
+        stop = min(stop, self.count)
+        if start >= stop:
+            return []
+        view = self.view()
+        return [WodRecord._make(values) for values in WOD_RECORD.iter_unpack(
+            view[STORE_HEADER.size + start * WOD_RECORD.size:STORE_HEADER.size + stop * WOD_RECORD.size])]
+
+    def latest(self, n: int) -> list:
+        '''The last n samples, oldest first'''
+        self.refresh()
+        return self.records(self.count - n, self.count)
+
+    def time_at(self, index: int) -> int:
+        return struct.unpack_from('<I', self.view(), STORE_HEADER.size + index * WOD_RECORD.size)[0]
+
+    def find(self, start_time: int, end_time: int) -> list:
+        '''Samples with start_time <= time < end_time, found by binary search on the time'''
+        times = _TimeColumn(self)
+        return self.records(bisect.bisect_left(times, start_time), bisect.bisect_left(times, end_time))
+
+    def export_csv(self, file_path='wod.csv', start=0, stop=None):
+        '''Write the samples to a csv file in the same format as the old wod.csv log'''
+        stop = self.refresh() if stop is None else stop
+        with open(file_path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(WOD_FIELDS)
+            # In chunks so a long history is never all in memory
+            for chunk_start in range(start, stop, 1024):
+                # float32 holds about 7 significant digits, don't write the rounding noise
+                writer.writerows([row.time, row.mode] + [f'{value:.7g}' for value in row[2:]]
+                                 for row in self.records(chunk_start, min(chunk_start + 1024, stop)))
+
+    def clear(self):
+        '''Remove every sample'''
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.truncate(STORE_HEADER.size)
+        self.file.seek(STORE_HEADER.size)
+        self.count = 0
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+
+class _TimeColumn:
+    # Sequence of the record times for bisect, read from the store as they are needed
+    def __init__(self, store: WodStore) -> None:
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, index: int) -> int:
+        return self.store.time_at(index)
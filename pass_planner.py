@@ -0,0 +1,206 @@
+'''
+Pass window downlink planner.
+
+Given the products wanted from a pass, how much each is worth, the link throughput and the
+time left in the pass, picks the requests worth the most that fit in the time, and sends them
+through a ground_scheduler.CommandScheduler most valuable first. After every response the
+throughput is measured again and what is left is re-planned for the time remaining.
+
+A product is one or more alternative requests, of which at most one is sent. An image can be
+asked for at 1 to 4 interlaced passes (1/64, 1/16, 1/4 or all of the pixels), worth
+RESOLUTION_VALUE of its value, so the planner can settle for a lower resolution of one image
+to fit in another. Picking the requests is a multiple choice knapsack, solved exactly by
+dynamic programming over the pass time in PLAN_RESOLUTION steps.
+
+The time of a request is estimated as the round trip time, plus its packets at the measured
+packets/s, plus the arduino's wait after the last packet of a product with more than one.
+'''
+
+import math
+import struct
+import time
+from collections import namedtuple
+from itertools import accumulate
+from image_codec import Compression, Ordering, interlace_order
+from obc_comms import WOD_ROLLUP_REQUEST, CommandType, MessageType
+from obc_framing import INFO_PAYLOAD_LENGTH
+from obc_wod_rollup import ROLLUP_BUCKET
+from wod_dataset import WOD_BLOB
+
+WOD_LENGTH = WOD_BLOB.itemsize
+IMAGE_WIDTH = 64
+IMAGE_HEIGHT = 64
+# The arduino waits this long after the last packet of a product before handing back control
+ARDUINO_PACKET_TIMEOUT = 1.0
+# Seconds per step of the planning table
+PLAN_RESOLUTION = 0.1
+# Share of an image's value for each number of interlaced passes
+RESOLUTION_VALUE = (0.4, 0.7, 0.9, 1.0)
+
+# One way of getting a product. packets counts the header packet, command is the line sent to the arduino
+# and passes is the number of interlaced passes asked for (0 if not an image)
+Option = namedtuple('Option', ['product', 'description', 'command', 'packets', 'value', 'passes'], defaults=[0])
+
+# A wanted product: name, value and the alternative Options for it, best first
+Product = namedtuple('Product', ['name', 'value', 'options'])
+
+PlanStats = namedtuple('PlanStats', ['sent', 'answered', 'value', 'seconds', 'packets_per_second'])
+
+
+def information_packets(n_bytes: int) -> int:
+    return math.ceil(n_bytes / INFO_PAYLOAD_LENGTH)
+
+
+def wod_product(value: float) -> Product:
+    return Product('wod', value, [Option('wod', 'latest WOD', b'wod\n', 1 + information_packets(WOD_LENGTH), value)])
+
+
+def rollup_product(window_seconds: int, n_windows: int, value: float) -> Product:
+    # Raw REQUEST_WOD_ROLLUP command, see SerialTest's wodrollup
+    contents = bytes([MessageType.GROUND_STATION_COMMAND.value, CommandType.REQUEST_WOD_ROLLUP.value]) \
+        + WOD_ROLLUP_REQUEST.pack(window_seconds, n_windows)
+    return Product(f'rollup {window_seconds}s', value, [Option(
+        f'rollup {window_seconds}s', f'{n_windows} WOD rollup windows of {window_seconds}s', f'raw {contents.hex()}\n'.encode(),
+        1 + information_packets(n_windows * ROLLUP_BUCKET.size), value)])
+
+
+def image_product(camera: int, max_passes: int, value: float, width=IMAGE_WIDTH, height=IMAGE_HEIGHT,
+                  compression=Compression.RAW, level=0) -> Product:
+    '''
+        The latest image from a camera (0 left, 1 right) at up to max_passes interlaced passes.
+        Sizes are estimated for an uncompressed image, re-planning corrects for compression
+    '''
+    camera_name = 'left' if camera == 0 else 'right'
+    pass_bytes = list(accumulate(len(indices) for indices in interlace_order(width, height)))
+    options = []
+    for passes in range(max_passes, 0, -1):
+        command = f'getimg 0 {camera} 0 0 {compression.value} {level} {Ordering.INTERLACED.value} {passes}\n'.encode()
+        options.append(Option(camera_name, f'{camera_name} image, {passes} of 4 passes', command,
+                              1 + information_packets(pass_bytes[passes - 1]), value * RESOLUTION_VALUE[passes - 1],
+                              passes))
+    return Product(camera_name, value, options)
+
+
+def request_seconds(option: Option, packets_per_second: float, round_trip: float) -> float:
+    seconds = round_trip + (option.packets - 1) / packets_per_second
+    if option.packets > 1:
+        seconds += ARDUINO_PACKET_TIMEOUT
+    return seconds
+
+
+def plan(products, seconds: float, packets_per_second: float, round_trip: float) -> list:
+    '''
+        The Options worth the most in total that fit in seconds, at most one per product,
+        most valuable first
+    '''
+    steps = int(seconds / PLAN_RESOLUTION)
+    if steps <= 0:
+        return []
+    # best[t] is the most value in t steps using the products so far, choices records each product's pick
+    best = [0.0] * (steps + 1)
+    choices = []
+    for product in products:
+        costs = [math.ceil(request_seconds(option, packets_per_second, round_trip) / PLAN_RESOLUTION)
+                 for option in product.options]
+        new_best = list(best)
+        choice = [None] * (steps + 1)
+        for t in range(steps + 1):
+            for i, (option, cost) in enumerate(zip(product.options, costs)):
+                if cost <= t and best[t - cost] + option.value > new_best[t]:
+                    new_best[t] = best[t - cost] + option.value
+                    choice[t] = (i, cost)
+        best = new_best
+        choices.append(choice)
+
+    picked = []
+    t = steps
+    for product, choice in zip(reversed(products), reversed(choices)):
+        if choice[t] is not None:
+            i, cost = choice[t]
+            picked.append(product.options[i])
+            t -= cost
+    return sorted(picked, key=lambda option: option.value, reverse=True)
+
+
+class PassPlanner:
+    def __init__(self, scheduler, products, pass_seconds: float, packets_per_second=20.0, round_trip=0.2,
+                 smoothing=0.5) -> None:
+        '''
+            scheduler: the ground_scheduler.CommandScheduler requests are sent through
+            pass_seconds: time left in the pass
+            packets_per_second, round_trip: link estimates until they are measured
+            smoothing: weight of each new throughput measurement
+        '''
+        self.scheduler = scheduler
+        self.products = list(products)
+        self.deadline = time.monotonic() + pass_seconds
+        self.packets_per_second = packets_per_second
+        self.round_trip = round_trip
+        self.smoothing = smoothing
+        self.stopped = False
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def current_plan(self) -> list:
+        return plan(self.products, self.remaining(), self.packets_per_second, self.round_trip)
+
+    def print_plan(self, options):
+        print(f'--- Pass plan, {self.remaining():.0f}s left at {self.packets_per_second:.1f} packets/s ---')
+        total = 0
+        for option in options:
+            seconds = request_seconds(option, self.packets_per_second, self.round_trip)
+            total += seconds
+            print(f'{total:6.1f}s  {option.description} ({option.packets} packets, value {option.value:g})')
+        skipped = [product.name for product in self.products if product.name not in {o.product for o in options}]
+        if skipped:
+            print(f'Not enough time for: {", ".join(skipped)}')
+        print('-------------------')
+
+    def measure(self, option: Option, response: bytes, seconds: float):
+        packets = option.packets
+        if response and response[0] == 2 and len(response) >= 28:
+            # A science image header has the packets up to the end of each pass, use the real count
+            n_passes = response[19]
+            pass_ends = struct.unpack_from('<4H', response, 20)[:n_passes]
+            if pass_ends and option.passes:
+                packets = 1 + pass_ends[min(option.passes, n_passes) - 1]
+        transfer = seconds - self.round_trip - (ARDUINO_PACKET_TIMEOUT if packets > 1 else 0)
+        if packets > 2 and transfer > 0:
+            rate = (packets - 1) / transfer
+            self.packets_per_second += self.smoothing * (rate - self.packets_per_second)
+        elif packets == 1:
+            self.round_trip += self.smoothing * (seconds - self.round_trip)
+
+    def run(self) -> PlanStats:
+        '''Send the plan, re-planning after every response, until the pass ends or nothing more fits'''
+        start = time.monotonic()
+        sent = answered = 0
+        value = 0.0
+        while not self.stopped:
+            options = self.current_plan()
+            if not options:
+                break
+            self.print_plan(options)
+            option = options[0]
+            request_start = time.monotonic()
+            request = self.scheduler.submit(option.command)
+            sent += 1
+            try:
+                response = request.result(timeout=max(self.remaining(), 0) + self.scheduler.timeout)
+            except Exception as e:
+                print(f'{option.description} failed: {e}')
+                response = None
+            else:
+                answered += 1
+                value += option.value
+                self.measure(option, response, time.monotonic() - request_start)
+            # Done with this product either way, a failed request isn't retried
+            self.products = [product for product in self.products if product.name != option.product]
+        seconds = time.monotonic() - start
+        print(f'Pass plan finished: {answered}/{sent} requests answered, value {value:g} in {seconds:.1f}s')
+        return PlanStats(sent, answered, value, seconds, self.packets_per_second)
+
+    def stop(self):
+        '''Stop after the request being sent'''
+        self.stopped = True
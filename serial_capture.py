@@ -0,0 +1,330 @@
+'''
+Binary capture of the raw bytes on a serial port, and replay of captures through the decoders.
+
+Wrap a serial port in CaptureSerial and every read and write is recorded with the time it
+happened, so a pass can be decoded again offline or used to benchmark the parsers.
+
+File format (little endian):
+File header: 4 byte magic 'ZCAP', uint8 version, uint64 wall clock start time (ns since the unix epoch)
+Then one record per read or write:
+uint64 - ns since the start of the capture (monotonic clock)
+uint8 - direction, RX (read from the port) or TX (written to the port)
+uint16 - data length
+data length bytes - the raw bytes
+
+A ground station replay writes the WOD, rollups and images it decodes to a scratch directory
+rather than next to the live data, see replay_ground.
+
+Usage: python serial_capture.py dump <capture file>
+       python serial_capture.py replay <capture file> [--target ground|obc] [--realtime] [--speed 1.0] [--quiet]
+                                       [--output-dir <directory>]
+'''
+
+import argparse
+import contextlib
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+CAPTURE_MAGIC = b'ZCAP'
+CAPTURE_VERSION = 1
+FILE_HEADER = struct.Struct('<4sBQ')
+RECORD_HEADER = struct.Struct('<QBH')
+MAX_RECORD_LENGTH = 0xFFFF
+
+# Direction of a record
+RX = 0
+TX = 1
+
+CaptureRecord = namedtuple('CaptureRecord', ['time', 'direction', 'data'])
+
+
+class CaptureWriter:
+    '''
+        Appends records to a capture file through a write buffer, so recording doesn't add a
+        disk write to every serial read. Safe to use from several threads
+    '''
+
+    def __init__(self, path: str, buffer_size=1 << 16) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.file = open(path, 'wb', buffering=buffer_size)
+        self.lock = threading.Lock()
+        self.start_ns = time.monotonic_ns()
+        self.file.write(FILE_HEADER.pack(
+            CAPTURE_MAGIC, CAPTURE_VERSION, time.time_ns()))
+
+    def record(self, direction: int, data):
+        if not data or self.file is None:
+            return
+        now = time.monotonic_ns() - self.start_ns
+        with self.lock:
+            for offset in range(0, len(data), MAX_RECORD_LENGTH):
+                chunk = data[offset:offset + MAX_RECORD_LENGTH]
+                self.file.write(RECORD_HEADER.pack(now, direction, len(chunk)))
+                self.file.write(chunk)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureSerial:
+    '''
+        Serial port wrapper that records everything read and written to a CaptureWriter.
+        Anything else is passed straight through to the wrapped port
+    '''
+
+    def __init__(self, ser, writer: CaptureWriter) -> None:
+        self.ser = ser
+        self.writer = writer
+
+    def read(self, size=1) -> bytes:
+        data = self.ser.read(size)
+        self.writer.record(RX, data)
+        return data
+
+    def readline(self, *args) -> bytes:
+        data = self.ser.readline(*args)
+        self.writer.record(RX, data)
+        return data
+
+    def write(self, data):
+        self.writer.record(TX, bytes(data))
+        return self.ser.write(data)
+
+    def close(self):
+        self.writer.close()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def __setattr__(self, name, value):
+        # Port settings such as timeout belong to the wrapped port
+        if name in ('ser', 'writer'):
+            super().__setattr__(name, value)
+        else:
+            setattr(self.ser, name, value)
+
+
+def read_capture(path: str):
+    '''Generator of the CaptureRecords in a capture file. Returns (start time, records)'''
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError(f"{path} is not a capture file")
+    magic, version, start_time = FILE_HEADER.unpack_from(data)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError(f"{path} is not a version {CAPTURE_VERSION} capture file")
+
+    def records():
+        view = memoryview(data)
+        offset = FILE_HEADER.size
+        end = len(data)
+        while offset + RECORD_HEADER.size <= end:
+            ns, direction, length = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > end:
+                # The capture was cut off part way through a record
+                break
+            yield CaptureRecord(ns, direction, view[offset:offset + length])
+            offset += length
+    return start_time, records()
+
+
+class ReplaySerial:
+    '''
+        Serial port stand in that reads back the received (RX) bytes of a capture.
+        As fast as possible by default, or realtime=True delivers each record at the time it
+        was captured (divided by speed). Writes are counted and discarded
+    '''
+
+    def __init__(self, records, realtime=False, speed=1.0) -> None:
+        self.records = (r for r in records if r.direction == RX)
+        self.realtime = realtime
+        self.speed = speed
+        self.buffer = bytearray()
+        self.next_record = None
+        self.exhausted = False
+        self.start = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.timeout = 0
+
+    def fill(self, block=True) -> bool:
+        '''Move the next record into the read buffer. Returns False once there are no more'''
+        if self.next_record is None:
+            self.next_record = next(self.records, None)
+            if self.next_record is None:
+                self.exhausted = True
+                return False
+        if self.realtime:
+            if self.start is None:
+                self.start = time.monotonic() - self.next_record.time / 1e9 / self.speed
+            delay = self.start + self.next_record.time / 1e9 / self.speed - time.monotonic()
+            if delay > 0:
+                if not block:
+                    return False
+                time.sleep(delay)
+        self.buffer += self.next_record.data
+        self.next_record = None
+        return True
+
+    def take(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        while self.fill(block=False):
+            if not self.realtime:
+                break
+        return len(self.buffer)
+
+    @property
+    def out_waiting(self) -> int:
+        return 0
+
+    def at_end(self) -> bool:
+        return not self.buffer and self.next_record is None and self.exhausted
+
+    def read(self, size=1) -> bytes:
+        while len(self.buffer) < size and self.fill():
+            pass
+        return self.take(size)
+
+    def readline(self) -> bytes:
+        while b'\n' not in self.buffer and self.fill():
+            pass
+        end = self.buffer.find(b'\n')
+        return self.take(end + 1 if end != -1 else len(self.buffer))
+
+    def write(self, data) -> int:
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def working_directory(path: str):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def replay_ground(port: ReplaySerial, output_dir: str = None) -> int:
+    '''
+        Feed a ground station capture through the SerialTest.py decoders. Returns the number of packets decoded.
+        SerialTest writes what it decodes relative to the working directory, so the replay runs in output_dir,
+        by default a temporary directory removed afterwards, and never adds to the live WOD and images
+    '''
+    import SerialTest
+    with contextlib.ExitStack() as stack:
+        if output_dir is None:
+            output_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='replay-'))
+        os.makedirs(os.path.join(output_dir, 'images'), exist_ok=True)
+        stack.enter_context(working_directory(output_dir))
+        packets = 0
+        while True:
+            data = port.readline()
+            if not data:
+                if port.at_end():
+                    return packets
+                continue
+            packets += SerialTest.process_line(port, data, show_images=False)
+
+
+def replay_obc(port: ReplaySerial, realtime=False) -> int:
+    '''Feed a CubeSat capture through OBCCommunication. Returns the number of frames received'''
+    from obc_comms import OBCCommunication
+    from obc_pacing import AdaptivePacer
+    obc = OBCCommunication(ser=port)
+    if not realtime:
+        # Nothing is really transmitted, so don't wait between packets
+        obc.pacer = AdaptivePacer(initial_gap=0, min_gap=0)
+    while not port.at_end():
+        obc.receiveTransmission()
+        if realtime:
+            time.sleep(0.001)
+    return obc.reassembler.frames_received
+
+
+def dump(path: str):
+    start_time, records = read_capture(path)
+    print(f'Capture started {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time / 1e9))}')
+    for record in records:
+        print(f'{record.time / 1e9:12.6f} {"RX" if record.direction == RX else "TX"} '
+              f'{len(record.data):5} {bytes(record.data)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    dump_parser = subparsers.add_parser('dump', help='print every record')
+    dump_parser.add_argument('capture')
+    replay_parser = subparsers.add_parser(
+        'replay', help='feed the received bytes back through the decoders')
+    replay_parser.add_argument('capture')
+    replay_parser.add_argument('--target', choices=['ground', 'obc'], default='ground',
+                               help='ground for SerialTest.py captures, obc for OBCCommunication captures')
+    replay_parser.add_argument('--realtime', action='store_true',
+                               help='replay at the captured timing instead of as fast as possible')
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help='with --realtime, replay this many times faster')
+    replay_parser.add_argument('--quiet', action='store_true',
+                               help="hide the decoders' output")
+    replay_parser.add_argument('--output-dir',
+                               help='with --target ground, keep the decoded WOD, rollups and images in this directory. '
+                                    'By default they go to a temporary directory')
+    args = parser.parse_args()
+
+    if args.command == 'dump':
+        dump(args.capture)
+        return
+
+    out = sys.stdout
+    _, records = read_capture(args.capture)
+    port = ReplaySerial(records, args.realtime, args.speed)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.quiet else out):
+        if args.target == 'ground':
+            decoded = replay_ground(port, args.output_dir)
+        else:
+            decoded = replay_obc(port, args.realtime)
+    seconds = time.perf_counter() - start
+    print(f'Replayed {port.bytes_read} bytes in {seconds:.3f}s ({port.bytes_read / seconds / 1e6 if seconds else 0:.2f} MB/s), '
+          f'{decoded} packets decoded', file=out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+'''A serial port stand-in that records every write, for the transports under test'''
+
+from obc_framing import ATS_HEADER
+
+
+class RecordingSerial:
+    def __init__(self) -> None:
+        self.writes = []
+        self.timeout = 0
+        self.in_waiting = 0
+        self.out_waiting = 0
+
+    def write(self, data) -> int:
+        self.writes.append(bytes(data))
+        return len(data)
+
+    def read(self, size=1) -> bytes:
+        return b''
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def frames(self) -> list:
+        '''The packets sent with ATS commands'''
+        return [data[ATS_HEADER.size:] for data in self.writes if data[:3] == b'ATS']
@@ -0,0 +1,50 @@
+import time
+
+from obc_comms import MessageType, OBCCommunication
+from zetaplus_sim import GroundStationSim, SimulatedLink, SimulatedZetaPlus
+
+WINDOW = 8
+N_PACKETS = 40
+
+
+def test_ground_station_grants_half_windows():
+    ground = GroundStationSim(SimulatedZetaPlus(SimulatedLink()))
+    commands = []
+    ground.send_command = lambda command_type, args=b'': commands.append((command_type, args))
+    ground.send_user_command(f'creditwindow {WINDOW}')
+    assert commands == [(16, WINDOW.to_bytes(2, 'little'))]
+
+    commands.clear()
+    ground.begin_additional_packets('Science Image')
+    for _ in range(WINDOW + 1):
+        ground.receive(bytes(64), 64, 150)
+    assert commands == [(11, (WINDOW // 2).to_bytes(2, 'little'))] * 2
+
+
+def test_downlink_runs_on_granted_credits():
+    link = SimulatedLink(rf_bitrate=1_000_000, latency=0.001)
+    obc = OBCCommunication(ser=SimulatedZetaPlus(link, 1_000_000).host)
+    obc.pacer.min_gap = obc.pacer.gap = 0
+    ground = GroundStationSim(SimulatedZetaPlus(link, 1_000_000), additional_packets_timeout=0.2)
+    ground.start()
+    try:
+        ground.pc.write(f'creditwindow {WINDOW}\n'.encode())
+        deadline = time.monotonic() + 2
+        while obc.pacer.window != WINDOW and time.monotonic() < deadline:
+            obc.receiveTransmission()
+            time.sleep(0.001)
+        assert obc.pacer.window == WINDOW
+
+        # The downlink only gets past the first window through the grants, which the pacer
+        # receives while it waits
+        obc.pacer.credit_timeout = 5.0
+        obc.downlink_header_packet(bytes([MessageType.SCIENCE_IMAGE.value]))
+        start = time.monotonic()
+        obc.pacer.begin()
+        obc.downlink_information_packets(MessageType.SCIENCE_IMAGE, bytes(61 * N_PACKETS))
+        stats = obc.pacer.end()
+        assert stats.packets == N_PACKETS
+        assert obc.pacer.lost_packets == 0
+        assert time.monotonic() - start < obc.pacer.credit_timeout
+    finally:
+        ground.stop()
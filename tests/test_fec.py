@@ -0,0 +1,107 @@
+import asyncio
+import os
+
+from fake_serial import RecordingSerial
+from obc_async import AsyncOBCCommunication
+from obc_comms import MessageType, OBCCommunication
+from obc_framing import FecParameters, FrameBuilder, PacketAssembler, header_fec, is_parity_packet
+from obc_multilink import StripedOBCCommunication
+from obc_pacing import AdaptivePacer
+
+FEC = FecParameters(8, 2)
+CONTENTS = os.urandom(61 * 20 + 17)
+N_PACKETS = 21
+# 3 blocks of 8, 8 and 5 packets, 2 parity packets each
+N_PARITY = 6
+
+
+def unpaced(obc):
+    obc.pacer = AdaptivePacer(initial_gap=0, min_gap=0)
+    return obc
+
+
+def assemble(frames, lost=(), fec=FEC) -> PacketAssembler:
+    assembler = PacketAssembler(N_PACKETS, 61, fec)
+    for frame in frames:
+        if is_parity_packet(frame):
+            assembler.add_parity(frame)
+        elif N_PACKETS - int.from_bytes(frame[:2], 'little') - 1 not in lost:
+            assembler.add(frame)
+    return assembler
+
+
+def check_frames(frames):
+    information = [frame for frame in frames if frame[:4] != b'USYD']
+    assert sum(map(is_parity_packet, information)) == N_PARITY
+    assert len(information) == N_PACKETS + N_PARITY
+    # A burst of 2 in every block is rebuilt
+    assembler = assemble(information, lost={3, 4, 8, 9, 19, 20})
+    assert assembler.complete()
+    assert assembler.packets_rebuilt == 6
+    assert bytes(assembler.data[:len(CONTENTS)]) == CONTENTS
+
+
+def test_rebuilds_lost_packets():
+    frames = [bytes(frame) for frame in FrameBuilder().information_frames(2, CONTENTS, fec=FEC)]
+    check_frames(frames)
+
+
+def test_parity_only_for_whole_blocks():
+    builder = FrameBuilder()
+    frames = [bytes(frame) for frame in builder.information_frames(2, CONTENTS, range(4, 21), fec=FEC)]
+    assert sum(map(is_parity_packet, frames)) == 4
+    frames = [bytes(frame) for frame in builder.information_frames(2, CONTENTS, [3, 5], fec=FEC)]
+    assert sum(map(is_parity_packet, frames)) == 0
+
+
+def test_sync_transport_sends_parity():
+    ser = RecordingSerial()
+    obc = unpaced(OBCCommunication(ser=ser))
+    obc.CMD_set_fec(*FEC)
+    obc.downlink_information_packets(MessageType.SCIENCE_IMAGE, CONTENTS)
+    check_frames(ser.frames())
+
+
+def test_async_transport_sends_parity():
+    ser = RecordingSerial()
+    obc = unpaced(AsyncOBCCommunication(ser=ser))
+    obc.CMD_set_fec(*FEC)
+
+    async def downlink():
+        obc.write_queue = asyncio.Queue()
+        writer = asyncio.get_running_loop().create_task(obc.writer())
+        obc.downlink_information_packets(MessageType.SCIENCE_IMAGE, CONTENTS)
+        await obc.write_queue.join()
+        writer.cancel()
+    asyncio.run(downlink())
+    check_frames(ser.frames())
+
+
+def test_striped_transport_sends_parity():
+    ser, link_ser = RecordingSerial(), RecordingSerial()
+    link = unpaced(OBCCommunication(ser=link_ser, channel=1))
+    obc = unpaced(StripedOBCCommunication(ser=ser, links=[link]))
+    obc.CMD_set_fec(*FEC)
+    obc.downlink_header_packet(bytes([MessageType.SCIENCE_IMAGE.value]))
+    obc.downlink_information_packets(MessageType.SCIENCE_IMAGE, CONTENTS)
+    # Both links sent the header, and the packets between them
+    assert all(frames[0][:4] == b'USYD' for frames in (ser.frames(), link_ser.frames()))
+    check_frames(ser.frames() + link_ser.frames())
+
+
+def test_header_carries_fec():
+    ser = RecordingSerial()
+    obc = unpaced(OBCCommunication(ser=ser))
+    obc.CMD_set_fec(*FEC)
+    obc.downlink_header_packet(bytes([MessageType.SCIENCE_IMAGE.value]))
+    obc.downlink_information_packets(MessageType.SCIENCE_IMAGE, CONTENTS)
+    obc.downlink_header_packet(bytes([MessageType.PONG.value]))
+    header, *information, pong = ser.frames()
+    # A ground station that never saw the fec command rebuilds from the header alone
+    assembler = assemble(information, lost={0, 13}, fec=header_fec(header[4:]))
+    assert assembler.complete()
+    assert header_fec(pong[4:]) is None
+
+    obc.CMD_set_fec(0, 0)
+    obc.downlink_header_packet(bytes([MessageType.SCIENCE_IMAGE.value]))
+    assert header_fec(ser.frames()[-1][4:]) is None
@@ -0,0 +1,24 @@
+import time
+
+from fake_serial import RecordingSerial
+from ground_scheduler import CommandScheduler
+
+
+def test_unanswered_command_does_not_hold_the_window():
+    ser = RecordingSerial()
+    scheduler = CommandScheduler(ser, window=1, timeout=5.0)
+    scheduler.start()
+    try:
+        # The CubeSat never answers a science reading request
+        reading = scheduler.submit(b'getsciencereading 769831935\n')
+        assert reading.result(timeout=1) is None
+        ping = scheduler.submit(b'ping\n')
+        # Sent straight away, the window is free
+        deadline = time.monotonic() + 1
+        while not scheduler.pending()[1] and time.monotonic() < deadline:
+            time.sleep(0.001)
+        scheduler.response_received(6, b'\x06')
+        assert ping.result(timeout=1) == b'\x06'
+    finally:
+        scheduler.stop()
+    assert ser.writes == [b'getsciencereading 769831935\n', b'ping\n']
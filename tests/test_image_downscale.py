@@ -0,0 +1,21 @@
+from PIL import Image
+
+from ImageDownscale import convert_batch, read_greyscale_data_from_binary
+
+
+def test_colliding_outputs_are_not_converted(tmp_path):
+    images = tmp_path / 'images'
+    images.mkdir()
+    Image.new('L', (8, 8), 10).save(images / 'a.png')
+    Image.new('L', (8, 8), 200).save(images / 'a.jpg')
+    Image.new('L', (8, 8), 50).save(images / 'b.png')
+    output = tmp_path / 'bin'
+
+    assert convert_batch(str(images), str(output), workers=1) == (1, 0, 2)
+    # Neither a.png nor a.jpg is written over the other
+    assert not (output / 'a.bin').exists()
+    assert read_greyscale_data_from_binary(str(output / 'b.bin'))[2] == [50] * 64
+
+    # Once one is renamed both are converted
+    (images / 'a.jpg').rename(images / 'a2.jpg')
+    assert convert_batch(str(images), str(output), workers=1) == (2, 1, 0)
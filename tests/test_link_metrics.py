@@ -0,0 +1,31 @@
+import json
+
+from fake_serial import RecordingSerial
+from obc_comms import OBCCommunication
+from obc_link_metrics import LinkMetrics, read_snapshots
+
+
+def test_snapshot_file_is_limited(tmp_path):
+    path = str(tmp_path / 'link_metrics.jsonl')
+    metrics = LinkMetrics()
+    snapshot_bytes = len(json.dumps(metrics.snapshot())) + 1
+    # Moved aside once it holds 3 snapshots
+    metrics.max_file_bytes = int(2.5 * snapshot_bytes)
+    for _ in range(10):
+        metrics.save_snapshot(path)
+    # The full file is moved aside, only the newest snapshots are kept
+    assert len(read_snapshots(path)) == 1
+    assert len(read_snapshots(path + '.1')) == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['link_metrics.jsonl', 'link_metrics.jsonl.1']
+
+
+def test_snapshots_are_opt_in(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    obc = OBCCommunication(ser=RecordingSerial())
+    obc.metrics.snapshot_interval = 0
+    obc.receiveTransmission()
+    assert list(tmp_path.iterdir()) == []
+
+    obc.metrics_path = 'link_0.jsonl'
+    obc.receiveTransmission()
+    assert len(read_snapshots(tmp_path / 'link_0.jsonl')) == 1
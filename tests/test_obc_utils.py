@@ -0,0 +1,30 @@
+import threading
+import time
+
+import obc_utils
+
+
+def test_one_logger_per_file(monkeypatch):
+    created = []
+
+    class SlowLogger:
+        def __init__(self, log_file, binary=False) -> None:
+            # Widens the window between checking for a logger and adding it
+            time.sleep(0.01)
+            created.append(log_file)
+
+    monkeypatch.setattr(obc_utils, 'BackgroundLogger', SlowLogger)
+    monkeypatch.setattr(obc_utils, 'loggers', {})
+    barrier = threading.Barrier(8)
+    found = []
+
+    def get():
+        barrier.wait()
+        found.append(obc_utils.get_logger('race.txt'))
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == ['race.txt']
+    assert all(logger is found[0] for logger in found)
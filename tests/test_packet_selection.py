@@ -0,0 +1,30 @@
+from obc_framing import (RANGE, SELECTION_BITMAP, SELECTION_RANGES, decode_packet_selection,
+                         encode_packet_selection)
+
+SELECTION_LENGTH = 53
+
+
+def test_round_trip():
+    for indices in ([], [0, 1, 2, 7, 40, 41], list(range(0, 200, 2))):
+        mode, selection, encoded = encode_packet_selection(indices, SELECTION_LENGTH)
+        assert len(selection) <= SELECTION_LENGTH
+        assert decode_packet_selection(mode, selection, 200) == encoded
+
+
+def test_range_count_past_the_end():
+    # Claims 200 ranges but holds 2, and a third cut short
+    selection = bytes([200]) + RANGE.pack(3, 2) + RANGE.pack(10, 1) + b'\x05'
+    assert decode_packet_selection(SELECTION_RANGES, selection) == [3, 4, 10]
+
+
+def test_out_of_range_indices():
+    selection = bytes([2]) + RANGE.pack(8, 4) + RANGE.pack(0xFFF0, 0xFFFF)
+    assert decode_packet_selection(SELECTION_RANGES, selection, 10) == [8, 9]
+    bitmap = (6).to_bytes(2, 'little') + b'\xff'
+    assert decode_packet_selection(SELECTION_BITMAP, bitmap, 10) == [6, 7, 8, 9]
+
+
+def test_short_selections():
+    assert decode_packet_selection(SELECTION_RANGES, b'') == []
+    assert decode_packet_selection(SELECTION_BITMAP, b'\x01') == []
+    assert decode_packet_selection(7, b'\x01\x00\x00\x01\x00') == []
@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import Future
+
+import SerialTest
+from ground_scheduler import CommandScheduler
+from obc_comms import SCIENCE_IMAGE_HEADER
+from pass_planner import PassPlanner, image_product, wod_product
+
+# Packets up to the end of each interlaced pass, fewer than the uncompressed estimate
+PASS_ENDS = (5, 10, 20, 40)
+
+
+def image_header(passes=4) -> bytes:
+    return SCIENCE_IMAGE_HEADER.pack(2, 0, 64, 64, 0, 0, 1, 2400, 6, 1, passes, *PASS_ENDS)
+
+
+class FakeScheduler:
+    '''Answers every request straight away, images with a compressed image header'''
+    timeout = 1.0
+
+    def __init__(self) -> None:
+        self.commands = []
+
+    def submit(self, command, priority=None) -> Future:
+        self.commands.append(command)
+        future = Future()
+        future.set_result(image_header() if command.startswith(b'getimg') else b'\x01')
+        return future
+
+
+def test_run_measures_image_responses():
+    scheduler = FakeScheduler()
+    planner = PassPlanner(scheduler, [image_product(0, 4, 10.0), wod_product(1.0)], 60)
+    stats = planner.run()
+    assert stats.answered == stats.sent == 2
+    assert scheduler.commands[0].startswith(b'getimg')
+
+
+def test_measure_uses_the_packets_in_the_header():
+    planner = PassPlanner(FakeScheduler(), [], 60, packets_per_second=20.0, round_trip=0.2)
+    option = image_product(0, 4, 10.0).options[0]
+    # 40 information packets at 10 packets/s, after the round trip and the arduino's wait
+    planner.measure(option, image_header(), 0.2 + 1.0 + 4.0)
+    assert abs(planner.packets_per_second - 15.0) < 1e-6
+
+
+def test_failed_plan_allows_the_next(monkeypatch):
+    def fail(self):
+        raise RuntimeError('planner failed')
+    monkeypatch.setattr(PassPlanner, 'run', fail)
+    monkeypatch.setattr(SerialTest, 'pass_planner', None)
+    # The thread's exception is expected, keep it out of the output
+    monkeypatch.setattr('threading.excepthook', lambda args: None)
+    SerialTest.start_pass_plan(CommandScheduler(None), [wod_product(1.0)], 60)
+    deadline = time.monotonic() + 1
+    while not SerialTest.pass_planner.stopped and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert SerialTest.pass_planner.stopped
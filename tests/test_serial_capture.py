@@ -0,0 +1,35 @@
+import os
+
+from fake_serial import RecordingSerial
+from obc_framing import FrameBuilder
+from serial_capture import RX, CaptureRecord, ReplaySerial, replay_ground
+from wod_dataset import WOD_BLOB
+from zetaplus_sim import GroundStationSim, SimulatedLink, SimulatedZetaPlus
+
+
+def wod_capture() -> list:
+    # What the arduino prints for a WOD downlink
+    ground = GroundStationSim(SimulatedZetaPlus(SimulatedLink()))
+    ground.serial = RecordingSerial()
+    ground.receive(b'USYD' + bytes([GroundStationSim.WOD]) + bytes(59), 64, 150)
+    for frame in FrameBuilder().information_frames(GroundStationSim.WOD, bytes(WOD_BLOB.itemsize)):
+        ground.receive(bytes(frame), 64, 150)
+    ground.println()
+    ground.println('<WOD Message/>')
+    ground.println('Finished processing all additional packets.')
+    return [CaptureRecord(0, RX, b''.join(ground.serial.writes))]
+
+
+def test_replay_keeps_out_of_live_data(tmp_path, monkeypatch):
+    live = tmp_path / 'live'
+    live.mkdir()
+    monkeypatch.chdir(live)
+    scratch = tmp_path / 'scratch'
+    assert replay_ground(ReplaySerial(wod_capture()), str(scratch)) == 1
+    assert os.getcwd() == str(live)
+    assert list(live.iterdir()) == []
+    assert (scratch / 'wod.csv').is_file()
+
+    # By default a temporary directory
+    assert replay_ground(ReplaySerial(wod_capture())) == 1
+    assert list(live.iterdir()) == []
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from fake_serial import RecordingSerial
+from link_timing import TIME_SYNC_REPLY
+from obc_async import AsyncOBCCommunication
+from obc_comms import MessageType, OBCCommunication
+from obc_pacing import AdaptivePacer
+
+GAP = 0.01
+N_PACKETS = 20
+
+
+def paced(obc):
+    # A fixed gap between packets
+    obc.pacer = AdaptivePacer(initial_gap=GAP, min_gap=GAP, decrease=1.0)
+    return obc
+
+
+def reply(ser: RecordingSerial) -> tuple:
+    frame = ser.frames()[-1]
+    assert frame[4] == MessageType.TIME_SYNC.value
+    return TIME_SYNC_REPLY.unpack_from(frame, 4)
+
+
+def test_sync_transport_stamps_send_time():
+    ser = RecordingSerial()
+    obc = paced(OBCCommunication(ser=ser))
+    obc.CMD_time_sync(7, 123.5)
+    _, sequence, ground_time, received, sent = reply(ser)
+    assert (sequence, ground_time) == (7, 123.5)
+    assert 0 <= sent - received < 1
+
+
+def test_async_reply_stamped_when_written():
+    ser = RecordingSerial()
+    obc = paced(AsyncOBCCommunication(ser=ser))
+
+    async def exchange():
+        obc.write_queue = asyncio.Queue()
+        writer = asyncio.get_running_loop().create_task(obc.writer())
+        # The reply queues behind a product
+        obc.downlink_information_packets(MessageType.SCIENCE_IMAGE, bytes(61 * N_PACKETS))
+        start = time.monotonic()
+        obc.CMD_time_sync(1, 0.0)
+        handler_seconds = time.monotonic() - start
+        await obc.write_queue.join()
+        writer.cancel()
+        return handler_seconds
+    handler_seconds = asyncio.run(exchange())
+
+    # The handler doesn't block the event loop waiting for the pacer
+    assert handler_seconds < GAP
+    _, _, _, received, sent = reply(ser)
+    # t3 is when the reply was written, after the product, not when it was queued
+    assert sent - received >= GAP * N_PACKETS * 0.8
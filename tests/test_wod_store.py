@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+
+import obc_utils
+from obc_wod_store import WodStore
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample(time: int) -> list:
+    return [time, 1] + [float(time % 7)] * 7
+
+
+def append_in_other_process(path, times):
+    # As obc_input's sampler does while the comms are running
+    subprocess.run([sys.executable, '-c', 'import sys; from obc_wod_store import WodStore; '
+                    'WodStore(sys.argv[1]).append_many([[t, 1] + [float(t % 7)] * 7 for t in map(int, sys.argv[2:])])',
+                    str(path)] + [str(t) for t in times], cwd=REPO, check=True)
+
+
+def test_store_sees_other_writers(tmp_path):
+    path = tmp_path / 'wod.bin'
+    reader, writer = WodStore(path), WodStore(path)
+    writer.append_many([sample(t) for t in range(100, 110)])
+    assert len(reader) == 10
+    assert reader.latest(1)[0].time == 109
+    assert [r.time for r in reader.find(105, 200)] == list(range(105, 110))
+
+    # Appending after the other writer doesn't overwrite its records
+    reader.append(sample(110))
+    writer.append(sample(111))
+    assert [r.time for r in reader.latest(3)] == [109, 110, 111]
+
+    writer.clear()
+    assert len(reader) == 0 and reader.latest(1) == []
+    reader.close()
+    writer.close()
+
+
+def test_rollup_catches_up(tmp_path, monkeypatch):
+    # log.txt goes in tmp_path too
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'wod.bin')
+    try:
+        obc_utils.log_wod_batch([sample(t) for t in range(0, 60, 10)], path)
+        assert obc_utils.get_wod_rollup(path).rollup(60, 1)[0].count == 6
+
+        append_in_other_process(path, range(60, 120, 10))
+        buckets = obc_utils.get_wod_rollup(path).rollup(60, 2)
+        assert [(b.start, b.count) for b in buckets] == [(0, 6), (60, 6)]
+
+        # Samples logged here are counted once
+        obc_utils.log_wod_batch([sample(120)], path)
+        assert obc_utils.get_wod_rollup(path).rollup(60, 1)[0].count == 1
+
+        WodStore(path).clear()
+        assert obc_utils.get_wod_rollup(path).rollup(60, 1) == []
+    finally:
+        obc_utils.clear_wod(path)
+        obc_utils.wod_stores.pop(path).close()
@@ -0,0 +1,120 @@
+'''
+Ground station WOD decoding and the dataset every downlinked WOD is added to.
+
+A downlinked WOD is a uint32 time followed by 32 rows of 8 uint8 readings, one row per minute.
+decode_wod turns one or many of them into a NumPy structured array of rows in one call.
+
+The dataset keeps every row received, in wod.csv for spreadsheets and in a binary file of
+WOD_ROW records (after a small header) that loads straight into a NumPy array.
+
+Usage: python wod_dataset.py [export.npz]
+'''
+
+import os
+import sys
+import time
+import numpy as np
+
+WOD_FIELDS = ['time', 'mode', 'bat_voltage', 'bat_current', 'bus_3v_current',
+              'bus_5v_current', 'temp_comm', 'temp_eps', 'temp_battery']
+WOD_ROWS = 32
+WOD_ROW_INTERVAL = 60
+
+# A downlinked WOD
+WOD_BLOB = np.dtype([('time', '<u4'), ('readings', 'u1', (WOD_ROWS, 8))])
+# One row of the dataset
+WOD_ROW = np.dtype([('time', '<u4')] + [(field, 'u1') for field in WOD_FIELDS[1:]])
+
+DATASET_MAGIC = b'WODD'
+DATASET_VERSION = 1
+DATASET_HEADER = np.dtype([('magic', 'S4'), ('version', 'u1'), ('row_size', 'u1')])
+
+
+def decode_wod(blobs) -> np.ndarray:
+    '''
+        Rows of one WOD (bytes) or many (a list of bytes), as a WOD_ROW array.
+        Anything after the WOD in each blob, such as padding in the last packet, is ignored
+    '''
+    if isinstance(blobs, (bytes, bytearray, memoryview)):
+        blobs = [blobs]
+    data = b''.join(bytes(blob[:WOD_BLOB.itemsize]) for blob in blobs)
+    wods = np.frombuffer(data, dtype=WOD_BLOB)
+
+    rows = np.empty(len(wods) * WOD_ROWS, dtype=WOD_ROW)
+    # Each row is one minute after the previous
+    rows['time'] = (wods['time'][:, None] + WOD_ROW_INTERVAL *
+                    np.arange(WOD_ROWS, dtype='<u4')).ravel()
+    readings = wods['readings'].reshape(-1, 8)
+    for i, field in enumerate(WOD_FIELDS[1:]):
+        rows[field] = readings[:, i]
+    # The mode should only be 0 or 1, anything else is invalid
+    rows['mode'][rows['mode'] > 1] = 0
+    return rows
+
+
+class WodDataset:
+    def __init__(self, csv_path='wod.csv', binary_path='wod_dataset.bin') -> None:
+        self.csv_path = csv_path
+        self.binary_path = binary_path
+
+    def append(self, rows: np.ndarray):
+        '''Add decoded rows to the end of both files'''
+        new_csv = not os.path.isfile(self.csv_path)
+        with open(self.csv_path, 'a', newline='') as file:
+            if new_csv:
+                file.write(','.join(WOD_FIELDS) + '\n')
+            np.savetxt(file, _row_table(rows), fmt='%d', delimiter=',')
+
+        new_binary = not os.path.isfile(self.binary_path)
+        with open(self.binary_path, 'ab') as file:
+            if new_binary:
+                header = np.array(
+                    [(DATASET_MAGIC, DATASET_VERSION, WOD_ROW.itemsize)], dtype=DATASET_HEADER)
+                file.write(header.tobytes())
+            file.write(rows.tobytes())
+
+    def load(self, unique=True) -> np.ndarray:
+        '''
+            Every row received as a WOD_ROW array, sorted by time.
+            unique drops rows received more than once (eg. the same WOD requested twice), keeping the latest
+        '''
+        if not os.path.isfile(self.binary_path):
+            return np.empty(0, dtype=WOD_ROW)
+        header = np.fromfile(self.binary_path, dtype=DATASET_HEADER, count=1)
+        if (len(header) == 0 or header['magic'][0] != DATASET_MAGIC or header['version'][0] != DATASET_VERSION
+                or header['row_size'][0] != WOD_ROW.itemsize):
+            raise ValueError(f"{self.binary_path} is not a version {DATASET_VERSION} WOD dataset")
+        size = os.path.getsize(self.binary_path) - DATASET_HEADER.itemsize
+        rows = np.fromfile(self.binary_path, dtype=WOD_ROW, count=size // WOD_ROW.itemsize,
+                           offset=DATASET_HEADER.itemsize)
+        if unique:
+            # Reverse so np.unique keeps the last copy of each time
+            times, index = np.unique(rows['time'][::-1], return_index=True)
+            return rows[::-1][index]
+        return rows[np.argsort(rows['time'], kind='stable')]
+
+    def export_npz(self, path: str):
+        '''Save the dataset as one array per field'''
+        rows = self.load()
+        np.savez_compressed(path, **{field: rows[field] for field in WOD_FIELDS})
+
+
+def _row_table(rows: np.ndarray) -> np.ndarray:
+    # Plain 2D table of the rows for np.savetxt
+    return np.column_stack([rows[field].astype(np.int64) for field in WOD_FIELDS])
+
+
+def main():
+    dataset = WodDataset()
+    start = time.perf_counter()
+    rows = dataset.load()
+    print(f'Loaded {len(rows)} rows in {(time.perf_counter() - start) * 1000:.1f}ms')
+    if len(rows):
+        print(f'First row time {rows["time"][0]}, last row time {rows["time"][-1]}')
+    if len(sys.argv) > 1:
+        dataset.export_npz(sys.argv[1])
+        print(f'Exported to {sys.argv[1]}')
+
+
+if __name__ == '__main__':
+    main()
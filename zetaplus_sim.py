@@ -0,0 +1,422 @@
+'''
+Simulated ZetaPlus transceivers, for running the CubeSat and ground station software
+without hardware.
+
+SimSerial is an in-memory stand-in for serial.Serial (in_waiting, read, readline, write,
+flush, out_waiting) whose writes take as long to drain as they would at its baud rate.
+
+SimulatedZetaPlus sits behind a SimSerial and understands the same ATS/ATR/ATM commands
+as the real transceiver. Packets sent with ATS go over a SimulatedLink, with configurable
+RF bitrate, latency and loss, and arrive at every other transceiver on the same channel
+with the '#R', length, RSSI header in front.
+
+GroundStationSim emulates GroundStation.ino: text commands from the PC are turned into
+ground station command packets, and received packets are printed to the PC serial in the
+same format the arduino uses, so the SerialTest.py decoders can read them.
+
+Example:
+    link = SimulatedLink(latency=0.01, loss=0.05)
+    obc = OBCCommunication(ser=SimulatedZetaPlus(link).host)
+    ground = GroundStationSim(SimulatedZetaPlus(link))
+    ground.start()
+    ground.pc.write(b'ping\\n')
+'''
+
+import heapq
+import itertools
+import math
+import random
+import struct
+import threading
+import time
+from obc_framing import FrameReassembler
+
+# Bits on the UART per byte, 8N1
+UART_BITS_PER_BYTE = 10
+
+
+class SimSerial:
+    '''In-memory serial port. Data written is passed to on_write(data, time the last byte leaves the UART)'''
+
+    def __init__(self, baudrate=19200, timeout=2, on_write=None) -> None:
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.on_write = on_write
+        self.is_open = True
+        self.condition = threading.Condition()
+        # Heap of (arrival time, sequence, data) still in flight to this port
+        self.incoming = []
+        self.sequence = itertools.count()
+        self.rx_buffer = bytearray()
+        # When the last byte written will have left the UART
+        self.tx_done = 0.0
+
+    def byte_time(self, n_bytes: int) -> float:
+        return n_bytes * UART_BITS_PER_BYTE / self.baudrate
+
+    def deliver(self, data: bytes, at: float):
+        '''Make data readable from this port at time at (time.monotonic)'''
+        with self.condition:
+            heapq.heappush(self.incoming, (at, next(self.sequence), data))
+            self.condition.notify_all()
+
+    def _arrive(self):
+        # Must hold self.condition
+        now = time.monotonic()
+        while self.incoming and self.incoming[0][0] <= now:
+            self.rx_buffer += heapq.heappop(self.incoming)[2]
+
+    def _wait(self, ready, timeout):
+        '''Wait until ready() or the timeout, must hold self.condition'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._arrive()
+            if ready() or not self.is_open:
+                return
+            now = time.monotonic()
+            wake = deadline
+            if self.incoming:
+                wake = self.incoming[0][0] if wake is None else min(
+                    wake, self.incoming[0][0])
+            if deadline is not None and now >= deadline:
+                return
+            self.condition.wait(None if wake is None else max(wake - now, 0))
+
+    @property
+    def in_waiting(self) -> int:
+        with self.condition:
+            self._arrive()
+            return len(self.rx_buffer)
+
+    def read(self, size=1) -> bytes:
+        with self.condition:
+            self._wait(lambda: len(self.rx_buffer) >= size, self.timeout)
+            data = bytes(self.rx_buffer[:size])
+            del self.rx_buffer[:size]
+            return data
+
+    def readline(self) -> bytes:
+        with self.condition:
+            self._wait(lambda: b'\n' in self.rx_buffer, self.timeout)
+            end = self.rx_buffer.find(b'\n') + 1 or len(self.rx_buffer)
+            data = bytes(self.rx_buffer[:end])
+            del self.rx_buffer[:end]
+            return data
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        with self.condition:
+            start = max(time.monotonic(), self.tx_done)
+            self.tx_done = start + self.byte_time(len(data))
+            done = self.tx_done
+        if self.on_write:
+            self.on_write(data, done)
+        return len(data)
+
+    @property
+    def out_waiting(self) -> int:
+        remaining = self.tx_done - time.monotonic()
+        return max(0, math.ceil(remaining * self.baudrate / UART_BITS_PER_BYTE))
+
+    def flush(self):
+        remaining = self.tx_done - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self.incoming.clear()
+            self.rx_buffer.clear()
+
+    def close(self):
+        with self.condition:
+            self.is_open = False
+            self.condition.notify_all()
+
+
+def serial_pair(baudrate=115200, timeout=2) -> tuple:
+    '''Two SimSerial ports wired to each other, like a USB serial cable'''
+    a = SimSerial(baudrate, timeout)
+    b = SimSerial(baudrate, timeout)
+    a.on_write = b.deliver
+    b.on_write = a.deliver
+    return a, b
+
+
+class SimulatedLink:
+    '''The RF link shared by all simulated transceivers'''
+
+    def __init__(self, rf_bitrate=38400, latency=0.005, loss=0.0, rssi=150, seed=None) -> None:
+        '''
+            rf_bitrate: bits/s between transceivers
+            latency: seconds added to every packet on top of its airtime
+            loss: probability of each packet being lost
+            rssi: signal strength reported in the '#R' header
+        '''
+        self.rf_bitrate = rf_bitrate
+        self.latency = latency
+        self.loss = loss
+        self.rssi = rssi
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.transceivers = []
+        self.packets_sent = 0
+        self.packets_lost = 0
+
+    def airtime(self, n_bytes: int) -> float:
+        return n_bytes * 8 / self.rf_bitrate
+
+    def transmit(self, sender, channel: int, data: bytes, at: float):
+        with self.lock:
+            # Transceivers are half duplex, one packet on air at a time
+            start = max(at, sender.radio_free)
+            sender.radio_free = start + self.airtime(len(data))
+            arrival = sender.radio_free + self.latency
+            self.packets_sent += 1
+            receivers = []
+            for transceiver in self.transceivers:
+                if transceiver is sender or transceiver.channel != channel or transceiver.mode == SimulatedZetaPlus.SLEEP:
+                    continue
+                if self.random.random() < self.loss:
+                    self.packets_lost += 1
+                    continue
+                receivers.append(transceiver)
+
+        frame = b'#R' + struct.pack('BB', len(data), self.rssi) + data
+        for transceiver in receivers:
+            host = transceiver.host
+            host.deliver(frame, arrival + host.byte_time(len(frame)))
+
+
+class SimulatedZetaPlus:
+    '''A ZetaPlus transceiver, the host (CubeSat or arduino) talks to it through self.host'''
+
+    RX = 1
+    DEFAULT = 2
+    SLEEP = 3
+
+    # Number of argument bytes after each AT command, ATS also has its packet contents
+    COMMAND_ARGS = {b'S': 2, b'R': 2, b'M': 1, b'C': 1, b'Q': 0, b'?': 0}
+
+    def __init__(self, link: SimulatedLink, baudrate=19200, timeout=2) -> None:
+        self.link = link
+        self.host = SimSerial(baudrate, timeout, self.from_host)
+        self.channel = 0
+        self.packet_length = 64
+        self.mode = SimulatedZetaPlus.DEFAULT
+        self.radio_free = 0.0
+        self.command_buffer = bytearray()
+        link.transceivers.append(self)
+
+    def from_host(self, data: bytes, at: float):
+        '''Parse AT commands written by the host'''
+        buffer = self.command_buffer
+        buffer += data
+        while True:
+            start = buffer.find(b'AT')
+            if start == -1:
+                # Keep a trailing 'A' in case the 'T' is still to come
+                del buffer[:len(buffer) - 1 if buffer.endswith(b'A') else len(buffer)]
+                return
+            del buffer[:start]
+            if len(buffer) < 3:
+                return
+            command = bytes(buffer[2:3])
+            n_args = SimulatedZetaPlus.COMMAND_ARGS.get(command)
+            if n_args is None:
+                del buffer[:1]
+                continue
+            if len(buffer) < 3 + n_args:
+                return
+            args = buffer[3:3 + n_args]
+            if command == b'S':
+                channel, length = args
+                if len(buffer) < 5 + length:
+                    return
+                self.link.transmit(self, channel, bytes(
+                    buffer[5:5 + length]), at)
+                del buffer[:5 + length]
+                continue
+            if command == b'R':
+                self.channel, self.packet_length = args
+            elif command == b'M':
+                self.mode = args[0]
+            del buffer[:3 + n_args]
+
+
+class GroundStationSim:
+    '''
+        Emulates GroundStation.ino between the PC (self.pc) and a SimulatedZetaPlus.
+        additional_packets_timeout matches the arduino's 1s wait for more information packets,
+        lower it to speed up simulations.
+    '''
+
+    # Message and command types, see GroundStation.ino
+    WOD = 1
+    SCIENCE_IMAGE = 2
+    SCIENCE_THERMO_AND_CURRENT = 3
+    GROUND_STATION_COMMAND = 4
+    TIME = 5
+    PONG = 6
+    DEBUG = 7
+    WOD_ROLLUP = 8
+    TIME_SYNC = 9
+
+    def __init__(self, transceiver: SimulatedZetaPlus, pc_baudrate=115200, additional_packets_timeout=1.0,
+                 my_address=b'USYD', target_address=b'CUBE', channel=0) -> None:
+        self.transceiver = transceiver
+        self.rf = transceiver.host
+        self.rf.timeout = 0
+        # self.pc is the end the PC (SerialTest.py) uses, self.serial is the arduino's end
+        self.pc, self.serial = serial_pair(pc_baudrate, timeout=5)
+        self.serial.timeout = 0
+        self.additional_packets_timeout = additional_packets_timeout
+        self.my_address = my_address
+        self.target_address = target_address
+        self.channel = channel
+        self.reassembler = FrameReassembler()
+        self.current_time = 0
+        # Name of the message whose additional packets are being received, or None
+        self.additional_packets = None
+        # Downlink credits are granted every credit_window / 2 additional packets, 0 grants none
+        self.credit_window = 0
+        self.packets_since_grant = 0
+        self.last_packet_time = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.rf.write(b'ATR' + struct.pack('BB', self.channel, 64))
+        self.rf.write(b'ATM' + struct.pack('B', 1))
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def println(self, text=''):
+        self.serial.write(text.encode() + b'\r\n')
+
+    def run(self):
+        command_line = bytearray()
+        while self.running:
+            # The arduino doesn't look at the PC serial while receiving additional packets
+            if self.additional_packets is None and self.serial.in_waiting:
+                command_line += self.serial.read(self.serial.in_waiting)
+                while b'\n' in command_line:
+                    end = command_line.index(b'\n')
+                    self.send_user_command(
+                        command_line[:end].decode(errors='ignore').strip())
+                    del command_line[:end + 1]
+
+            if self.rf.in_waiting:
+                for frame in self.reassembler.feed(self.rf.read(self.rf.in_waiting)):
+                    self.receive(frame.payload, frame.packet_length,
+                                 frame.signal_strength)
+
+            if self.additional_packets is not None and time.monotonic() - self.last_packet_time > self.additional_packets_timeout:
+                self.println()
+                self.println(f'<{self.additional_packets}/>')
+                self.println('Finished processing all additional packets.')
+                self.additional_packets = None
+            time.sleep(0.0005)
+
+    def transmit(self, contents: bytes):
+        packet = (self.target_address + contents).ljust(64, b'\x00')[:64]
+        self.rf.write(b'ATS' + struct.pack('BB', 0, 64) + packet)
+
+    def send_command(self, command_type: int, args: bytes = b''):
+        self.transmit(struct.pack('BB', GroundStationSim.GROUND_STATION_COMMAND, command_type) + args)
+
+    def send_user_command(self, command: str):
+        args = command.split()
+        if not args:
+            return
+        if args[0] == 'raw' and len(args) == 2:
+            self.println('Sending raw packet')
+            self.transmit(bytes.fromhex(args[1])[:60])
+        elif args[0] == 'setchannel' and len(args) == 2:
+            self.channel = int(args[1])
+            self.println(f'Receiving on channel {self.channel}')
+            self.rf.write(b'ATR' + struct.pack('BB', self.channel, 64))
+        elif args[0] == 'creditwindow' and len(args) == 2:
+            self.credit_window = int(args[1])
+            self.println(f'Credit window: {self.credit_window} packets')
+            self.send_command(16, struct.pack('<H', self.credit_window))
+        elif command == 'ping':
+            self.println('Sending Ping')
+            self.send_command(4)
+        elif command == 'wod':
+            self.println('Requesting WOD')
+            self.send_command(1)
+        elif command == 'clearstorage':
+            self.send_command(8)
+        elif command == 'payloadstrike':
+            self.send_command(9)
+        elif command == 'sciencemeasurement':
+            self.send_command(10)
+        elif command == 'gettime':
+            self.println('Requesting Time')
+            self.send_command(5)
+        elif args[0] == 'settime' and len(args) == 2:
+            self.current_time = int(args[1])
+            self.send_command(6, struct.pack('<I', self.current_time))
+        elif args[0] == 'getimg' and len(args) in (5, 7, 9):
+            timestamp, camera, resume, count, compression, level, ordering, passes = map(
+                int, args[1:] + ['0'] * (9 - len(args)))
+            self.send_command(2, struct.pack(
+                '<bhhiBBBB', camera, resume, count, timestamp, compression, level, ordering, passes))
+        elif args[0] == 'getsciencereading' and len(args) == 2:
+            self.send_command(3, struct.pack('<I', int(args[1])))
+        else:
+            self.println(f'Invalid command: {command}')
+
+    def receive(self, data: bytes, packet_length: int, rssi: int):
+        if self.additional_packets is not None:
+            # The arduino prints the 64 bytes after the '#R' header of every packet as is
+            self.serial.write(data.ljust(64, b'\x00')[:64])
+            self.last_packet_time = time.monotonic()
+            if self.credit_window:
+                self.packets_since_grant += 1
+                grant = max(self.credit_window // 2, 1)
+                if self.packets_since_grant >= grant:
+                    self.send_command(11, struct.pack('<H', grant))
+                    self.packets_since_grant = 0
+            return
+
+        self.serial.write(
+            f'New Received - length:{packet_length}, RSSI:{rssi}, Data:\r\n'.encode() + data + b'\r\n')
+        if data[:4] != self.my_address:
+            self.println(
+                f'Received a message with incorrect ID: {data[:4].decode(errors="ignore")}')
+            return
+        msg_type = data[4]
+        if msg_type == GroundStationSim.WOD:
+            self.println('Receiving WOD message')
+            self.begin_additional_packets('WOD Message')
+        elif msg_type == GroundStationSim.SCIENCE_IMAGE:
+            self.println('Receiving SCIENCE IMAGE message')
+            self.begin_additional_packets('Science Image')
+        elif msg_type == GroundStationSim.WOD_ROLLUP:
+            self.println('Receiving WOD ROLLUP message')
+            self.begin_additional_packets('WOD Rollup')
+        elif msg_type == GroundStationSim.TIME:
+            self.println('Received current time from CubeSat')
+        elif msg_type == GroundStationSim.PONG:
+            self.println('Received PONG message')
+        elif msg_type == GroundStationSim.TIME_SYNC:
+            self.println('Received TIME SYNC message')
+        elif msg_type == GroundStationSim.DEBUG:
+            self.println('Received DEBUG message')
+            self.println(data[5:].rstrip(b'\x00').decode(errors='ignore'))
+        else:
+            self.println('Unknown message type received')
+
+    def begin_additional_packets(self, name: str):
+        self.println(f'<{name}>')
+        self.additional_packets = name
+        self.last_packet_time = time.monotonic()
+        self.packets_since_grant = 0